@@ -0,0 +1,422 @@
+import os
+import time
+import threading
+import importlib.util
+import pandas as pd
+from archive import get_archive_version, INVOICES_PATH, DETAILS_PATH, PAYMENTS_PATH
+from sync import SYNC_TABLES, SETTLE_WINDOW, sync_horizon, needs_full_reload, pull_changes
+
+# duckdb is imported on first use so pages that never report don't pay for it;
+# without it reports fall back to querying Supabase directly
+DUCKDB_AVAILABLE = importlib.util.find_spec('duckdb') is not None
+
+# 'duckdb' answers report queries from a local columnar snapshot, 'postgrest' disables it
+ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'duckdb')
+# ':memory:' keeps one snapshot per process; a file path persists it across restarts
+ANALYTICS_DB = os.getenv('ANALYTICS_DB', ':memory:')
+REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '60'))
+OPEN_STATUSES = ('Unpaid', 'Partially Paid')
+# A payment counts towards the 'New' segment within this many days of the
+# customer's first invoice, 'Returning' after
+NEW_CUSTOMER_DAYS = 90
+# Revenue cube dimensions: report name -> cube column
+CUBE_DIMENSIONS = {'service': 'servicename', 'method': 'paymentmethod', 'segment': 'segment'}
+CUBE_PERIODS = ('day', 'week', 'month', 'quarter', 'year')
+# RFM scores are quintiles, 1 (worst) to 5 (best); lifetime value projects a
+# customer's yearly spend so far over this many years
+RFM_BUCKETS = 5
+LTV_YEARS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    customerid INTEGER PRIMARY KEY,
+    customername VARCHAR
+);
+CREATE TABLE IF NOT EXISTS services (
+    serviceid INTEGER PRIMARY KEY,
+    servicename VARCHAR,
+    unitprice DOUBLE
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    invoiceid INTEGER PRIMARY KEY,
+    customerid INTEGER,
+    invoicedate DATE,
+    totalamount DOUBLE,
+    taxamount DOUBLE,
+    grandtotal DOUBLE,
+    amountpaid DOUBLE,
+    status VARCHAR
+);
+CREATE TABLE IF NOT EXISTS invoicedetails (
+    invoiceid INTEGER,
+    serviceid INTEGER,
+    quantity INTEGER,
+    totalprice DOUBLE,
+    PRIMARY KEY (invoiceid, serviceid)
+);
+CREATE TABLE IF NOT EXISTS payments (
+    paymentid INTEGER PRIMARY KEY,
+    invoiceid INTEGER,
+    paymentdate DATE,
+    paymentmethod VARCHAR,
+    amountpaid DOUBLE
+);
+CREATE TABLE IF NOT EXISTS snapshot_meta (
+    key VARCHAR PRIMARY KEY,
+    value VARCHAR
+);
+"""
+
+# Per table: columns pulled from Supabase, and how they land in the snapshot
+SNAPSHOT_TABLES = {
+    'customers': ('customerid, customername', 'customerid, customername'),
+    'services': ('serviceid, servicename, unitprice', 'serviceid, servicename, unitprice'),
+    'invoices': (
+        'invoiceid, customerid, invoicedate, totalamount, taxamount, grandtotal, amountpaid, status',
+        """invoiceid, customerid, CAST(substr(invoicedate, 1, 10) AS DATE), totalamount, taxamount,
+           grandtotal, amountpaid, status"""
+    ),
+    'invoicedetails': ('invoiceid, serviceid, quantity, totalprice', 'invoiceid, serviceid, quantity, totalprice'),
+    'payments': (
+        'paymentid, invoiceid, paymentdate, paymentmethod, amountpaid',
+        'paymentid, invoiceid, CAST(substr(paymentdate, 1, 10) AS DATE), paymentmethod, amountpaid'
+    )
+}
+
+_connection = None
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+
+def enabled():
+    return DUCKDB_AVAILABLE and ANALYTICS_BACKEND == 'duckdb'
+
+def _db():
+    global _connection
+    if _connection is None:
+        import duckdb
+        _connection = duckdb.connect(ANALYTICS_DB)
+        _connection.execute(SCHEMA)
+    # Each caller gets its own cursor; Streamlit sessions run on separate threads
+    return _connection.cursor()
+
+# ======================
+# SNAPSHOT REFRESH
+# ======================
+def _upsert(con, table, rows, select='*'):
+    if not rows:
+        return
+    incoming = pd.DataFrame(rows)
+    con.register('incoming', incoming)
+    try:
+        con.execute(f"INSERT OR REPLACE INTO {table} SELECT {select} FROM incoming")
+    finally:
+        con.unregister('incoming')
+
+# Archived tables: their rows are purged from Supabase once they are in the archive
+ARCHIVE_PATHS = {'invoices': INVOICES_PATH, 'invoicedetails': DETAILS_PATH, 'payments': PAYMENTS_PATH}
+
+def _archived_keys(con, table, keys):
+    """The keys among keys whose rows are in the archive, as tuples"""
+    path = ARCHIVE_PATHS.get(table)
+    if path is None or not os.path.exists(path):
+        return set()
+    columns = ', '.join(SYNC_TABLES[table])
+    con.register('deleted', pd.DataFrame(keys)[SYNC_TABLES[table]])
+    try:
+        return set(con.execute(f"""
+            SELECT {columns}
+            FROM read_parquet('{path}/**/*.parquet', hive_partitioning = true)
+            SEMI JOIN deleted USING ({columns})
+        """).fetchall())
+    finally:
+        con.unregister('deleted')
+
+def _delete(con, table, keys):
+    if not keys:
+        return
+    columns = SYNC_TABLES[table]
+    # An archive run's purge tombstones can arrive in a later pull than its
+    # manifest (they wait for the sync horizon), after the archive is loaded;
+    # the rows they name now live in the archive, so the snapshot keeps them
+    archived = _archived_keys(con, table, keys)
+    keys = [key for key in keys if tuple(key[c] for c in columns) not in archived]
+    if not keys:
+        return
+    condition = ' AND '.join(f"{column} = ?" for column in columns)
+    con.executemany(f"DELETE FROM {table} WHERE {condition}", [[key[c] for c in columns] for key in keys])
+
+def _get_meta(con, key):
+    row = con.execute("SELECT value FROM snapshot_meta WHERE key = ?", [key]).fetchone()
+    return row[0] if row else None
+
+def _set_meta(con, key, value):
+    con.execute("INSERT OR REPLACE INTO snapshot_meta VALUES (?, ?)", [key, value])
+
+def _load_archive(con):
+    # Archived rows only need loading after an archive run; tombstones for
+    # them, whenever they arrive, leave them in place (see _delete)
+    archive_version = get_archive_version()
+    if not archive_version or _get_meta(con, 'archive_version') == archive_version:
+        return False
+    if os.path.exists(INVOICES_PATH):
+        con.execute(f"""
+            INSERT OR IGNORE INTO invoices
+            SELECT invoiceid, customerid, CAST(substr(invoicedate, 1, 10) AS DATE), totalamount, taxamount,
+                   grandtotal, grandtotal, status
+            FROM read_parquet('{INVOICES_PATH}/**/*.parquet', hive_partitioning = true)
+        """)
+    if os.path.exists(DETAILS_PATH):
+        con.execute(f"""
+            INSERT OR IGNORE INTO invoicedetails
+            SELECT invoiceid, serviceid, quantity, totalprice
+            FROM read_parquet('{DETAILS_PATH}/**/*.parquet', hive_partitioning = true)
+        """)
+    if os.path.exists(PAYMENTS_PATH):
+        con.execute(f"""
+            INSERT OR IGNORE INTO payments
+            SELECT paymentid, invoiceid, CAST(substr(paymentdate, 1, 10) AS DATE), paymentmethod, amountpaid
+            FROM read_parquet('{PAYMENTS_PATH}/**/*.parquet', hive_partitioning = true)
+        """)
+    _set_meta(con, 'archive_version', archive_version)
+    return True
+
+def _build_cube(con):
+    # Revenue per day x service x payment method x customer segment. A payment
+    # is spread over its invoice's services in proportion to their line totals,
+    # so every rollup of the cube adds up to the payments it came from.
+    con.execute(f"""
+        CREATE OR REPLACE TABLE revenue_cube AS
+        WITH first_invoice AS (
+            SELECT customerid, MIN(invoicedate) AS first_date
+            FROM invoices
+            GROUP BY customerid
+        ),
+        lines AS (
+            SELECT invoiceid,
+                   serviceid,
+                   COALESCE(totalprice / NULLIF(SUM(totalprice) OVER (PARTITION BY invoiceid), 0),
+                            1.0 / COUNT(*) OVER (PARTITION BY invoiceid)) AS share
+            FROM invoicedetails
+        )
+        SELECT p.paymentdate AS day,
+               COALESCE(s.servicename, 'Unassigned') AS servicename,
+               COALESCE(p.paymentmethod, 'Unknown') AS paymentmethod,
+               CASE WHEN f.first_date IS NULL THEN 'Unknown'
+                    WHEN p.paymentdate - f.first_date < {NEW_CUSTOMER_DAYS} THEN 'New'
+                    ELSE 'Returning' END AS segment,
+               SUM(p.amountpaid * COALESCE(l.share, 1)) AS revenue,
+               COUNT(DISTINCT p.paymentid) AS payment_count
+        FROM payments p
+        LEFT JOIN invoices i ON i.invoiceid = p.invoiceid
+        LEFT JOIN first_invoice f ON f.customerid = i.customerid
+        LEFT JOIN lines l ON l.invoiceid = p.invoiceid
+        LEFT JOIN services s ON s.serviceid = l.serviceid
+        GROUP BY ALL
+    """)
+
+def refresh_snapshot(force=False):
+    """Bring the local snapshot up to date with Supabase.
+
+    Pulls only the rows changed and deleted since the snapshot's watermark
+    (see sync.py), so refreshing an up-to-date snapshot transfers no rows.
+    Runs at most once per REFRESH_SECONDS per process unless forced.
+    """
+    global _last_refresh
+    with _refresh_lock:
+        if not force and time.time() - _last_refresh < REFRESH_SECONDS:
+            return
+        con = _db()
+        watermark = _get_meta(con, 'watermark')
+        horizon = sync_horizon()
+
+        if needs_full_reload(watermark):
+            for table in SNAPSHOT_TABLES:
+                con.execute(f"DELETE FROM {table}")
+            con.execute("DELETE FROM snapshot_meta")
+            watermark = None
+
+        changed = False
+        for table, (columns, select) in SNAPSHOT_TABLES.items():
+            rows, deleted = pull_changes(table, watermark, horizon, columns)
+            _upsert(con, table, rows, select)
+            _delete(con, table, deleted)
+            changed = changed or bool(rows) or bool(deleted)
+
+        changed = _load_archive(con) or changed
+        # The cube is rebuilt in one statement, and only when something changed
+        if changed or _get_meta(con, 'cube_built') is None:
+            _build_cube(con)
+            _set_meta(con, 'cube_built', horizon)
+        _set_meta(con, 'watermark', horizon)
+        _last_refresh = time.time()
+
+def mark_stale():
+    """Refresh on the first query after a local write has settled (see sync.SETTLE_WINDOW).
+
+    Only the changed rows are pulled, so this is cheap; writes from other
+    processes still show up within REFRESH_SECONDS.
+    """
+    global _last_refresh
+    _last_refresh = min(_last_refresh, time.time() - REFRESH_SECONDS + SETTLE_WINDOW.total_seconds())
+
+# ======================
+# REPORT QUERIES
+# ======================
+def get_service_performance(start_date, end_date):
+    refresh_snapshot()
+    df = _db().execute("""
+        SELECT s.serviceid,
+               s.servicename,
+               COUNT(i.invoiceid) AS usage_count,
+               COALESCE(SUM(d.totalprice) FILTER (WHERE i.invoiceid IS NOT NULL), 0) AS total_revenue
+        FROM services s
+        LEFT JOIN invoicedetails d ON d.serviceid = s.serviceid
+        LEFT JOIN invoices i
+            ON i.invoiceid = d.invoiceid
+           AND i.invoicedate BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+        GROUP BY s.serviceid, s.servicename
+        ORDER BY total_revenue DESC
+    """, [start_date, end_date]).df()
+    return df.to_dict('records')
+
+def get_report_data(start_date, end_date):
+    refresh_snapshot()
+    con = _db()
+    invoices = con.execute("""
+        SELECT i.invoiceid,
+               strftime(i.invoicedate, '%Y-%m-%d') AS invoicedate,
+               COALESCE(c.customername, 'Unknown') AS customername,
+               i.grandtotal,
+               i.grandtotal - i.amountpaid AS balancedue,
+               i.status
+        FROM invoices i
+        LEFT JOIN customers c ON c.customerid = i.customerid
+        WHERE i.invoicedate BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+        ORDER BY i.invoicedate, i.invoiceid
+    """, [start_date, end_date]).df()
+    payments = con.execute("""
+        SELECT p.paymentid,
+               p.invoiceid,
+               strftime(p.paymentdate, '%Y-%m-%d') AS paymentdate,
+               COALESCE(c.customername, 'Unknown') AS customername,
+               p.amountpaid
+        FROM payments p
+        LEFT JOIN invoices i ON i.invoiceid = p.invoiceid
+        LEFT JOIN customers c ON c.customerid = i.customerid
+        WHERE p.paymentdate BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+        ORDER BY p.paymentdate, p.paymentid
+    """, [start_date, end_date]).df()
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_revenue': float(payments['amountpaid'].sum()),
+        'total_outstanding': float(invoices.loc[invoices['status'].isin(OPEN_STATUSES), 'balancedue'].sum()),
+        'invoices': invoices.to_dict('records'),
+        'payments': payments.to_dict('records'),
+        'service_performance': get_service_performance(start_date, end_date)
+    }
+
+def get_revenue_by_period(period_type, start_date, end_date, group_by=None, filters=None):
+    """Revenue per period_type (see CUBE_PERIODS), rolled up from the revenue cube.
+
+    group_by names one of CUBE_DIMENSIONS to split each period by; filters maps
+    dimension names to the values to keep.
+    """
+    if period_type not in CUBE_PERIODS:
+        raise ValueError(f"Unknown period: {period_type}")
+    refresh_snapshot()
+    select = ''
+    if group_by:
+        select = f"{CUBE_DIMENSIONS[group_by]} AS {group_by}, "
+    conditions = ['day BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)']
+    params = [period_type, start_date, end_date]
+    for dimension, values in (filters or {}).items():
+        if values:
+            conditions.append(f"{CUBE_DIMENSIONS[dimension]} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    # date_trunc('week') starts weeks on Monday, as the PostgREST path does
+    df = _db().execute(f"""
+        SELECT strftime(date_trunc(?, day), '%Y-%m-%d') AS period_start,
+               {select}SUM(revenue) AS total_revenue
+        FROM revenue_cube
+        WHERE {' AND '.join(conditions)}
+        GROUP BY ALL
+        ORDER BY ALL
+    """, params).df()
+    return df.to_dict('records')
+
+def get_cube_members(dimension):
+    """The values a cube dimension takes, for filter choices"""
+    refresh_snapshot()
+    column = CUBE_DIMENSIONS[dimension]
+    rows = _db().execute(f"SELECT DISTINCT {column} FROM revenue_cube ORDER BY 1").fetchall()
+    return [row[0] for row in rows]
+
+# ======================
+# CUSTOMER SEGMENTS
+# ======================
+def get_customer_rfm(as_of):
+    """Recency, frequency and monetary scores, segment and lifetime value per customer.
+
+    Customers are ranked into RFM_BUCKETS quantiles by their latest invoice,
+    their number of invoices and what they have paid, all in one pass of window
+    functions over the snapshot. Customers without invoices are left out.
+    """
+    refresh_snapshot()
+    df = _db().execute(f"""
+        WITH invoice_stats AS (
+            SELECT customerid,
+                   MIN(invoicedate) AS first_invoice,
+                   MAX(invoicedate) AS last_invoice,
+                   COUNT(*) AS frequency
+            FROM invoices
+            WHERE invoicedate <= CAST($as_of AS DATE)
+            GROUP BY customerid
+        ),
+        paid AS (
+            SELECT i.customerid, SUM(p.amountpaid) AS monetary
+            FROM payments p
+            JOIN invoices i ON i.invoiceid = p.invoiceid
+            WHERE p.paymentdate <= CAST($as_of AS DATE)
+            GROUP BY i.customerid
+        ),
+        scored AS (
+            SELECT s.customerid,
+                   COALESCE(c.customername, 'Unknown') AS customername,
+                   date_diff('day', s.last_invoice, CAST($as_of AS DATE)) AS recency_days,
+                   s.frequency,
+                   COALESCE(p.monetary, 0) AS monetary,
+                   -- At least a year, so one recent visit isn't projected as a monthly habit
+                   GREATEST(date_diff('day', s.first_invoice, CAST($as_of AS DATE)), 365) / 365.0 AS tenure_years,
+                   NTILE({RFM_BUCKETS}) OVER (ORDER BY s.last_invoice, s.customerid) AS r_score,
+                   NTILE({RFM_BUCKETS}) OVER (ORDER BY s.frequency, s.customerid) AS f_score,
+                   NTILE({RFM_BUCKETS}) OVER (ORDER BY COALESCE(p.monetary, 0), s.customerid) AS m_score
+            FROM invoice_stats s
+            LEFT JOIN customers c ON c.customerid = s.customerid
+            LEFT JOIN paid p ON p.customerid = s.customerid
+        )
+        SELECT customerid,
+               customername,
+               recency_days,
+               frequency,
+               monetary,
+               r_score,
+               f_score,
+               m_score,
+               CASE
+                   WHEN r_score >= 4 AND f_score >= 4 THEN 'Champions'
+                   WHEN f_score >= 4 THEN 'Loyal'
+                   WHEN r_score >= 4 AND f_score <= 2 THEN 'New'
+                   WHEN r_score <= 2 AND f_score >= 3 THEN 'At Risk'
+                   WHEN r_score <= 1 THEN 'Lost'
+                   ELSE 'Needs Attention'
+               END AS segment,
+               monetary / tenure_years * {LTV_YEARS} AS lifetime_value
+        FROM scored
+        ORDER BY lifetime_value DESC
+    """, {'as_of': as_of}).df()
+    # Six segments repeat across every row; scores fit in a byte
+    df['segment'] = df['segment'].astype('category')
+    df[['r_score', 'f_score', 'm_score']] = df[['r_score', 'f_score', 'm_score']].astype('int8')
+    return df
@@ -0,0 +1,392 @@
+import os
+import json
+import hmac
+import uuid
+import math
+import hashlib
+import argparse
+import threading
+import time
+import resilience
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from models import LineItem
+from utils import (supabase, create_invoices, log_payments, _load_invoice_details, _load_unpaid_invoices,
+                   _load_services, TAX_RATE)
+
+# Headless JSON API for the POS terminals and the booking site, run next to the
+# Streamlit app (python api.py). It writes through the same functions as the
+# forms, so totals, cache eviction and snapshot refreshes behave the same.
+#
+#   POST /invoices              {"customer_id", "date", "items": [{"service_id", "quantity"}]}
+#   POST /invoices/batch        {"invoices": [...]}, inserted in bulk, all or nothing
+#   POST /payments              {"invoice_id", "date", "method", "amount"}
+#   POST /payments/batch        {"payments": [...]}, inserted in one statement, all or nothing
+#   GET  /invoices/<id>
+#   GET  /invoices/unpaid[?customer_id=]
+#   GET  /jobs/<id>             result of a request sent with Prefer: respond-async
+#
+# Every request but GET /health needs Authorization: Bearer $API_TOKEN. Writes
+# may carry an Idempotency-Key header: retries with the same key and body get
+# the first response back (see migrations/create_api_idempotency_keys.sql).
+# Prices come from the services table and tax from TAX_RATE; clients send
+# quantities only. A new invoice is Unpaid until payments are posted against it.
+
+API_TOKEN = os.getenv('API_TOKEN')
+API_WORKERS = int(os.getenv('API_WORKERS', '8'))
+MAX_BATCH = 5000  # invoices or payments per batch request
+MAX_BODY = 8 * 1024 * 1024
+JOB_TTL = 3600  # seconds a finished async job's result is kept
+RETRY_AFTER = 5  # seconds a client is asked to wait after Supabase failed transiently
+PAYMENT_METHODS = ['Cash', 'Card', 'Online']
+
+class ApiError(Exception):
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+# ======================
+# REQUEST BODIES
+# ======================
+def _parse_date(value):
+    if value is None:
+        return date.today().strftime('%Y-%m-%d')
+    try:
+        return date.fromisoformat(value).strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError("date must be YYYY-MM-DD")
+
+def _positive(value, name, kind=float):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0 or kind(value) != value:
+        raise ValueError(f"{name} must be a positive {'integer' if kind is int else 'number'}")
+    return kind(value)
+
+def _invoice_data(body, services):
+    """create_invoice's invoice_data for an API body, priced from services"""
+    if not isinstance(body, dict):
+        raise ValueError("invoice must be an object")
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+
+    lines = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("each item must be an object")
+        service_id = _positive(item.get('service_id'), 'service_id', int)
+        service = services.get(service_id)
+        if service is None:
+            raise ValueError(f"unknown service_id {service_id}")
+        if service_id in lines:
+            raise ValueError(f"service_id {service_id} appears more than once")
+        quantity = _positive(item.get('quantity', 1), 'quantity', int)
+        lines[service_id] = LineItem(None, service_id, service.servicename, service.unitprice,
+                                     quantity, service.unitprice * quantity)
+
+    if str(body.get('status', 'Unpaid')).capitalize() != 'Unpaid':
+        raise ValueError("a new invoice is Unpaid; post its payments to /payments")
+
+    subtotal = sum(line.totalprice for line in lines.values())
+    tax_amount = subtotal * TAX_RATE
+    return {
+        'customer_id': _positive(body.get('customer_id'), 'customer_id', int),
+        'date': _parse_date(body.get('date')),
+        'services': list(lines.values()),
+        'subtotal': subtotal,
+        'tax': tax_amount,
+        'cgst': tax_amount / 2,
+        'sgst': tax_amount / 2,
+        'grand_total': subtotal + tax_amount
+    }
+
+def _payment_data(body):
+    """log_payment's payment_data for an API body"""
+    if not isinstance(body, dict):
+        raise ValueError("payment must be an object")
+    method = body.get('method', 'Cash')
+    if method not in PAYMENT_METHODS:
+        raise ValueError(f"method must be one of {', '.join(PAYMENT_METHODS)}")
+    return {
+        'invoice_id': _positive(body.get('invoice_id'), 'invoice_id', int),
+        'date': _parse_date(body.get('date')),
+        'method': method,
+        'amount': round(_positive(body.get('amount'), 'amount'), 2)
+    }
+
+def _validate(entries, parse):
+    """Parse every entry, collecting the errors of all of them before failing"""
+    if not isinstance(entries, list) or not entries:
+        raise ApiError(400, "expected a non-empty list")
+    if len(entries) > MAX_BATCH:
+        raise ApiError(413, f"at most {MAX_BATCH} entries per batch")
+    parsed = []
+    errors = []
+    for i, entry in enumerate(entries):
+        try:
+            parsed.append(parse(entry))
+        except ValueError as e:
+            errors.append({'index': i, 'error': str(e)})
+    if errors:
+        raise ApiError(422, "invalid entries", errors)
+    return parsed
+
+# ======================
+# HANDLERS
+# ======================
+def _services():
+    return {service.serviceid: service for service in _load_services()}
+
+def _invoice_summary(invoice_id, invoice_data):
+    return {
+        'invoice_id': invoice_id,
+        'subtotal': round(invoice_data['subtotal'], 2),
+        'tax': round(invoice_data['tax'], 2),
+        'grand_total': round(invoice_data['grand_total'], 2)
+    }
+
+def post_invoices(body, batch):
+    services = _services()
+    entries = [body] if not batch else body.get('invoices') if isinstance(body, dict) else None
+    invoice_list = _validate(entries, lambda entry: _invoice_data(entry, services))
+    invoice_ids = create_invoices(invoice_list)
+    created = [_invoice_summary(i, d) for i, d in zip(invoice_ids, invoice_list)]
+    return 201, {'invoices': created} if batch else created[0]
+
+def post_payments(body, batch):
+    entries = [body] if not batch else body.get('payments') if isinstance(body, dict) else None
+    payment_ids = log_payments(_validate(entries, _payment_data))
+    return 201, {'payment_ids': payment_ids} if batch else {'payment_id': payment_ids[0]}
+
+def get_invoice(invoice_id):
+    invoice = _load_invoice_details(invoice_id)
+    if invoice is None:
+        raise ApiError(404, f"invoice {invoice_id} not found")
+    return 200, invoice
+
+def get_unpaid(customer_id):
+    return 200, {'invoices': _load_unpaid_invoices(customer_id)}
+
+WRITES = {
+    '/invoices': lambda body: post_invoices(body, batch=False),
+    '/invoices/batch': lambda body: post_invoices(body, batch=True),
+    '/payments': lambda body: post_payments(body, batch=False),
+    '/payments/batch': lambda body: post_payments(body, batch=True)
+}
+
+def _run(handler, *args):
+    """(status, body) of a handler, with failures turned into error responses"""
+    try:
+        return handler(*args)
+    except ApiError as e:
+        return e.status, {'error': str(e), **({'details': e.details} if e.details else {})}
+    except resilience.CircuitOpenError as e:
+        # Tell POS clients when to come back rather than have them retry at once
+        return 503, {'error': str(e), 'retry_after': max(1, math.ceil(e.retry_after))}
+    except Exception as e:
+        # Constraint violations (unknown customer or invoice, a payment over the balance
+        # due, see migrations/reject_invoice_overpayments.sql) are the client's
+        code = str(getattr(e, 'code', '') or '')
+        if code.startswith('23'):
+            return 422, {'error': getattr(e, 'message', None) or str(e)}
+        if resilience.is_transient(e):
+            print(f"Supabase unavailable for API request: {str(e)}")
+            return 503, {'error': "database unavailable", 'retry_after': RETRY_AFTER}
+        print(f"Error in API request: {str(e)}")
+        return 500, {'error': "internal error"}
+
+# ======================
+# IDEMPOTENCY KEYS
+# ======================
+def _claim(key, endpoint, request_hash):
+    """Claim key for this request; returns None, or the (status, body) to replay"""
+    try:
+        supabase.table('apiidempotencykeys').insert({
+            'idempotencykey': key,
+            'endpoint': endpoint,
+            'requesthash': request_hash
+        }).execute()
+        return None
+    except Exception as e:
+        if str(getattr(e, 'code', '')) != '23505':  # anything but unique_violation
+            raise
+    response = supabase.table('apiidempotencykeys').select('*').eq(
+        'idempotencykey', key).eq('endpoint', endpoint).execute()
+    if not response.data:
+        # Released by a failed attempt in the meantime
+        return _claim(key, endpoint, request_hash)
+    row = response.data[0]
+    if row['requesthash'] != request_hash:
+        raise ApiError(422, "Idempotency-Key was already used with a different request")
+    if row['statuscode'] is None:
+        raise ApiError(409, "a request with this Idempotency-Key is still in progress")
+    return row['statuscode'], row['responsebody']
+
+def _settle(key, endpoint, status, body):
+    """Store the response to replay, or release the key after a server error so a retry runs again"""
+    query = supabase.table('apiidempotencykeys')
+    if status >= 500:
+        query.delete().eq('idempotencykey', key).eq('endpoint', endpoint).execute()
+    else:
+        query.update({'statuscode': status, 'responsebody': body}).eq(
+            'idempotencykey', key).eq('endpoint', endpoint).execute()
+
+def _write(endpoint, raw_body, key):
+    """Run a write, once per Idempotency-Key"""
+    try:
+        body = json.loads(raw_body or b'null')
+    except ValueError:
+        return 400, {'error': "body must be JSON"}
+    if not key:
+        return _run(WRITES[endpoint], body)
+
+    request_hash = hashlib.sha256(raw_body).hexdigest()
+    replay = _run(_claim, key, endpoint, request_hash)
+    if replay is not None:
+        return replay
+    status, response = _run(WRITES[endpoint], body)
+    try:
+        _settle(key, endpoint, status, response)
+    except Exception as e:
+        print(f"Error storing idempotent response: {str(e)}")
+    return status, response
+
+# ======================
+# ASYNC JOBS
+# ======================
+# Requests sent with Prefer: respond-async are answered 202 straight away and
+# run on a worker pool; GET /jobs/<id> returns the result once there is one.
+# Jobs live in this process only, so a client polls the instance it wrote to.
+_executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='api-job')
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _submit(endpoint, raw_body, key):
+    job_id = uuid.uuid4().hex
+    now = time.monotonic()
+    with _jobs_lock:
+        for old_id in [j for j, job in _jobs.items() if job['finished'] and now - job['finished'] > JOB_TTL]:
+            del _jobs[old_id]
+        _jobs[job_id] = {'status': 'pending', 'finished': None}
+
+    def run():
+        status, response = _write(endpoint, raw_body, key)
+        with _jobs_lock:
+            _jobs[job_id] = {'status': 'done', 'statuscode': status, 'response': response,
+                             'finished': time.monotonic()}
+
+    _executor.submit(run)
+    return job_id
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        raise ApiError(404, f"job {job_id} not found")
+    return 200, {k: v for k, v in job.items() if k != 'finished'}
+
+# ======================
+# HTTP
+# ======================
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, '__slots__'):
+        # Records from models.py
+        return {name: getattr(value, name) for name in value.__slots__}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a terminal sending a stream of requests reuses its connection
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, headers=None):
+        if status == 503 and 'retry_after' in body:
+            headers = {**(headers or {}), 'Retry-After': str(body['retry_after'])}
+        payload = json.dumps(body, default=_json_default).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorized(self):
+        token = self.headers.get('Authorization', '')
+        if API_TOKEN and hmac.compare_digest(token.encode(), f"Bearer {API_TOKEN}".encode()):
+            return True
+        self._send(401, {'error': "missing or wrong bearer token"}, {'WWW-Authenticate': 'Bearer'})
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self.close_connection = True
+            self._send(413, {'error': f"body is over {MAX_BODY} bytes"})
+            return
+        raw_body = self.rfile.read(length)
+        if not self._authorized():
+            return
+        endpoint = urlsplit(self.path).path.rstrip('/')
+        if endpoint not in WRITES:
+            self._send(404, {'error': "not found"})
+            return
+
+        key = self.headers.get('Idempotency-Key')
+        if 'respond-async' in self.headers.get('Prefer', ''):
+            job_id = _submit(endpoint, raw_body, key)
+            self._send(202, {'job_id': job_id, 'status': 'pending'}, {'Location': f"/jobs/{job_id}"})
+            return
+        self._send(*_write(endpoint, raw_body, key))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        # Open to load balancer health checks
+        if parts == ['health']:
+            self._send(200, {'status': 'ok'})
+            return
+        if not self._authorized():
+            return
+        if parts == ['invoices', 'unpaid']:
+            customer_id = parse_qs(url.query).get('customer_id', [None])[0]
+            if customer_id is not None and not customer_id.isdigit():
+                self._send(400, {'error': "customer_id must be an integer"})
+                return
+            self._send(*_run(get_unpaid, int(customer_id) if customer_id else None))
+        elif len(parts) == 2 and parts[0] == 'invoices' and parts[1].isdigit():
+            self._send(*_run(get_invoice, int(parts[1])))
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            self._send(*_run(get_job, parts[1]))
+        else:
+            self._send(404, {'error': "not found"})
+
+    def log_request(self, code='-', size='-'):
+        # Successful requests would flood the log at peak volume
+        if isinstance(code, int) and code < 400:
+            return
+        super().log_request(code, size)
+
+def serve(host, port):
+    if not API_TOKEN:
+        raise SystemExit("Set API_TOKEN before starting the API")
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    print(f"Billing API listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _executor.shutdown(wait=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the invoice and payment ingestion API")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+    args = parser.parse_args()
+    serve(args.host, args.port)
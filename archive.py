@@ -0,0 +1,224 @@
+import os
+import json
+import argparse
+import pandas as pd
+from datetime import datetime, timedelta
+from supabase_config import supabase
+
+# Closed invoices older than this move to the archive
+ARCHIVE_AFTER_DAYS = 730
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+MANIFEST_PATH = os.path.join(ARCHIVE_DIR, 'manifest.json')
+PAGE_SIZE = 1000  # PostgREST's default max rows per response
+ID_CHUNK = 200  # ids per .in_() filter, keeps request URLs short
+
+# One dataset per table, partitioned by year of the row's own date
+INVOICES_PATH = os.path.join(ARCHIVE_DIR, 'invoices')
+DETAILS_PATH = os.path.join(ARCHIVE_DIR, 'invoicedetails')
+PAYMENTS_PATH = os.path.join(ARCHIVE_DIR, 'payments')
+
+# ======================
+# MANIFEST
+# ======================
+def get_archived_before():
+    """Date (YYYY-MM-DD) before which closed invoices live in the archive, or None"""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH) as f:
+        return json.load(f).get('archived_before')
+
+def get_archive_version():
+    """Changes every time an archive run writes, so readers know to reload"""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH) as f:
+        return json.load(f).get('updated_at')
+
+def archive_covers(start_date):
+    """Whether a range starting at start_date reaches back into the archive"""
+    archived_before = get_archived_before()
+    return archived_before is not None and (start_date is None or start_date < archived_before)
+
+def _write_manifest(archived_before):
+    current = get_archived_before()
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump({
+            'archived_before': max(archived_before, current) if current else archived_before,
+            'updated_at': datetime.now().isoformat(timespec='seconds')
+        }, f)
+
+# ======================
+# READING
+# ======================
+def _read(path, filters):
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    # year is the hive partition column; drop it so rows match the hot tables
+    df = pd.read_parquet(path, engine='pyarrow', filters=filters or None)
+    return df.drop(columns=['year'], errors='ignore')
+
+def _date_filters(column, start_date, end_date):
+    filters = []
+    if start_date:
+        filters.append((column, '>=', start_date))
+        filters.append(('year', '>=', int(start_date[:4])))
+    if end_date:
+        # Stored dates are full ISO timestamps; compare against the end of the day
+        filters.append((column, '<=', f"{end_date}T23:59:59.999999"))
+        filters.append(('year', '<=', int(end_date[:4])))
+    return filters
+
+def read_archived_invoices(start_date=None, end_date=None, customer_id=None):
+    filters = _date_filters('invoicedate', start_date, end_date)
+    if customer_id is not None:
+        filters.append(('customerid', '=', customer_id))
+    return _read(INVOICES_PATH, filters).to_dict('records')
+
+def read_archived_payments(start_date=None, end_date=None, customer_id=None):
+    filters = _date_filters('paymentdate', start_date, end_date)
+    if customer_id is not None:
+        filters.append(('customerid', '=', customer_id))
+    return _read(PAYMENTS_PATH, filters).to_dict('records')
+
+def read_archived_invoice_details(start_date=None, end_date=None):
+    return _read(DETAILS_PATH, _date_filters('invoicedate', start_date, end_date)).to_dict('records')
+
+# ======================
+# ARCHIVING
+# ======================
+def _fetch_closed_invoices(archived_before):
+    invoices = []
+    while True:
+        response = supabase.table('invoices').select('''
+            invoiceid,
+            customerid,
+            invoicedate,
+            totalamount,
+            taxamount,
+            grandtotal,
+            status,
+            customers (
+                customername
+            )
+        ''').eq('status', 'Paid').lt('invoicedate', archived_before).order('invoiceid').range(
+            len(invoices), len(invoices) + PAGE_SIZE - 1
+        ).execute()
+        invoices.extend(response.data or [])
+        if not response.data or len(response.data) < PAGE_SIZE:
+            return invoices
+
+def _fetch_by_invoice(table, select, invoice_ids):
+    rows = []
+    for i in range(0, len(invoice_ids), ID_CHUNK):
+        response = supabase.table(table).select(select).in_('invoiceid', invoice_ids[i:i + ID_CHUNK]).execute()
+        rows.extend(response.data or [])
+    return rows
+
+def _archived(path, column, invoice_ids):
+    """Values of column already in the archive for these invoices"""
+    if not os.path.exists(path):
+        return set()
+    df = pd.read_parquet(path, engine='pyarrow', columns=[column], filters=[('invoiceid', 'in', invoice_ids)])
+    return set(df[column])
+
+def _append(path, rows, date_column, run_id, key):
+    # A run that stopped before its purge leaves its rows in the database, so
+    # the next run fetches them again; those already archived are skipped
+    done = _archived(path, key, sorted({row['invoiceid'] for row in rows}))
+    rows = [row for row in rows if row[key] not in done]
+    if not rows:
+        return
+    df = pd.DataFrame(rows)
+    df['year'] = df[date_column].str[:4].astype(int)
+    df.to_parquet(
+        path,
+        engine='pyarrow',
+        compression='zstd',
+        partition_cols=['year'],
+        index=False,
+        basename_template=f"{run_id}-{{i}}.parquet"
+    )
+
+def archive_closed_invoices(archived_before=None):
+    """Move paid invoices dated before archived_before, with their line items and
+    payments, from the database into compressed Parquet files.
+
+    An invoice paid on or after archived_before stays in the database until a
+    later run, since reports of ranges after archived_before don't read the
+    archive. Rows are written and flushed to the archive before they are deleted from the
+    hot tables; customer and service names are stored alongside so archived rows
+    can be read without joins. Returns the number of invoices archived.
+    """
+    archived_before = archived_before or (datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime('%Y-%m-%d')
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    invoices = _fetch_closed_invoices(archived_before)
+    payments = _fetch_by_invoice('payments', 'paymentid, invoiceid, paymentdate, paymentmethod, amountpaid',
+                                 [inv['invoiceid'] for inv in invoices])
+    paid_late = {p['invoiceid'] for p in payments if p['paymentdate'][:10] >= archived_before}
+    invoices = [inv for inv in invoices if inv['invoiceid'] not in paid_late]
+    payments = [p for p in payments if p['invoiceid'] not in paid_late]
+    if not invoices:
+        _write_manifest(archived_before)
+        return 0
+
+    invoice_ids = [inv['invoiceid'] for inv in invoices]
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    by_id = {inv['invoiceid']: inv for inv in invoices}
+
+    details = _fetch_by_invoice('invoicedetails', '''
+        invoiceid,
+        serviceid,
+        quantity,
+        totalprice,
+        services (
+            servicename,
+            unitprice
+        )
+    ''', invoice_ids)
+
+    _append(INVOICES_PATH, [{
+        'invoiceid': inv['invoiceid'],
+        'customerid': inv['customerid'],
+        'customername': inv['customers']['customername'] if inv.get('customers') else 'Unknown',
+        'invoicedate': inv['invoicedate'],
+        'totalamount': float(inv['totalamount']),
+        'taxamount': float(inv['taxamount']),
+        'grandtotal': float(inv['grandtotal']),
+        'status': inv['status']
+    } for inv in invoices], 'invoicedate', run_id, 'invoiceid')
+
+    _append(DETAILS_PATH, [{
+        'invoiceid': d['invoiceid'],
+        'invoicedate': by_id[d['invoiceid']]['invoicedate'],
+        'serviceid': d['serviceid'],
+        'servicename': d['services']['servicename'] if d.get('services') else 'Unknown',
+        'unitprice': float(d['services']['unitprice']) if d.get('services') else 0.0,
+        'quantity': d['quantity'],
+        'totalprice': float(d['totalprice'])
+    } for d in details], 'invoicedate', run_id, 'invoiceid')
+
+    _append(PAYMENTS_PATH, [{
+        'paymentid': p['paymentid'],
+        'invoiceid': p['invoiceid'],
+        'customerid': by_id[p['invoiceid']]['customerid'],
+        'customername': by_id[p['invoiceid']]['customers']['customername'] if by_id[p['invoiceid']].get('customers') else 'Unknown',
+        'grandtotal': float(by_id[p['invoiceid']]['grandtotal']),
+        'paymentdate': p['paymentdate'],
+        'paymentmethod': p['paymentmethod'],
+        'amountpaid': float(p['amountpaid'])
+    } for p in payments], 'paymentdate', run_id, 'paymentid')
+
+    # Each chunk's line items, payments and invoices are removed in one transaction
+    for i in range(0, len(invoice_ids), ID_CHUNK):
+        supabase.rpc('purge_archived_invoices', {'invoice_ids': invoice_ids[i:i + ID_CHUNK]}).execute()
+
+    _write_manifest(archived_before)
+    return len(invoices)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive closed invoices to Parquet")
+    parser.add_argument("--before", help="archive paid invoices dated before YYYY-MM-DD (default: two years ago)")
+    args = parser.parse_args()
+    count = archive_closed_invoices(args.before)
+    print(f"Archived {count} invoice(s) to {ARCHIVE_DIR}")
@@ -3,6 +3,10 @@ import os
 import time
 from supabase_config import supabase
 
+# Refresh the access token this many seconds before it expires; until then
+# reruns trust the session cached in st.session_state and make no auth calls
+REFRESH_MARGIN = 60
+
 def show_login_page():
     st.title("🐕 Smart Billing System")
     
@@ -24,7 +28,7 @@ def show_login_page():
                         "email": email,
                         "password": password
                     })
-                    st.session_state.auth_status = True
+                    remember_session(response.session, response.user)
                     st.success("Login successful!")
                     st.rerun()
                 except Exception as e:
@@ -150,11 +154,41 @@ def handle_password_reset():
         st.error(f"Error processing reset request: {str(e)}")
         st.markdown("[← Back to Login](/?page=login)")
 
+def remember_session(session, user):
+    """Cache the validated session and user profile for this browser session"""
+    st.session_state.auth_session = {
+        'access_token': session.access_token,
+        'refresh_token': session.refresh_token,
+        'expires_at': session.expires_at or int(time.time()) + session.expires_in
+    }
+    st.session_state.user_profile = {'id': user.id, 'email': user.email}
+    st.session_state.auth_status = True
+
+def logout():
+    """Forget the cached session and sign out of Supabase"""
+    for key in ('auth_session', 'user_profile'):
+        st.session_state.pop(key, None)
+    st.session_state.auth_status = False
+    try:
+        supabase.auth.sign_out()
+    except:
+        pass
+
 def init_auth():
-    """Initialize authentication state"""
+    """Initialize authentication state, revalidating only near token expiry"""
+    cached = st.session_state.get('auth_session')
+    if cached and cached['expires_at'] - REFRESH_MARGIN > time.time():
+        st.session_state.auth_status = True
+        return
+
     try:
-        user = supabase.auth.get_user()
-        if user:
-            st.session_state.auth_status = True
+        if cached:
+            response = supabase.auth.refresh_session(cached['refresh_token'])
+            remember_session(response.session, response.user)
+        else:
+            user = supabase.auth.get_user()
+            if user:
+                remember_session(supabase.auth.get_session(), user.user)
     except:
-        st.session_state.auth_status = False 
\ No newline at end of file
+        st.session_state.pop('auth_session', None)
+        st.session_state.auth_status = False
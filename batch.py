@@ -0,0 +1,213 @@
+import os
+import sys
+import argparse
+import analytics
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from models import Invoice, LineItem
+from utils import (supabase, get_report_data, generate_report_pdf, generate_invoice_pdf, get_customers,
+                   get_services, get_customer_segments)
+
+# Headless report and export runs for cron, so the nightly PDFs and data dumps
+# are ready before the shop opens and never compete with people using the app.
+#
+#   python batch.py report   --range day --range month   [--date YYYY-MM-DD]
+#   python batch.py invoices --start YYYY-MM-DD --end YYYY-MM-DD [--status Unpaid]
+#   python batch.py export   --start YYYY-MM-DD --end YYYY-MM-DD [--format parquet]
+#   python batch.py partitions [--months-ahead 3]
+#
+# Files go to --out (default: exports). Work is spread over --workers threads;
+# most of it is waiting on the database. Exits non-zero if anything failed.
+#
+#   30 2 * * *  cd /srv/smart-billing && python batch.py --out /srv/exports/$(date +\%F) report --range day --range month
+
+PAGE_SIZE = 1000  # PostgREST's default max rows per response
+REPORT_RANGES = ['day', 'week', 'month', 'year']
+PARTITION_MONTHS_AHEAD = 3
+EXPORT_FORMATS = ['csv', 'parquet']
+
+def yesterday():
+    return date.today() - timedelta(days=1)
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {value!r}")
+
+def report_range(range_name, as_of):
+    """(start, end) of the day, week (from Monday), month or year to date ending on as_of"""
+    if range_name == 'week':
+        return as_of - timedelta(days=as_of.weekday()), as_of
+    if range_name == 'month':
+        return as_of.replace(day=1), as_of
+    if range_name == 'year':
+        return as_of.replace(month=1, day=1), as_of
+    return as_of, as_of
+
+def _run_all(tasks, workers):
+    """Run (label, func, *args) tasks in parallel; returns the number that failed"""
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(func, *args): label for label, func, *args in tasks}
+        for future in as_completed(futures):
+            try:
+                path = future.result()
+            except Exception as e:
+                path, error = None, e
+            else:
+                error = "nothing was written"
+            if path:
+                print(f"{futures[future]}: {path}")
+            else:
+                failed += 1
+                print(f"{futures[future]}: FAILED ({error})", file=sys.stderr)
+    return failed
+
+# ======================
+# REPORTS
+# ======================
+def write_report(start_date, end_date, output_dir):
+    report_data = get_report_data(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    if not report_data:
+        return None
+    return generate_report_pdf(report_data, output_dir)
+
+def run_reports(args):
+    as_of = args.date or yesterday()
+    ranges = sorted({report_range(r, as_of) for r in args.range or ['day']})
+    return _run_all([(f"report {start} to {end}", write_report, start, end, args.out)
+                     for start, end in ranges], args.workers)
+
+# ======================
+# INVOICE PDFS
+# ======================
+def fetch_invoices(start_date, end_date, status=None):
+    """Invoices in the date range with their customer and line items, a page per request"""
+    invoices = []
+    while True:
+        query = supabase.table('invoices').select('''
+            *,
+            customers!inner(*),
+            invoicedetails (
+                *,
+                services!inner(*)
+            )
+        ''').gte('invoicedate', start_date).lte('invoicedate', end_date)
+        if status:
+            query = query.eq('status', status)
+        response = query.order('invoiceid').range(len(invoices), len(invoices) + PAGE_SIZE - 1).execute()
+        rows = response.data or []
+        for row in rows:
+            invoice = Invoice.from_row(row)
+            invoice.items = LineItem.from_rows(row.get('invoicedetails'))
+            invoices.append(invoice)
+        if len(rows) < PAGE_SIZE:
+            return invoices
+
+def run_invoices(args):
+    invoices = fetch_invoices(args.start.strftime('%Y-%m-%d'), args.end.strftime('%Y-%m-%d'), args.status)
+    print(f"{len(invoices)} invoice(s) from {args.start} to {args.end}")
+    return _run_all([(f"invoice #{invoice.invoiceid}", generate_invoice_pdf,
+                      invoice.invoiceid, invoice.customer, invoice, args.out)
+                     for invoice in invoices], args.workers)
+
+# ======================
+# DATA EXPORTS
+# ======================
+def _records(records):
+    return [{name: getattr(record, name) for name in record.__slots__} for record in records]
+
+def write_table(name, load, output_dir, file_format):
+    import pandas as pd
+
+    df = load()
+    if df is None:
+        return None
+    if not isinstance(df, pd.DataFrame):
+        df = pd.DataFrame(df)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{name}.{file_format}")
+    # Written under a temporary name, so a reader never picks up half a file
+    partial = path + '.partial'
+    if file_format == 'parquet':
+        df.to_parquet(partial, engine='pyarrow', compression='zstd', index=False)
+    else:
+        df.to_csv(partial, index=False)
+    os.replace(partial, path)
+    return path
+
+def run_export(args):
+    start, end = args.start.strftime('%Y-%m-%d'), args.end.strftime('%Y-%m-%d')
+    suffix = f"{start}_to_{end}"
+    report_data = get_report_data(start, end)
+    if report_data is None:
+        print(f"export {suffix}: FAILED (could not load invoices and payments)", file=sys.stderr)
+        return 1
+
+    tables = {
+        f"invoices_{suffix}": lambda: report_data['invoices'],
+        f"payments_{suffix}": lambda: report_data['payments'],
+        f"service_performance_{suffix}": lambda: report_data['service_performance'],
+        'customers': lambda: _records(get_customers()),
+        'services': lambda: _records(get_services())
+    }
+    # RFM segments come from the DuckDB snapshot
+    if analytics.enabled():
+        tables[f"customer_segments_{end}"] = lambda: get_customer_segments(end)
+    return _run_all([(f"export {name}", write_table, name, load, args.out, args.format)
+                     for name, load in tables.items()], args.workers)
+
+# ======================
+# PARTITION MAINTENANCE
+# ======================
+def run_partitions(args):
+    """Create the coming months' invoices/payments partitions where pg_cron doesn't.
+
+    See migrations/partition_invoices_payments_by_month.sql. Exits non-zero if
+    any month's partition couldn't be created; the database log has the reason.
+    """
+    failed = supabase.rpc('ensure_monthly_partitions', {'months_ahead': args.months_ahead}).execute().data
+    if failed:
+        raise SystemExit(f"{failed} partition(s) failed")
+    print(f"partitions: this month and {args.months_ahead} ahead exist")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate reports, invoice PDFs and data exports without the UI")
+    parser.add_argument("--out", default="exports", help="directory the files are written to (default: exports)")
+    parser.add_argument("--workers", type=int, default=4, help="files generated in parallel (default: 4)")
+    parser.add_argument("--nice", type=int, default=10, help="lower the CPU priority by this much (default: 10)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report = commands.add_parser("report", help="business report PDFs")
+    report.add_argument("--range", action="append", choices=REPORT_RANGES,
+                        help="day, or week/month/year to date; repeat for several (default: day)")
+    report.add_argument("--date", type=_date, help="last day covered (default: yesterday)")
+    report.set_defaults(run=run_reports)
+
+    invoices = commands.add_parser("invoices", help="one PDF per invoice")
+    invoices.add_argument("--start", type=_date, default=yesterday(), help="first invoice date (default: yesterday)")
+    invoices.add_argument("--end", type=_date, default=yesterday(), help="last invoice date (default: yesterday)")
+    invoices.add_argument("--status", choices=["Unpaid", "Partially Paid", "Paid"], help="only invoices in this status")
+    invoices.set_defaults(run=run_invoices)
+
+    export = commands.add_parser("export", help="invoices, payments, customers, services and segments as files")
+    export.add_argument("--start", type=_date, default=yesterday(), help="first date (default: yesterday)")
+    export.add_argument("--end", type=_date, default=yesterday(), help="last date (default: yesterday)")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="file format (default: csv)")
+    export.set_defaults(run=run_export)
+
+    partitions = commands.add_parser("partitions", help="monthly invoice and payment partitions, for databases without pg_cron")
+    partitions.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD,
+                            help=f"months after this one to create (default: {PARTITION_MONTHS_AHEAD})")
+    partitions.set_defaults(run=run_partitions)
+
+    args = parser.parse_args()
+    if getattr(args, 'start', None) and args.start > args.end:
+        parser.error("--start must not be after --end")
+    if hasattr(os, 'nice') and args.nice:
+        os.nice(args.nice)
+    failed = args.run(args)
+    if failed:
+        raise SystemExit(f"{failed} file(s) failed")
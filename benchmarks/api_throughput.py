@@ -0,0 +1,98 @@
+"""Ingestion throughput of the HTTP API (api.py): invoices and payments per
+second sent one per request, in batches, and as async jobs.
+
+    API_TOKEN=... python benchmarks/api_throughput.py --customer-id 1 --service-id 1 \\
+        [--url http://localhost:8000] [--count 2000] [--batch-size 200] [--concurrency 16]
+
+Writes real rows, so point it at a staging database. Every invoice is paid in
+full by the payments phase, so the rows it leaves behind show up as settled.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+
+_local = threading.local()
+
+def request(url, token, method, path, body=None, headers=None):
+    # One keep-alive connection per thread, as a POS terminal would hold
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        parts = urlsplit(url)
+        conn = _local.conn = HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers={
+        'Authorization': f"Bearer {token}",
+        'Content-Type': 'application/json',
+        **(headers or {})
+    })
+    response = conn.getresponse()
+    payload = json.loads(response.read())
+    if response.status >= 400:
+        raise SystemExit(f"{method} {path} failed with {response.status}: {payload}")
+    return response.status, payload
+
+def run(args, label, requests, rows):
+    """Send every (method, path, body, headers) and print rows/s"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda r: request(args.url, args.token, *r), requests))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {rows:>7} rows {len(requests):>6} requests {elapsed:8.2f} s {rows / elapsed:10.1f} rows/s")
+    return results
+
+def wait_for_jobs(args, job_ids):
+    results = []
+    for job_id in job_ids:
+        while True:
+            _, job = request(args.url, args.token, 'GET', f"/jobs/{job_id}")
+            if job['status'] == 'done':
+                results.append(job['response'])
+                break
+            time.sleep(0.05)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the API's invoice and payment ingestion rate")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL (default: http://localhost:8000)")
+    parser.add_argument("--token", default=os.getenv('API_TOKEN'), help="bearer token (default: $API_TOKEN)")
+    parser.add_argument("--customer-id", type=int, required=True, help="customer the invoices are billed to")
+    parser.add_argument("--service-id", type=int, required=True, help="service on every invoice")
+    parser.add_argument("--count", type=int, default=2000, help="invoices per phase (default: 2000)")
+    parser.add_argument("--batch-size", type=int, default=200, help="entries per batch request (default: 200)")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads (default: 16)")
+    args = parser.parse_args()
+    if not args.token:
+        sys.exit("Pass --token or set API_TOKEN")
+
+    today = date.today().isoformat()
+    invoice = {'customer_id': args.customer_id, 'date': today, 'items': [{'service_id': args.service_id, 'quantity': 1}]}
+    n, size = args.count, args.batch_size
+    batches = [min(size, n - i) for i in range(0, n, size)]
+
+    created = []
+    results = run(args, "invoices, one per request", [('POST', '/invoices', invoice, None)] * n, n)
+    created += [body for _, body in results]
+    results = run(args, "invoices, batched",
+                  [('POST', '/invoices/batch', {'invoices': [invoice] * b}, None) for b in batches], n)
+    created += [inv for _, body in results for inv in body['invoices']]
+
+    start = time.perf_counter()
+    results = run(args, "invoices, async batches (accepted)",
+                  [('POST', '/invoices/batch', {'invoices': [invoice] * b}, {'Prefer': 'respond-async'}) for b in batches], n)
+    created += [inv for body in wait_for_jobs(args, [body['job_id'] for _, body in results]) for inv in body['invoices']]
+    elapsed = time.perf_counter() - start
+    print(f"{'invoices, async batches (completed)':<36} {n:>7} rows {'':>15} {elapsed:8.2f} s {n / elapsed:10.1f} rows/s")
+
+    payments = [{'invoice_id': inv['invoice_id'], 'date': today, 'method': 'Cash', 'amount': inv['grand_total']}
+                for inv in created]
+    half = len(payments) // 2
+    run(args, "payments, one per request", [('POST', '/payments', p, None) for p in payments[:half]], half)
+    rest = payments[half:]
+    run(args, "payments, batched",
+        [('POST', '/payments/batch', {'payments': rest[i:i + size]}, None) for i in range(0, len(rest), size)], len(rest))
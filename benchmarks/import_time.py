@@ -0,0 +1,60 @@
+"""Import-time budget for the login page.
+
+    python benchmarks/import_time.py [--budget-ms 1500]
+
+Imports main.py in a fresh interpreter under `python -X importtime`, prints
+the slowest top-level imports, and exits non-zero when the total goes over
+the budget or when something the login page doesn't need is imported.
+Suitable as a CI step after dependency or import changes.
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only needed after login, by the dashboard pages, reports and PDFs. Streamlit
+# itself imports the bare plotly package for its theme; plotly.express is ours.
+FORBIDDEN = ['pandas', 'plotly.express', 'fpdf', 'duckdb', 'pyarrow', 'psycopg2']
+
+def measure():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+
+    modules = {}
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(' '):
+            top_level.append((name.strip(), int(cumulative)))
+    return modules, top_level
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the login page's import-time budget")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="maximum total import time (default: 1500)")
+    args = parser.parse_args()
+
+    modules, top_level = measure()
+    total_ms = sum(us for _, us in top_level) / 1000
+    for name, us in sorted(top_level, key=lambda m: m[1], reverse=True)[:10]:
+        print(f"{us / 1000:8.1f} ms  {name}")
+    print(f"{total_ms:8.1f} ms  total (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    loaded = sorted(m for m in FORBIDDEN
+                    if any(name == m or name.startswith(m + '.') for name in modules))
+    if loaded:
+        failures.append(f"login path imports {', '.join(loaded)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    if failures:
+        raise SystemExit("FAIL: " + "; ".join(failures))
+    print("OK")
@@ -0,0 +1,123 @@
+-- Compares date-bounded report queries on a flat payments/invoices layout with
+-- the monthly-partitioned layout from migrations/partition_invoices_payments_by_month.sql.
+--
+-- Runs against any local Postgres 13+ stand-in in a scratch schema:
+--   createdb smartbilling_bench
+--   psql -d smartbilling_bench -f benchmarks/partitioning_benchmark.sql
+--
+-- Data: 4 years, ~500k invoices and ~500k payments. Compare the "Execution Time"
+-- and buffer counts of each pair of plans; the partitioned plans should only
+-- list the partitions for the months in range.
+
+\timing on
+SET client_min_messages = warning;
+
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+SET search_path = bench;
+
+-- ======================
+-- Flat layout (current schema plus create_query_indexes.sql)
+-- ======================
+CREATE TABLE invoices_flat (
+    invoiceid INTEGER PRIMARY KEY,
+    customerid INTEGER NOT NULL,
+    invoicedate TIMESTAMPTZ NOT NULL,
+    grandtotal NUMERIC NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE TABLE payments_flat (
+    paymentid INTEGER PRIMARY KEY,
+    invoiceid INTEGER NOT NULL,
+    paymentdate TIMESTAMPTZ NOT NULL,
+    paymentmethod TEXT NOT NULL,
+    amountpaid NUMERIC NOT NULL
+);
+
+INSERT INTO invoices_flat
+SELECT g,
+       1 + (g % 20000),
+       TIMESTAMPTZ '2022-01-01 UTC' + (random() * INTERVAL '1460 days'),
+       round((100 + random() * 5000)::numeric, 2),
+       CASE WHEN random() < 0.9 THEN 'Paid' ELSE 'Unpaid' END
+FROM generate_series(1, 500000) g;
+
+INSERT INTO payments_flat
+SELECT i.invoiceid, i.invoiceid, i.invoicedate + (random() * INTERVAL '20 days'),
+       (ARRAY['Cash', 'Card', 'Online'])[1 + (i.invoiceid % 3)], i.grandtotal
+FROM invoices_flat i;
+
+CREATE INDEX ON invoices_flat (invoicedate);
+CREATE INDEX ON invoices_flat (customerid, invoicedate);
+CREATE INDEX ON payments_flat (paymentdate) INCLUDE (invoiceid, amountpaid);
+CREATE INDEX ON payments_flat (invoiceid, paymentdate) INCLUDE (amountpaid);
+
+-- ======================
+-- Partitioned layout
+-- ======================
+CREATE TABLE invoices_part (LIKE invoices_flat, PRIMARY KEY (invoiceid, invoicedate))
+    PARTITION BY RANGE (invoicedate);
+CREATE TABLE payments_part (LIKE payments_flat, PRIMARY KEY (paymentid, paymentdate))
+    PARTITION BY RANGE (paymentdate);
+
+DO $$
+DECLARE
+    m DATE;
+BEGIN
+    FOR m IN SELECT generate_series(DATE '2022-01-01', DATE '2026-01-01', INTERVAL '1 month')::date LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF invoices_part FOR VALUES FROM (%L) TO (%L)',
+                       'invoices_part_' || to_char(m, 'YYYYMM'),
+                       m::timestamp AT TIME ZONE 'UTC', (m + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC');
+        EXECUTE format('CREATE TABLE %I PARTITION OF payments_part FOR VALUES FROM (%L) TO (%L)',
+                       'payments_part_' || to_char(m, 'YYYYMM'),
+                       m::timestamp AT TIME ZONE 'UTC', (m + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC');
+    END LOOP;
+END $$;
+CREATE TABLE invoices_part_default PARTITION OF invoices_part DEFAULT;
+CREATE TABLE payments_part_default PARTITION OF payments_part DEFAULT;
+
+INSERT INTO invoices_part SELECT * FROM invoices_flat;
+INSERT INTO payments_part SELECT * FROM payments_flat;
+
+CREATE INDEX ON invoices_part (invoicedate);
+CREATE INDEX ON invoices_part (customerid, invoicedate);
+CREATE INDEX ON payments_part (paymentdate) INCLUDE (invoiceid, amountpaid);
+CREATE INDEX ON payments_part (invoiceid, paymentdate) INCLUDE (amountpaid);
+
+VACUUM ANALYZE invoices_flat;
+VACUUM ANALYZE payments_flat;
+VACUUM ANALYZE invoices_part;
+VACUUM ANALYZE payments_part;
+
+-- ======================
+-- Queries issued by get_report_data() / get_revenue_by_period()
+-- ======================
+\echo '--- get_revenue_by_period: one month of payments (flat) ---'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM payments_flat WHERE paymentdate >= '2025-04-01' AND paymentdate <= '2025-04-30';
+
+\echo '--- get_revenue_by_period: one month of payments (partitioned) ---'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM payments_part WHERE paymentdate >= '2025-04-01' AND paymentdate <= '2025-04-30';
+
+\echo '--- get_report_data: one quarter of invoices (flat) ---'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM invoices_flat WHERE invoicedate >= '2025-01-01' AND invoicedate <= '2025-03-31';
+
+\echo '--- get_report_data: one quarter of invoices (partitioned) ---'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT * FROM invoices_part WHERE invoicedate >= '2025-01-01' AND invoicedate <= '2025-03-31';
+
+\echo '--- one year of revenue, summed (flat) ---'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT date_trunc('month', paymentdate), SUM(amountpaid)
+FROM payments_flat WHERE paymentdate >= '2024-01-01' AND paymentdate < '2025-01-01'
+GROUP BY 1;
+
+\echo '--- one year of revenue, summed (partitioned) ---'
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT date_trunc('month', paymentdate), SUM(amountpaid)
+FROM payments_part WHERE paymentdate >= '2024-01-01' AND paymentdate < '2025-01-01'
+GROUP BY 1;
+
+DROP SCHEMA bench CASCADE;
@@ -0,0 +1,143 @@
+-- Checks that every filter utils.py sends through PostgREST is planned on the
+-- index migrations/create_query_indexes.sql (or create_ar_aging_functions.sql)
+-- made for it, rather than on a sequential scan. Fails on the first that isn't.
+--
+-- Runs the real migration files against an empty scratch database on any local
+-- Postgres 13+ stand-in:
+--   dropdb --if-exists smartbilling_indexcheck && createdb smartbilling_indexcheck
+--   psql -d smartbilling_indexcheck -f benchmarks/query_index_check.sql
+--
+-- Exits non-zero and names the query, the index and the plan when a filter
+-- would scan its table. CI runs it on every change to utils.py, the migrations
+-- or this file (.github/workflows/query-plans.yml).
+
+\set ON_ERROR_STOP on
+SET client_min_messages = notice;
+
+-- ======================
+-- Schema the migrations expect, with enough rows for realistic plans
+-- ======================
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+\ir ../migrations/create_invoiceservices_table.sql
+
+ALTER TABLE public.invoices ADD COLUMN amountpaid NUMERIC NOT NULL DEFAULT 0;
+ALTER TABLE public.invoices ADD COLUMN balancedue NUMERIC GENERATED ALWAYS AS (grandtotal - amountpaid) STORED;
+
+CREATE TABLE public.invoicedetails (
+    invoiceid INTEGER NOT NULL,
+    serviceid INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    totalprice NUMERIC NOT NULL
+);
+CREATE TABLE public.recurringinvoices (
+    templateid SERIAL PRIMARY KEY,
+    active BOOLEAN NOT NULL DEFAULT TRUE
+);
+ALTER TABLE public.invoices ADD COLUMN templateid INTEGER;
+ALTER TABLE public.invoices ADD COLUMN billingperiod TEXT;
+
+INSERT INTO public.users (email)
+SELECT 'user' || g || '@example.com' FROM generate_series(1, 20000) g;
+INSERT INTO public.customers (customername)
+SELECT 'Customer ' || g FROM generate_series(1, 20000) g;
+INSERT INTO public.services (servicename, unitprice)
+SELECT 'Service ' || g, 100 + g FROM generate_series(1, 200) g;
+
+-- Four years of invoices in date order, as they are written. The last month's
+-- or so are still open; everything older is paid.
+INSERT INTO public.invoices (customerid, invoicedate, totalamount, taxamount, grandtotal, amountpaid, status)
+SELECT 1 + (g % 20000),
+       TIMESTAMPTZ '2022-01-01 UTC' + g * (INTERVAL '1460 days' / 200000),
+       t, t * 0.1, t * 1.1,
+       CASE WHEN g > 195000 THEN 0 ELSE t * 1.1 END,
+       CASE WHEN g > 195000 THEN 'Unpaid' ELSE 'Paid' END
+FROM generate_series(1, 200000) g, LATERAL (SELECT round((100 + random() * 5000)::numeric, 2) AS t) amount;
+
+INSERT INTO public.invoicedetails (invoiceid, serviceid, quantity, totalprice)
+SELECT i.invoiceid, 1 + ((i.invoiceid * 7 + n) % 200), 1, 100
+FROM public.invoices i, generate_series(1, 2) n;
+
+INSERT INTO public.payments (invoiceid, paymentdate, paymentmethod, amountpaid)
+SELECT invoiceid, invoicedate + INTERVAL '10 days', 'Cash', grandtotal
+FROM public.invoices
+WHERE status = 'Paid'
+ORDER BY invoiceid;
+
+-- Templates pile up; only the newest stay active
+INSERT INTO public.recurringinvoices (active)
+SELECT g > 19600 FROM generate_series(1, 20000) g;
+
+\ir ../migrations/create_ar_aging_functions.sql
+\ir ../migrations/create_query_indexes.sql
+
+VACUUM ANALYZE;
+
+-- ======================
+-- Assertions
+-- ======================
+CREATE FUNCTION pg_temp.expect_index(label TEXT, query TEXT, index_name TEXT)
+RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+    plan JSON;
+BEGIN
+    EXECUTE 'EXPLAIN (FORMAT JSON) ' || query INTO plan;
+    IF position(format('"Index Name": "%s"', index_name) IN plan::text) = 0 THEN
+        RAISE EXCEPTION '% does not use %. Query: %. Plan: %', label, index_name, query, plan;
+    END IF;
+    RAISE NOTICE 'ok: % uses %', label, index_name;
+END;
+$$;
+
+SELECT pg_temp.expect_index('authenticate_user(): users .eq(email)',
+    $q$SELECT * FROM public.users WHERE email = 'user4242@example.com'$q$,
+    'idx_users_email');
+
+SELECT pg_temp.expect_index('get_customer_history(): invoices .eq(customerid)',
+    $q$SELECT * FROM public.invoices WHERE customerid = 4242$q$,
+    'idx_invoices_customer_date');
+
+SELECT pg_temp.expect_index('check_duplicate_invoice(): invoices .eq(customerid).eq(invoicedate)',
+    $q$SELECT invoiceid FROM public.invoices WHERE customerid = 4242 AND invoicedate = '2025-03-01'$q$,
+    'idx_invoices_customer_date');
+
+SELECT pg_temp.expect_index('get_customer_history(): payments .in_(invoiceid)',
+    $q$SELECT paymentid, invoiceid, paymentdate, paymentmethod, amountpaid
+       FROM public.payments WHERE invoiceid IN (4242, 24242, 44242, 64242, 84242)$q$,
+    'idx_payments_invoice_date');
+
+SELECT pg_temp.expect_index('get_unpaid_invoices(customer): invoices .in_(status).eq(customerid)',
+    $q$SELECT * FROM public.invoices
+       WHERE status IN ('Unpaid', 'Partially Paid') AND customerid = 17000$q$,
+    'idx_invoices_open_customer_date');
+
+SELECT pg_temp.expect_index('get_unpaid_invoices(): invoices .in_(status)',
+    $q$SELECT * FROM public.invoices WHERE status IN ('Unpaid', 'Partially Paid')$q$,
+    'idx_invoices_open_customer_date');
+
+SELECT pg_temp.expect_index('get_report_data(): invoices .gte/.lte(invoicedate), one week',
+    $q$SELECT * FROM public.invoices WHERE invoicedate >= '2025-03-01' AND invoicedate <= '2025-03-07'$q$,
+    'idx_invoices_invoicedate');
+
+SELECT pg_temp.expect_index('get_report_data(): payments .gte/.lte(paymentdate), one week',
+    $q$SELECT * FROM public.payments WHERE paymentdate >= '2025-03-01' AND paymentdate <= '2025-03-07'$q$,
+    'idx_payments_paymentdate');
+
+SELECT pg_temp.expect_index('get_revenue_by_period(): payments .gte/.lte(paymentdate), one month',
+    $q$SELECT paymentdate, amountpaid FROM public.payments
+       WHERE paymentdate >= '2025-03-01' AND paymentdate <= '2025-03-31'$q$,
+    'idx_payments_paymentdate');
+
+SELECT pg_temp.expect_index('get_invoice_details(): invoicedetails .eq(invoiceid)',
+    $q$SELECT * FROM public.invoicedetails WHERE invoiceid = 4242$q$,
+    'idx_invoicedetails_invoice');
+
+SELECT pg_temp.expect_index('delete_service(): invoicedetails .eq(serviceid)',
+    $q$SELECT invoiceid FROM public.invoicedetails WHERE serviceid = 42$q$,
+    'idx_invoicedetails_service');
+
+SELECT pg_temp.expect_index('get_recurring_templates(active_only=True): recurringinvoices .eq(active)',
+    $q$SELECT * FROM public.recurringinvoices WHERE active$q$,
+    'idx_recurringinvoices_active');
+
+\echo 'Every filter uses its index.'
@@ -0,0 +1,97 @@
+"""Memory held per session for the Payment History and Invoice List tabs,
+before (lists of dicts plus a DataFrame of formatted strings) and after
+(slotted records from models.py plus one typed frame from frames.py).
+
+    python benchmarks/session_memory.py [rows]
+
+Uses synthetic rows shaped like the PostgREST responses; no database needed.
+"""
+import os
+import sys
+import random
+import tracemalloc
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import Invoice, Payment
+from frames import invoices_frame, payments_frame
+
+CUSTOMERS = [f"Customer {i}" for i in range(500)]
+
+def fake_payments(n):
+    return [{
+        'paymentid': i,
+        'invoiceid': i,
+        'paymentdate': f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}T10:00:00+00:00",
+        'paymentmethod': random.choice(['Cash', 'Card', 'Online']),
+        'amountpaid': round(random.uniform(100, 5000), 2),
+        'customerid': i % 500,
+        'grandtotal': round(random.uniform(100, 5000), 2),
+        'customername': CUSTOMERS[i % 500]
+    } for i in range(n)]
+
+def fake_invoices(n):
+    return [{
+        'invoiceid': i,
+        'customerid': i % 500,
+        'invoicedate': f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}T10:00:00+00:00",
+        'totalamount': 1000.0,
+        'taxamount': 100.0,
+        'grandtotal': 1100.0,
+        'amountpaid': 0.0,
+        'balancedue': 1100.0,
+        'status': random.choice(['Unpaid', 'Partially Paid', 'Paid']),
+        'customers': {'customerid': i % 500, 'customername': CUSTOMERS[i % 500], 'email': 'a@b.c'}
+    } for i in range(n)]
+
+def payments_before(payments):
+    payment_list = [{
+        "Payment #": p['paymentid'],
+        "Invoice #": p['invoiceid'],
+        "Customer": p['customername'],
+        "Date": p['paymentdate'].split('T')[0],
+        "Method": p['paymentmethod'],
+        "Amount": f"Rs. {float(p['amountpaid']):,.2f}"
+    } for p in payments]
+    return payments, payment_list, pd.DataFrame(payment_list)
+
+def invoices_before(invoices):
+    invoice_list = [{
+        "Invoice #": inv['invoiceid'],
+        "Customer": inv['customers']['customername'],
+        "Date": inv['invoicedate'].split('T')[0],
+        "Amount": f"Rs. {inv['grandtotal']:,.2f}",
+        "Status": inv['status']
+    } for inv in invoices]
+    return invoices, invoice_list, pd.DataFrame(invoice_list)
+
+def payments_after(rows):
+    payments = Payment.from_rows(rows)
+    return payments, payments_frame(payments)
+
+def invoices_after(rows):
+    invoices = Invoice.from_rows(rows)
+    return invoices, invoices_frame(invoices)
+
+def measure(build, make_rows, n):
+    # Rows arrive as a fresh copy from the read cache on every rerun; whatever
+    # build() returns is what the session keeps alive
+    tracemalloc.start()
+    held = build(make_rows(n))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current / 1024 ** 2, peak / 1024 ** 2
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(0)
+    print(f"{n} rows          held MiB   peak MiB")
+    for label, build, make_rows in [
+        ("payments before", payments_before, fake_payments),
+        ("payments after ", payments_after, fake_payments),
+        ("invoices before", invoices_before, fake_invoices),
+        ("invoices after ", invoices_after, fake_invoices),
+    ]:
+        held, peak = measure(build, make_rows, n)
+        print(f"{label}     {held:8.1f}   {peak:8.1f}")
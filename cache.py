@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import pickle
+import select
+import sqlite3
+import threading
+import functools
+import resilience
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:  # no change feed; cached reads fall back to a short TTL
+    psycopg2 = None
+
+# Direct (session) Postgres connection string; LISTEN doesn't work through the transaction pooler
+DATABASE_URL = os.getenv('DATABASE_URL')
+CHANNEL = 'table_changes'  # see migrations/add_change_notifications.sql
+# While subscribed every change evicts its entries, so they can live for an hour;
+# without the feed other processes' writes are only seen once an entry expires
+CACHE_TTL = int(os.getenv('CACHE_TTL_SECONDS', '3600'))
+UNSUBSCRIBED_TTL = int(os.getenv('CACHE_UNSUBSCRIBED_TTL_SECONDS', '30'))
+RECONNECT_SECONDS = 5
+# Optional SQLite file shared by every process on the box (e.g. several Streamlit
+# replicas), so a cold process starts from what the others have already read.
+# Values are pickled: the file must only be writable by the app's user.
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH')
+# Only the app's own writes evict shared entries, so they expire sooner
+SHARED_CACHE_TTL = int(os.getenv('SHARED_CACHE_TTL_SECONDS', '300'))
+# Evicted and expired values kept to fall back on while Supabase is unreachable
+STALE_ENTRIES = int(os.getenv('CACHE_STALE_ENTRIES', '500'))
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    cache_key TEXT PRIMARY KEY,
+    tables TEXT NOT NULL,
+    key_column TEXT,
+    key_value BLOB,
+    expires_at REAL NOT NULL,
+    value BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO generation VALUES (1, 0);
+"""
+
+_entries = {}
+_stale = {}  # cache key -> evicted _Entry, oldest first
+_flights = {}  # cache key -> _Flight for reads in progress
+_generation = 0  # bumped on every eviction
+_lock = threading.Lock()
+_listener = None
+_subscribed = threading.Event()
+_shared_local = threading.local()  # one SQLite connection per thread
+
+# ======================
+# CACHE
+# ======================
+class _Entry:
+    def __init__(self, value, tables, key_column, key_value, expires_at):
+        self.value = value
+        self.tables = tables
+        self.key_column = key_column
+        self.key_value = key_value
+        self.expires_at = expires_at
+        self.loaded_at = time.time()
+
+    def affected_by(self, table, rowkeys):
+        return table in self.tables and _key_affected(self.key_column, self.key_value, rowkeys)
+
+def _key_affected(key_column, key_value, rowkeys):
+    # Entries for one key only go when a row with that key changes; a table whose
+    # rows don't carry the key column (e.g. services for one invoice) evicts them all
+    if key_value is None or rowkeys is None:
+        return True
+    return any(key_column not in rowkey or rowkey[key_column] == key_value for rowkey in rowkeys)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+def _coalesce(cache_key, func, args):
+    """Run func(*args) once for every caller that misses on cache_key at the same time.
+
+    When the shop opens, every session's dashboard asks for the same lists at
+    once; followers wait for the leader's read instead of each querying Supabase.
+    """
+    with _lock:
+        flight = _flights.get(cache_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[cache_key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        flight.value = func(*args)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            # An eviction mid-read has already detached this flight
+            if _flights.get(cache_key) is flight:
+                del _flights[cache_key]
+        flight.done.set()
+    return flight.value
+
+def cached(*tables, key_column=None, ttl=None, derived=False):
+    """Cache a read function's result until a row of one of tables changes.
+
+    With key_column, the function's first argument is the value of that column
+    its result depends on, and only changes to rows with that value evict it.
+    ttl caps an entry's lifetime in seconds, for results that can lag the
+    tables (e.g. those answered from the analytics snapshot). derived marks a
+    function that only builds on other cached reads: they report to the circuit
+    breaker, so it is run once, unguarded. Concurrent misses
+    on the same arguments share one call, and with SHARED_CACHE_PATH set other
+    processes' results are used too. The function should raise on failure so
+    errors are never cached; transient failures are retried (see resilience.py),
+    and if Supabase stays unreachable the last value read is returned instead.
+    A result built from such a stale value is returned but not cached.
+
+    Every caller gets the cached object itself, not a copy, so a rerun costs
+    nothing however many rows it holds: treat results as read-only, and copy
+    one before changing it.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            _ensure_listener()
+            cache_key = (func.__qualname__, args)
+            with _lock:
+                entry = _entries.get(cache_key)
+                if entry and entry.expires_at > time.monotonic():
+                    return entry.value
+                generation = _generation
+
+            key_value = args[0] if key_column and args else None
+
+            def load():
+                shared_key = repr((func.__module__, func.__qualname__, args))
+                if SHARED_CACHE_PATH:
+                    hit = _shared_get(shared_key)
+                    if hit is not None:
+                        return hit + (True,)
+                    shared_generation = _shared_generation()
+                stale_reads = resilience.stale_reads()
+                value = func(*args) if derived else resilience.call(func, *args)
+                # A cached read inside func fell back on stale data
+                fresh = resilience.stale_reads() == stale_reads
+                expires_in = CACHE_TTL if _subscribed.is_set() else UNSUBSCRIBED_TTL
+                if ttl is not None:
+                    expires_in = min(expires_in, ttl)
+                if fresh and SHARED_CACHE_PATH and shared_generation is not None:
+                    _shared_put(shared_key, value, tables, key_column, key_value,
+                                min(expires_in, SHARED_CACHE_TTL), shared_generation)
+                return value, expires_in, fresh
+
+            try:
+                value, expires_in, fresh = _coalesce(cache_key, load, ())
+            except Exception as e:
+                stale = _stale_entry(cache_key) if resilience.is_transient(e) else None
+                if stale is None:
+                    raise
+                resilience.served_stale(stale.loaded_at)
+                return stale.value
+            with _lock:
+                # A change that arrived mid-read may not be reflected in value
+                if fresh and generation == _generation:
+                    _entries[cache_key] = _Entry(value, tables, key_column, key_value, time.monotonic() + expires_in)
+                    _stale.pop(cache_key, None)
+            return value
+        return wrapper
+    return decorator
+
+def invalidate(table, rowkey=None):
+    """Evict the entries that depend on table, or only on the row with rowkey.
+
+    Called by the process that wrote, so it also evicts the shared tier; the
+    other processes only hear of the write through the change feed.
+    """
+    _evict(table, None if rowkey is None else [rowkey])
+
+def invalidate_rows(table, rowkeys):
+    """Evict the entries that depend on any of the rows with rowkeys, for bulk writes.
+
+    Entries for other keys stay, in this process and in the shared tier, so a
+    batch of writes doesn't make every process read whole tables again.
+    """
+    if rowkeys:
+        _evict(table, list(rowkeys))
+
+def _evict(table, rowkeys, shared=True):
+    global _generation
+    with _lock:
+        _generation += 1
+        # Reads already in flight may predate the change; later callers start afresh
+        _flights.clear()
+        for cache_key in [k for k, entry in _entries.items() if entry.affected_by(table, rowkeys)]:
+            _keep_stale(cache_key, _entries.pop(cache_key))
+    if shared and SHARED_CACHE_PATH:
+        _shared_invalidate(table, rowkeys)
+
+def clear():
+    _clear_local()
+    if SHARED_CACHE_PATH:
+        _shared_invalidate(None)
+
+def _clear_local():
+    global _generation
+    with _lock:
+        _generation += 1
+        _flights.clear()
+        # The change feed drops out when the database does, which is just when these are needed
+        for cache_key, entry in _entries.items():
+            _keep_stale(cache_key, entry)
+        _entries.clear()
+
+def _keep_stale(cache_key, entry):
+    # Called with _lock held
+    _stale.pop(cache_key, None)
+    _stale[cache_key] = entry
+    while len(_stale) > STALE_ENTRIES:
+        del _stale[next(iter(_stale))]
+
+def _stale_entry(cache_key):
+    """The last value read for cache_key, however old, or None"""
+    with _lock:
+        return _entries.get(cache_key) or _stale.get(cache_key)
+
+# ======================
+# SHARED TIER
+# ======================
+# Errors here are printed and treated as misses; the shared tier only ever
+# saves a query. A generation counter in the file plays the same part as
+# _generation: a read that overlapped a change in any process isn't stored.
+def _shared():
+    conn = getattr(_shared_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SHARED_CACHE_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SHARED_SCHEMA)
+        _shared_local.conn = conn
+    return conn
+
+def _shared_get(shared_key):
+    """(value, seconds left) for a live shared entry, or None"""
+    try:
+        now = time.time()
+        row = _shared().execute(
+            "SELECT value, expires_at FROM entries WHERE cache_key = ? AND expires_at > ?", (shared_key, now)
+        ).fetchone()
+        return (pickle.loads(row[0]), row[1] - now) if row else None
+    except Exception as e:
+        print(f"Shared cache read failed: {str(e)}")
+        return None
+
+def _shared_generation():
+    try:
+        return _shared().execute("SELECT value FROM generation").fetchone()[0]
+    except Exception as e:
+        print(f"Shared cache read failed: {str(e)}")
+        return None
+
+def _shared_put(shared_key, value, tables, key_column, key_value, expires_in, generation):
+    try:
+        conn = _shared()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT value FROM generation").fetchone()[0] == generation:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (shared_key, ',' + ','.join(tables) + ',', key_column, pickle.dumps(key_value),
+                     time.time() + expires_in, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                )
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        print(f"Shared cache write failed: {str(e)}")
+
+def _shared_invalidate(table, rowkeys=None):
+    """Evict shared entries as _evict() does; table None evicts everything"""
+    try:
+        conn = _shared()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE generation SET value = value + 1")
+            if table is None:
+                conn.execute("DELETE FROM entries")
+            else:
+                candidates = conn.execute(
+                    "SELECT cache_key, key_column, key_value FROM entries WHERE tables LIKE ?", (f'%,{table},%',)
+                ).fetchall()
+                doomed = [(key,) for key, key_column, key_value in candidates
+                          if _key_affected(key_column, pickle.loads(key_value), rowkeys)]
+                conn.executemany("DELETE FROM entries WHERE cache_key = ?", doomed)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        print(f"Shared cache eviction failed: {str(e)}")
+
+# ======================
+# CHANGE FEED
+# ======================
+def _ensure_listener():
+    global _listener
+    if _listener is not None or psycopg2 is None or not DATABASE_URL:
+        return
+    with _lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='cache-listener', daemon=True)
+            _listener.start()
+
+def _listen():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {CHANNEL}")
+            # Anything may have changed while we weren't listening. The shared
+            # tier is kept: the process that wrote evicts it, and its entries are
+            # short-lived (SHARED_CACHE_TTL) for writes made outside the app.
+            _clear_local()
+            _subscribed.set()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    conn.cursor().execute("SELECT 1")  # notices a dropped connection
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    change = json.loads(conn.notifies.pop(0).payload)
+                    # Only this process's entries: every replica hears each
+                    # change, and the writer has already evicted the shared tier
+                    key = change.get('key')
+                    _evict(change['table'], None if key is None else [key], shared=False)
+        except Exception as e:
+            print(f"Cache change feed disconnected: {str(e)}")
+            _subscribed.clear()
+            _clear_local()
+            if conn is not None:
+                conn.close()
+            time.sleep(RECONNECT_SECONDS)
+
+if __name__ == "__main__":
+    # Print the change feed, e.g. to check the triggers against a local Postgres
+    if psycopg2 is None or not DATABASE_URL:
+        raise SystemExit("Set DATABASE_URL and install psycopg2-binary to listen for changes")
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    conn.cursor().execute(f"LISTEN {CHANNEL}")
+    print(f"Listening on {CHANNEL}...")
+    while True:
+        if select.select([conn], [], [], 60) != ([], [], []):
+            conn.poll()
+            while conn.notifies:
+                print(conn.notifies.pop(0).payload)
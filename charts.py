@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from datetime import timedelta
+import analytics
+from archive import get_archive_version
+from cache import cached
+from utils import _load_payments, _revenue_by_period
+
+# Revenue line charts, downsampled on the server and cached per data version.
+# A line chart can't show more than about one point per horizontal pixel, so
+# longer series are cut down to CHART_POINTS with Largest-Triangle-Three-Buckets,
+# which keeps the peaks and dips. Figures are cached until the rows behind them
+# change (see cache.py) or an archive run writes, so reruns don't rebuild them.
+# Errors reading the data are raised to the page rather than drawn as no data.
+
+# Width in pixels of a default st.plotly_chart; the dashboard's half-width
+# columns are narrower, so this is enough for both
+CHART_POINTS = 700
+# Revenue breakdowns offered by the revenue cube (see analytics.py)
+REVENUE_BREAKDOWNS = {'service': 'Service', 'method': 'Payment Method', 'segment': 'Customer Segment'}
+
+def lttb(x, y, threshold):
+    """Indices of the threshold points Largest-Triangle-Three-Buckets keeps.
+
+    x must be increasing. The first and last points are always kept; each
+    bucket in between keeps the point forming the largest triangle with the
+    previously kept point and the average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+
+    keep = np.empty(threshold, dtype='int64')
+    keep[0], keep[-1] = 0, n - 1
+    # threshold - 2 buckets over the points between the first and last
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+def downsample(df, x, y, threshold=CHART_POINTS):
+    """df sorted by x, cut down to at most threshold rows with lttb"""
+    if len(df) <= threshold:
+        return df
+    xs = df[x]
+    if pd.api.types.is_datetime64_any_dtype(xs):
+        xs = xs.astype('int64')
+    return df.iloc[lttb(xs.to_numpy(), df[y].to_numpy(), threshold)]
+
+# ======================
+# FIGURES
+# ======================
+# Snapshot-backed, so kept no longer than the snapshot may lag (see utils._load_report_data)
+@cached('payments', 'invoices', 'invoicedetails', 'services', ttl=analytics.REFRESH_SECONDS)
+def _revenue_trend_figure(period, start_date, end_date, group_by, filters, archive_version):
+    revenue_data = _revenue_by_period(period, start_date, end_date, group_by, dict(filters))
+    if not revenue_data:
+        # Raising keeps an empty range out of the cache
+        raise LookupError("No revenue in range")
+    df = pd.DataFrame(revenue_data)
+    df['period_start'] = pd.to_datetime(df['period_start'])
+    df = df.sort_values('period_start')
+    if group_by:
+        # One line per group, each cut down to the chart width on its own
+        df = df.groupby(group_by, group_keys=False).apply(
+            lambda group: downsample(group, 'period_start', 'total_revenue')
+        )
+    else:
+        df = downsample(df, 'period_start', 'total_revenue')
+    labels = {'period_start': 'Date', 'total_revenue': 'Revenue (Rs.)'}
+    if group_by:
+        labels[group_by] = REVENUE_BREAKDOWNS[group_by]
+    return px.line(df, x='period_start', y='total_revenue', color=group_by,
+                   title=f"Revenue Trend by {period.capitalize()}", labels=labels)
+
+def revenue_trend_figure(period, start_date, end_date, group_by=None, filters=None):
+    """Revenue per period between the dates, one line per group_by value, or None if there was none"""
+    # Filters become part of the cache key, so they need to be hashable
+    filters = tuple(sorted((dimension, tuple(values)) for dimension, values in (filters or {}).items() if values))
+    try:
+        return _revenue_trend_figure(period, start_date, end_date, group_by, filters, get_archive_version())
+    except LookupError:
+        return None
+
+# Built from the cached payments list, whose read reports to the circuit breaker
+@cached('payments', derived=True)
+def _weekly_revenue_figure():
+    payments = _load_payments()
+    if not payments:
+        raise LookupError("No payments")
+    weekly = {}
+    for p in payments:
+        # Weeks start on Sunday, as before with strftime('%Y-%U')
+        week = p.paymentdate - timedelta(days=(p.paymentdate.weekday() + 1) % 7)
+        weekly[week] = weekly.get(week, 0) + p.amountpaid
+    df = pd.DataFrame(sorted(weekly.items()), columns=['week', 'amountpaid'])
+    df['week'] = pd.to_datetime(df['week'])
+    return px.line(downsample(df, 'week', 'amountpaid'), x='week', y='amountpaid', title='Weekly Revenue')
+
+def weekly_revenue_figure():
+    """Revenue per week over all payments, or None if there are none"""
+    try:
+        return _weekly_revenue_figure()
+    except LookupError:
+        return None
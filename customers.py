@@ -1,12 +1,14 @@
 import streamlit as st
-import pandas as pd
-from utils import get_customers, add_customer, update_customer, delete_customer, get_customer_history
+from datetime import datetime
+from utils import get_customers, add_customer, update_customer, delete_customer, get_customer_history, get_customer_segments
+from frames import customers_frame, invoices_frame, payments_frame, money_column
+from grid import paged_grid
 
 def show_customers_page():
     st.title("🐕 Customer Management")
     st.markdown("---")
     
-    tab1, tab2, tab3 = st.tabs(["Add Customer", "Customer List", "Customer History"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Add Customer", "Customer List", "Customer History", "Segments"])
     
     with tab1:
         with st.form("add_customer_form"):
@@ -26,7 +28,7 @@ def show_customers_page():
                 else:
                     # Check if customer with this email already exists
                     existing_customers = get_customers()
-                    if existing_customers and any(c['email'] == email for c in existing_customers) and any(c['phonenumber'] == phone for c in existing_customers):
+                    if existing_customers and any(c.email == email for c in existing_customers) and any(c.phonenumber == phone for c in existing_customers):
                         st.error("Customer already exists! Please use a different email or phone number.")
                     else:
                         # Only try to add customer if they don't already exist
@@ -48,7 +50,7 @@ def show_customers_page():
         customers = get_customers()
         
         if customers:
-            df = pd.DataFrame(customers)
+            df = customers_frame(customers)
             st.dataframe(df.rename(columns={
                 'customerid': 'ID',
                 'customername': 'Name',
@@ -60,24 +62,24 @@ def show_customers_page():
             
             # Edit/Delete functionality
             st.subheader("Manage Customers")
-            customer_ids = [c['customerid'] for c in customers]
+            customer_ids = [c.customerid for c in customers]
             selected_id = st.selectbox(
                 "Select Customer to Manage", 
                 customer_ids, 
-                format_func=lambda x: f"{next(c['customername'] for c in customers if c['customerid'] == x)} (ID: {x})"
+                format_func=lambda x: f"{next(c.customername for c in customers if c.customerid == x)} (ID: {x})"
             )
             
             if selected_id:
-                selected_customer = next(c for c in customers if c['customerid'] == selected_id)
+                selected_customer = next(c for c in customers if c.customerid == selected_id)
                 
                 col1, col2 = st.columns(2)
                 with col1:
                     with st.expander("Edit Customer"):
                         with st.form("edit_customer_form"):
-                            edit_name = st.text_input("Name", value=selected_customer['customername'])
-                            edit_email = st.text_input("Email", value=selected_customer['email'])
-                            edit_phone = st.text_input("Phone", value=selected_customer['phonenumber'])
-                            edit_address = st.text_area("Address", value=selected_customer['address'])
+                            edit_name = st.text_input("Name", value=selected_customer.customername)
+                            edit_email = st.text_input("Email", value=selected_customer.email)
+                            edit_phone = st.text_input("Phone", value=selected_customer.phonenumber)
+                            edit_address = st.text_area("Address", value=selected_customer.address)
                             
                             update_button = st.form_submit_button("Update Customer")
                             
@@ -109,52 +111,100 @@ def show_customers_page():
         if customers:
             customer_id = st.selectbox(
                 "Select Customer", 
-                [c['customerid'] for c in customers], 
-                format_func=lambda x: f"{next(c['customername'] for c in customers if c['customerid'] == x)} (ID: {x})"
+                [c.customerid for c in customers], 
+                format_func=lambda x: f"{next(c.customername for c in customers if c.customerid == x)} (ID: {x})"
             )
             
             history = get_customer_history(customer_id)
             
             if history['customer']:
-                st.markdown(f"### History for {history['customer']['customername']}")
+                st.markdown(f"### History for {history['customer'].customername}")
                 
                 st.markdown("#### Invoices")
                 if history['invoices']:
-                    df_invoices = pd.DataFrame(history['invoices'])
-                    # Rename columns for better display
-                    df_invoices = df_invoices.rename(columns={
-                        'invoiceid': 'Invoice ID',
-                        'customerid': 'Customer ID',
-                        'invoicedate': 'Date',
-                        'duedate': 'Due Date',
-                        'totalamount': 'Total Amount',
-                        'status': 'Status'
-                    })
-                    st.dataframe(df_invoices)
+                    paged_grid(
+                        invoices_frame(history['invoices']).drop(columns=['customername']),
+                        key="history_invoices",
+                        column_config={
+                            'invoiceid': st.column_config.NumberColumn('Invoice ID', format="%d"),
+                            'invoicedate': st.column_config.DateColumn('Date', format="YYYY-MM-DD"),
+                            'grandtotal': money_column('Grand Total'),
+                            'balancedue': money_column('Balance Due'),
+                            'status': 'Status'
+                        },
+                        search_columns=['status'],
+                        sort_column='invoicedate'
+                    )
                 else:
                     st.info("No invoices found")
                 
                 st.markdown("#### Payments")
                 if history['payments']:
-                    df_payments = pd.DataFrame(history['payments'])
-                    # Rename columns for better display
-                    df_payments = df_payments.rename(columns={
-                        'paymentid': 'Payment ID',
-                        'invoiceid': 'Invoice ID',
-                        'paymentdate': 'Payment Date',
-                        'paymentmethod': 'Method',
-                        'amountpaid': 'Amount'
-                    })
-                    # Format the payment date
-                    if 'Payment Date' in df_payments.columns:
-                        df_payments['Payment Date'] = pd.to_datetime(df_payments['Payment Date']).dt.strftime('%Y-%m-%d %H:%M')
-                    # Format the amount with 2 decimal places
-                    if 'Amount' in df_payments.columns:
-                        df_payments['Amount'] = df_payments['Amount'].apply(lambda x: f"Rs.{x:,.2f}")
-                    st.dataframe(df_payments)
+                    paged_grid(
+                        payments_frame(history['payments'])[['paymentid', 'invoiceid', 'paymentdate', 'paymentmethod', 'amountpaid']],
+                        key="history_payments",
+                        column_config={
+                            'paymentid': st.column_config.NumberColumn('Payment ID', format="%d"),
+                            'invoiceid': st.column_config.NumberColumn('Invoice ID', format="%d"),
+                            'paymentdate': st.column_config.DateColumn('Payment Date', format="YYYY-MM-DD"),
+                            'paymentmethod': 'Method',
+                            'amountpaid': money_column('Amount')
+                        },
+                        search_columns=['paymentmethod'],
+                        sort_column='paymentdate'
+                    )
                 else:
                     st.info("No payments found")
             else:
                 st.info("No history found for this customer")
         else:
-            st.info("No customers available")
\ No newline at end of file
+            st.info("No customers available")
+    
+    with tab4:
+        show_segments_tab()
+
+def show_segments_tab():
+    st.subheader("Customer Segments")
+    st.caption("Customers ranked 1-5 on how recently they were invoiced (R), how often (F) and how much "
+               "they have paid (M). Lifetime value projects their yearly spend so far forward.")
+    segments = get_customer_segments(datetime.now().strftime("%Y-%m-%d"))
+    
+    if segments is None:
+        st.info("Segments are computed over the DuckDB analytics snapshot; install duckdb to enable them")
+        return
+    if segments.empty:
+        st.info("No invoiced customers yet")
+        return
+    
+    # Customers and value per segment, largest first
+    summary = segments.groupby('segment', observed=True).agg(
+        customers=('customerid', 'size'),
+        value=('lifetime_value', 'sum')
+    ).sort_values('customers', ascending=False)
+    cols = st.columns(len(summary))
+    for col, row in zip(cols, summary.itertuples()):
+        with col:
+            st.metric(row.Index, f"{row.customers:,}", f"Rs. {row.value:,.0f} LTV", delta_color="off")
+    
+    selected = st.multiselect("Show segments", list(summary.index), placeholder="All segments")
+    if selected:
+        segments = segments[segments['segment'].isin(selected)]
+    
+    paged_grid(
+        segments,
+        key="customer_segments",
+        column_config={
+            'customerid': st.column_config.NumberColumn('ID', format="%d"),
+            'customername': 'Customer',
+            'recency_days': st.column_config.NumberColumn('Days Since Invoice', format="%d"),
+            'frequency': st.column_config.NumberColumn('Invoices', format="%d"),
+            'monetary': money_column('Paid'),
+            'r_score': 'R',
+            'f_score': 'F',
+            'm_score': 'M',
+            'segment': 'Segment',
+            'lifetime_value': money_column('Lifetime Value')
+        },
+        search_columns=['customername'],
+        sort_column='lifetime_value'
+    )
@@ -1,8 +1,10 @@
+import time
 import streamlit as st
-import pandas as pd
-import plotly.express as px
+import resilience
+import outbox
 from datetime import datetime, timedelta
-from utils import get_customers, get_invoices, get_payments
+from utils import get_customers, get_invoices, get_payments, OPEN_INVOICE_STATUSES
+from frames import invoices_frame, payments_frame, money_column
 
 def show_dashboard_page():
     st.title("🐕 Dashboard Overview")
@@ -15,11 +17,14 @@ def show_dashboard_page():
     
     # Calculate metrics with error handling
     total_customers = len(customers) if customers else 0
-    pending_invoices = len([inv for inv in invoices if inv.get('status', '') == 'unpaid']) if invoices else 0
-    total_revenue = sum(float(p.get('amount', 0)) for p in payments) if payments else 0
+    open_invoices = [inv for inv in invoices if inv.status in OPEN_INVOICE_STATUSES] if invoices else []
+    pending_invoices = len(open_invoices)
+    # Balances are maintained on each invoice, so no need to aggregate payments here
+    total_revenue = sum(inv.amountpaid for inv in invoices) if invoices else 0
+    total_outstanding = sum(inv.balancedue for inv in open_invoices)
     
     # Create cards
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.markdown(f"""
         <div class="card">
@@ -44,86 +49,116 @@ def show_dashboard_page():
         </div>
         """, unsafe_allow_html=True)
     
+    with col4:
+        st.markdown(f"""
+        <div class="card">
+            <h3>Outstanding</h3>
+            <h1>${total_outstanding:,.2f}</h1>
+        </div>
+        """, unsafe_allow_html=True)
+    
     st.markdown("---")
     
     # Recent activities with proper error handling
     st.subheader("Recent Activities")
     
+    invoices_df = invoices_frame(invoices) if invoices else None
+    payments_df = payments_frame(payments) if payments else None
+    
     # Recent invoices
-    if invoices:
-        recent_invoices = sorted(invoices, key=lambda x: x.get('date', ''), reverse=True)[:5]
+    if invoices_df is not None:
         st.markdown("*Recent Invoices*")
-        
-        # Create DataFrame with only available columns
-        invoice_data = []
-        for inv in recent_invoices:
-            invoice_data.append({
-                'invoice_id': inv.get('invoice_id', 'N/A'),
-                'customer_name': inv.get('customer_name', 'Unknown'),
-                'date': inv.get('date', 'N/A'),
-                'status': inv.get('status', 'N/A'),
-                'grand_total': inv.get('grand_total', 0)
-            })
-        
-        df_invoices = pd.DataFrame(invoice_data)
-        st.dataframe(df_invoices)
+        st.dataframe(
+            invoices_df.nlargest(5, 'invoicedate')[['invoiceid', 'customername', 'invoicedate', 'status', 'grandtotal']],
+            column_config={
+                'invoicedate': st.column_config.DateColumn(format="YYYY-MM-DD"),
+                'grandtotal': money_column()
+            },
+            hide_index=True
+        )
     else:
         st.info("No invoices available")
     
     # Recent payments
-    if payments:
-        recent_payments = sorted(payments, key=lambda x: x.get('date', ''), reverse=True)[:5]
+    if payments_df is not None:
         st.markdown("*Recent Payments*")
-        
-        # Create DataFrame with only available columns
-        payment_data = []
-        for p in recent_payments:
-            payment_data.append({
-                'payment_id': p.get('payment_id', 'N/A'),
-                'invoice_id': p.get('invoice_id', 'N/A'),
-                'date': p.get('date', 'N/A'),
-                'method': p.get('method', 'N/A'),
-                'amount': p.get('amount', 0)
-            })
-        
-        df_payments = pd.DataFrame(payment_data)
-        st.dataframe(df_payments)
+        st.dataframe(
+            payments_df.nlargest(5, 'paymentdate')[['paymentid', 'invoiceid', 'paymentdate', 'paymentmethod', 'amountpaid']],
+            column_config={
+                'paymentdate': st.column_config.DateColumn(format="YYYY-MM-DD"),
+                'amountpaid': money_column()
+            },
+            hide_index=True
+        )
     else:
         st.info("No payments available")
     
     # Quick charts (only show if data exists)
-    if invoices and payments:
+    if invoices_df is not None and payments_df is not None:
+        import plotly.express as px
+        from charts import weekly_revenue_figure
+        
         st.markdown("---")
         st.subheader("Quick Insights")
         
         col1, col2 = st.columns(2)
         with col1:
             try:
-                # Revenue by week
-                payments_df = pd.DataFrame(payments)
-                payments_df['date'] = pd.to_datetime(payments_df['date'])
-                payments_df['week'] = payments_df['date'].dt.strftime('%Y-%U')
-                weekly_revenue = payments_df.groupby('week')['amount'].sum().reset_index()
-                fig = px.line(weekly_revenue, x='week', y='amount', title='Weekly Revenue')
-                st.plotly_chart(fig, use_container_width=True)
+                # Revenue by week, cached until a payment changes
+                fig = weekly_revenue_figure()
+                if fig:
+                    st.plotly_chart(fig, use_container_width=True)
             except Exception as e:
                 st.error(f"Could not generate revenue chart: {str(e)}")
         
         with col2:
             try:
                 # Invoice status
-                invoices_df = pd.DataFrame(invoices)
                 status_counts = invoices_df['status'].value_counts().reset_index()
                 fig = px.pie(status_counts, values='count', names='status', title='Invoice Status')
                 st.plotly_chart(fig, use_container_width=True)
             except Exception as e:
                 st.error(f"Could not generate status chart: {str(e)}")
 
+def show_staleness_banner(placeholder):
+    """Say so above the page when some of it is cached data Supabase couldn't refresh"""
+    stale_since = resilience.stale_since()
+    if stale_since is None:
+        return
+    minutes = int((time.time() - stale_since) // 60)
+    age = "less than a minute" if minutes < 1 else f"{minutes} minute{'s' if minutes != 1 else ''}"
+    placeholder.warning(
+        f"⚠️ The database isn't responding, so this page shows saved data from up to {age} ago. "
+        "It refreshes on its own once the connection is back; changes may not save until then."
+    )
+
+def show_outbox_banner(placeholder):
+    """Say how many invoices and payments taken offline are still waiting to be saved"""
+    try:
+        counts = outbox.status()
+    except Exception as e:
+        placeholder.error(f"Offline queue unavailable: {str(e)}")
+        return
+    pending = [f"{c['pending']} {kind}{'s' if c['pending'] != 1 else ''}" for kind, c in counts.items() if c['pending']]
+    failed = sum(c['failed'] for c in counts.values())
+    if failed:
+        placeholder.error(f"{failed} invoice(s) or payment(s) taken offline couldn't be saved. "
+                          "Run `python outbox.py` to see why.")
+    elif pending:
+        placeholder.info(f"{' and '.join(pending)} taken offline will be saved once the database is reachable.")
+
 def show_dashboard():
     st.sidebar.title("Navigation")
     page = st.sidebar.radio("", ["Dashboard", "Customers", "Services", "Invoices", "Payments", "Reports", "Logout"])
     
+    # Filled in once the page has loaded its data
+    resilience.begin_run()
+    banner = st.empty()
+    outbox_banner = st.empty()
+    
     if page == "Logout":
+        from auth import logout
+        logout()
         st.session_state.logged_in = False
         st.rerun()
     elif page == "Customers":
@@ -142,4 +177,7 @@ def show_dashboard():
         from reports import show_reports_page
         show_reports_page()
     else:
-        show_dashboard_page()
\ No newline at end of file
+        show_dashboard_page()
+    
+    show_staleness_banner(banner)
+    show_outbox_banner(outbox_banner)
\ No newline at end of file
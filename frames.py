@@ -0,0 +1,68 @@
+import streamlit as st
+import pandas as pd
+
+# Compact, typed tables for the listings the pages show, built from the records
+# in models.py. Ids are int32, dates datetime64 and repeated text (names,
+# statuses, methods) categorical, so a listing costs a few bytes per cell instead
+# of a dict and a formatted string per row. Pages format money and dates with
+# st.column_config.
+
+def _dates(values):
+    return pd.to_datetime(pd.Series(values, dtype='object'))
+
+def _money(values):
+    return pd.Series(values, dtype='float64')
+
+def customers_frame(customers):
+    return pd.DataFrame({
+        'customerid': pd.Series([c.customerid for c in customers], dtype='int32'),
+        'customername': pd.Series([c.customername for c in customers], dtype='string'),
+        'email': pd.Series([c.email for c in customers], dtype='string'),
+        'phonenumber': pd.Series([c.phonenumber for c in customers], dtype='string'),
+        'address': pd.Series([c.address for c in customers], dtype='string'),
+        'createddate': _dates([c.createddate for c in customers])
+    })
+
+def services_frame(services):
+    return pd.DataFrame({
+        'serviceid': pd.Series([s.serviceid for s in services], dtype='int32'),
+        'servicename': pd.Series([s.servicename for s in services], dtype='string'),
+        'description': pd.Series([s.description for s in services], dtype='string'),
+        'unitprice': _money([s.unitprice for s in services]),
+        'createddate': _dates([s.createddate for s in services])
+    })
+
+def invoices_frame(invoices):
+    """One row per Invoice: invoiceid, customername, invoicedate, grandtotal, balancedue, status"""
+    return pd.DataFrame({
+        'invoiceid': pd.Series([inv.invoiceid for inv in invoices], dtype='int32'),
+        'customername': pd.Series([inv.customername for inv in invoices], dtype='category'),
+        'invoicedate': _dates([inv.invoicedate for inv in invoices]),
+        'grandtotal': _money([inv.grandtotal for inv in invoices]),
+        'balancedue': _money([inv.balancedue for inv in invoices]),
+        'status': pd.Series([inv.status for inv in invoices], dtype='category')
+    })
+
+def payments_frame(payments):
+    """One row per Payment"""
+    return pd.DataFrame({
+        'paymentid': pd.Series([p.paymentid for p in payments], dtype='int32'),
+        'invoiceid': pd.Series([p.invoiceid for p in payments], dtype='int32'),
+        'customername': pd.Series([p.customername for p in payments], dtype='category'),
+        'paymentdate': _dates([p.paymentdate for p in payments]),
+        'paymentmethod': pd.Series([p.paymentmethod for p in payments], dtype='category'),
+        'amountpaid': _money([p.amountpaid for p in payments]),
+        'grandtotal': _money([p.grandtotal for p in payments])
+    })
+
+def line_items_frame(items):
+    """LineItems of one invoice"""
+    return pd.DataFrame({
+        'Service': pd.Series([item.servicename for item in items], dtype='category'),
+        'Unit Price': _money([item.unitprice for item in items]),
+        'Quantity': pd.Series([item.quantity for item in items], dtype='int32'),
+        'Total': _money([item.totalprice for item in items])
+    })
+
+def money_column(label=None):
+    return st.column_config.NumberColumn(label, format="Rs. %.2f")
@@ -0,0 +1,56 @@
+import math
+import streamlit as st
+import pandas as pd
+
+# A paged table for long listings. The full frame stays on the server, where it
+# is filtered and sorted; only the visible page is sent to the browser, with its
+# numeric and date columns intact, so st.column_config does the formatting.
+# Paging, sorting and filtering rerun just the grid's fragment.
+
+PAGE_SIZE = 50
+
+def _label(column, column_config):
+    config = column_config.get(column, column)
+    if isinstance(config, dict):
+        return config.get('label') or column
+    return config
+
+@st.fragment
+def paged_grid(df, key, column_config=None, search_columns=None, sort_column=None, page_size=PAGE_SIZE):
+    """Show df a page at a time.
+
+    key must be unique on the page. search_columns are matched, case-insensitively,
+    against the filter text; columns set to None in column_config are hidden and
+    can't be sorted on. Sorts by sort_column, descending, until the user picks one.
+    """
+    column_config = column_config or {}
+    columns = [c for c in df.columns if column_config.get(c, c) is not None]
+
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        query = st.text_input("Filter", key=f"{key}_filter", disabled=not search_columns,
+                              placeholder=", ".join(_label(c, column_config) for c in search_columns or []))
+    with col2:
+        sort_by = st.selectbox("Sort by", columns, key=f"{key}_sort",
+                               index=columns.index(sort_column) if sort_column in columns else 0,
+                               format_func=lambda c: _label(c, column_config))
+    with col3:
+        descending = st.toggle("Descending", value=True, key=f"{key}_desc")
+
+    if query and search_columns:
+        mask = pd.Series(False, index=df.index)
+        for column in search_columns:
+            mask |= df[column].astype('string').str.contains(query, case=False, regex=False, na=False)
+        df = df[mask]
+    df = df.sort_values(sort_by, ascending=not descending, kind='stable', na_position='last')
+
+    pages = max(1, math.ceil(len(df) / page_size))
+    page_key = f"{key}_page"
+    # A narrower filter can leave the remembered page past the end
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input("Page", min_value=1, max_value=pages, key=page_key) if pages > 1 else 1
+
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[start:start + page_size], column_config=column_config, hide_index=True)
+    st.caption(f"{start + 1 if len(df) else 0}-{min(start + page_size, len(df))} of {len(df)} rows")
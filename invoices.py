@@ -2,12 +2,16 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from utils import get_customers, get_services, create_invoice, get_invoices, generate_invoice_pdf, get_invoice_details, check_duplicate_invoice
+from utils import get_recurring_templates, add_recurring_template, set_recurring_template_active, generate_recurring_invoices, get_billing_period, RECURRING_CADENCES, TAX_RATE
+from frames import invoices_frame, line_items_frame, money_column
+from models import LineItem
+from outbox import is_provisional, resolve
 
 def show_invoices_page():
     st.title("🐕 Invoice Management")
     st.markdown("---")
     
-    tab1, tab2 = st.tabs(["Create Invoice", "Invoice List"])
+    tab1, tab2, tab3 = st.tabs(["Create Invoice", "Invoice List", "Recurring Invoices"])
     
     with tab1:
         st.subheader("Create New Invoice")
@@ -23,145 +27,30 @@ def show_invoices_page():
             st.error("No services available. Please add services first.")
             return
         
-        # Store form submission status in session state
+        # Store form submission status in session state. Only the id is kept;
+        # the details come from the shared read cache on each rerun.
         if 'invoice_created' not in st.session_state:
             st.session_state.invoice_created = False
             st.session_state.new_invoice_id = None
-            st.session_state.new_invoice_details = None
         
-        with st.form("create_invoice_form"):
-            # Customer selection
-            customer_id = st.selectbox(
-                "Select Customer",
-                [c['customerid'] for c in customers],
-                format_func=lambda x: f"{next(c['customername'] for c in customers if c['customerid'] == x)}"
-            )
-            
-            # Date selection
-            invoice_date = st.date_input("Invoice Date", datetime.now())
-            
-            # Service selection
-            st.subheader("Add Services")
-            
-            # Initialize service count in session state
-            if 'service_count' not in st.session_state:
-                st.session_state.service_count = 1
-            
-            selected_services = []
-            service_ids_selected = set()  # Track selected service IDs
-            
-            for i in range(st.session_state.service_count):
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    service_id = st.selectbox(
-                        f"Service {i+1}",
-                        [s['serviceid'] for s in services],
-                        format_func=lambda x: f"{next(s['servicename'] for s in services if s['serviceid'] == x)} (Rs. {next(s['unitprice'] for s in services if s['serviceid'] == x):.2f})",
-                        key=f"service_{i}"
-                    )
-                with col2:
-                    quantity = st.number_input(
-                        "Quantity",
-                        min_value=1,
-                        value=1,
-                        key=f"quantity_{i}"
-                    )
-                
-                if service_id:
-                    if service_id in service_ids_selected:
-                        st.error(f"Service {next(s['servicename'] for s in services if s['serviceid'] == service_id)} is selected multiple times. Please select each service only once.")
-                    else:
-                        service_ids_selected.add(service_id)
-                        service = next(s for s in services if s['serviceid'] == service_id)
-                        selected_services.append({
-                            "service_id": service_id,
-                            "name": service['servicename'],
-                            "unit_price": service['unitprice'],
-                            "quantity": quantity,
-                            "total": service['unitprice'] * quantity
-                        })
-            
-            # Add/Remove service buttons
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.form_submit_button("➕ Add Service"):
-                    st.session_state.service_count += 1
-                    st.rerun()
-            with col2:
-                if st.session_state.service_count > 1:
-                    if st.form_submit_button("➖ Remove Service"):
-                        st.session_state.service_count -= 1
-                        st.rerun()
-            
-            # Status selection
-            status = st.radio("Invoice Status", ["Unpaid", "Paid"])
-            
-            # Calculate totals if services are selected
-            if selected_services:
-                subtotal = sum(s['total'] for s in selected_services)
-                tax_rate = 0.10  # 10% tax
-                tax_amount = subtotal * tax_rate
-                cgst = tax_amount / 2
-                sgst = tax_amount / 2
-                grand_total = subtotal + tax_amount
-                
-                # Preview section inside form
-                st.markdown("### Invoice Preview")
-                st.markdown("#### Services")
-                preview_df = pd.DataFrame([{
-                    'Service': s['name'],
-                    'Unit Price': f"Rs. {s['unit_price']:,.2f}",
-                    'Quantity': s['quantity'],
-                    'Total': f"Rs. {s['total']:,.2f}"
-                } for s in selected_services])
-                st.table(preview_df)
-                
-                # Show totals
-                st.markdown("#### Amount Details")
-                col1, col2 = st.columns([1, 1])
-                with col1:
-                    st.markdown("**Subtotal:**")
-                    st.markdown("**CGST (5%):**")
-                    st.markdown("**SGST (5%):**")
-                    st.markdown("**Grand Total:**")
-                with col2:
-                    st.markdown(f"**Rs. {subtotal:,.2f}**")
-                    st.markdown(f"**Rs. {cgst:,.2f}**")
-                    st.markdown(f"**Rs. {sgst:,.2f}**")
-                    st.markdown(f"**Rs. {grand_total:,.2f}**")
-            
-            # Submit button
-            submit_button = st.form_submit_button("Create Invoice")
-            
-            if submit_button:
-                if not selected_services:
-                    st.error("Please add at least one service")
-                elif check_duplicate_invoice(customer_id, invoice_date.strftime("%Y-%m-%d")):
-                    st.error("An invoice already exists for this customer on the selected date")
-                else:
-                    invoice_data = {
-                        "customer_id": customer_id,
-                        "date": invoice_date.strftime("%Y-%m-%d"),
-                        "services": selected_services,
-                        "subtotal": subtotal,
-                        "tax": tax_amount,
-                        "cgst": cgst,
-                        "sgst": sgst,
-                        "grand_total": grand_total,
-                        "status": status
-                    }
-                    
-                    invoice_id = create_invoice(invoice_data)
-                    if invoice_id:
-                        st.session_state.invoice_created = True
-                        st.session_state.new_invoice_id = invoice_id
-                        st.session_state.new_invoice_details = get_invoice_details(invoice_id)
-                        st.success(f"Invoice #{invoice_id} created successfully!")
+        show_invoice_form(customers, services)
+        
+        # An invoice queued while the database was unreachable gets its number once it's saved
+        if is_provisional(st.session_state.new_invoice_id):
+            saved_id = resolve(st.session_state.new_invoice_id)
+            if saved_id:
+                st.session_state.new_invoice_id = saved_id
+            elif st.session_state.invoice_created:
+                st.success(f"Invoice {st.session_state.new_invoice_id} saved offline. It gets its invoice number "
+                           "and PDF once the database is reachable again.")
         
         # PDF Generation and Download - Outside the form
-        if st.session_state.invoice_created and st.session_state.new_invoice_id and st.session_state.new_invoice_details:
-            invoice_details = st.session_state.new_invoice_details
-            customer = next(c for c in customers if c['customerid'] == invoice_details['customerid'])
+        new_invoice_id = st.session_state.new_invoice_id
+        invoice_details = get_invoice_details(new_invoice_id) if new_invoice_id and not is_provisional(new_invoice_id) else None
+        if st.session_state.invoice_created and invoice_details:
+            customer = invoice_details.customer
+            
+            st.success(f"Invoice #{st.session_state.new_invoice_id} created successfully!")
             
             # Show final preview before download
             st.markdown("### Final Invoice Preview")
@@ -170,24 +59,22 @@ def show_invoices_page():
             col1, col2 = st.columns(2)
             with col1:
                 st.markdown(f"**Invoice #:** {st.session_state.new_invoice_id}")
-                st.markdown(f"**Date:** {invoice_details['invoicedate'].split('T')[0]}")
-                st.markdown(f"**Status:** {invoice_details['status']}")
+                st.markdown(f"**Date:** {invoice_details.invoicedate:%Y-%m-%d}")
+                st.markdown(f"**Status:** {invoice_details.status}")
             with col2:
-                st.markdown(f"**Customer:** {customer['customername']}")
-                if customer.get('email'):
-                    st.markdown(f"**Email:** {customer['email']}")
-                if customer.get('phonenumber'):
-                    st.markdown(f"**Phone:** {customer['phonenumber']}")
+                st.markdown(f"**Customer:** {customer.customername}")
+                if customer.email:
+                    st.markdown(f"**Email:** {customer.email}")
+                if customer.phonenumber:
+                    st.markdown(f"**Phone:** {customer.phonenumber}")
             
             # Services
             st.markdown("#### Services")
-            services_df = pd.DataFrame([{
-                'Service': s['name'],
-                'Unit Price': f"Rs. {s['unit_price']:,.2f}",
-                'Quantity': s['quantity'],
-                'Total': f"Rs. {s['total']:,.2f}"
-            } for s in invoice_details['services']])
-            st.table(services_df)
+            st.dataframe(
+                line_items_frame(invoice_details.items),
+                column_config={'Unit Price': money_column(), 'Total': money_column()},
+                hide_index=True
+            )
             
             # Amount Details
             st.markdown("#### Amount Details")
@@ -198,10 +85,10 @@ def show_invoices_page():
                 st.markdown("**SGST (5%):**")
                 st.markdown("**Grand Total:**")
             with amount_col2:
-                st.markdown(f"**Rs. {invoice_details['totalamount']:,.2f}**")
-                st.markdown(f"**Rs. {invoice_details['taxamount']/2:,.2f}**")
-                st.markdown(f"**Rs. {invoice_details['taxamount']/2:,.2f}**")
-                st.markdown(f"**Rs. {invoice_details['grandtotal']:,.2f}**")
+                st.markdown(f"**Rs. {invoice_details.totalamount:,.2f}**")
+                st.markdown(f"**Rs. {invoice_details.taxamount/2:,.2f}**")
+                st.markdown(f"**Rs. {invoice_details.taxamount/2:,.2f}**")
+                st.markdown(f"**Rs. {invoice_details.grandtotal:,.2f}**")
             
             # Generate PDF path but don't show download button yet
             pdf_path = generate_invoice_pdf(st.session_state.new_invoice_id, customer, invoice_details)
@@ -214,19 +101,18 @@ def show_invoices_page():
         invoices = get_invoices()
         
         if invoices:
-            # Convert to DataFrame for display
-            invoice_list = []
-            for inv in invoices:
-                invoice_list.append({
-                    "Invoice #": inv['invoiceid'],
-                    "Customer": inv['customers']['customername'],
-                    "Date": inv['invoicedate'].split('T')[0],
-                    "Amount": f"Rs. {inv['grandtotal']:,.2f}",
-                    "Status": inv['status']
-                })
-            
-            df = pd.DataFrame(invoice_list)
-            st.dataframe(df)
+            df = invoices_frame(invoices)
+            st.dataframe(
+                df.drop(columns=['balancedue']),
+                column_config={
+                    "invoiceid": st.column_config.NumberColumn("Invoice #", format="%d"),
+                    "customername": "Customer",
+                    "invoicedate": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
+                    "grandtotal": money_column("Amount"),
+                    "status": "Status"
+                },
+                hide_index=True
+            )
             
             # Invoice details section
             st.subheader("Invoice Details")
@@ -235,40 +121,39 @@ def show_invoices_page():
             col1, col2 = st.columns([2, 1])
             
             with col1:
+                customer_names = {inv.invoiceid: inv.customername for inv in invoices}
                 selected_invoice_id = st.selectbox(
                     "Select Invoice",
-                    [inv['invoiceid'] for inv in invoices],
-                    format_func=lambda x: f"Invoice #{x} - {next(inv['customers']['customername'] for inv in invoices if inv['invoiceid'] == x)}"
+                    list(customer_names),
+                    format_func=lambda x: f"Invoice #{x} - {customer_names[x]}"
                 )
             
             if selected_invoice_id:
                 invoice_details = get_invoice_details(selected_invoice_id)
                 if invoice_details:
                     # Display invoice details
-                    st.markdown(f"### Invoice #{invoice_details['invoiceid']}")
+                    st.markdown(f"### Invoice #{invoice_details.invoiceid}")
                     detail_col1, detail_col2 = st.columns(2)
                     with detail_col1:
-                        st.markdown(f"**Customer:** {invoice_details['customers']['customername']}")
-                        st.markdown(f"**Date:** {invoice_details['invoicedate'].split('T')[0]}")
-                        st.markdown(f"**Status:** {invoice_details['status']}")
+                        st.markdown(f"**Customer:** {invoice_details.customername}")
+                        st.markdown(f"**Date:** {invoice_details.invoicedate:%Y-%m-%d}")
+                        st.markdown(f"**Status:** {invoice_details.status}")
                     with detail_col2:
-                        st.markdown(f"**Subtotal:** Rs. {invoice_details['totalamount']:,.2f}")
-                        st.markdown(f"**Tax:** Rs. {invoice_details['taxamount']:,.2f}")
-                        st.markdown(f"**Grand Total:** Rs. {invoice_details['grandtotal']:,.2f}")
+                        st.markdown(f"**Subtotal:** Rs. {invoice_details.totalamount:,.2f}")
+                        st.markdown(f"**Tax:** Rs. {invoice_details.taxamount:,.2f}")
+                        st.markdown(f"**Grand Total:** Rs. {invoice_details.grandtotal:,.2f}")
                     
                     # Display services
                     st.markdown("#### Services")
-                    if invoice_details['services']:
-                        services_df = pd.DataFrame([{
-                            'Service': s['name'],
-                            'Unit Price': f"Rs. {s['unit_price']:,.2f}",
-                            'Quantity': s['quantity'],
-                            'Total': f"Rs. {s['total']:,.2f}"
-                        } for s in invoice_details['services']])
-                        st.table(services_df)
+                    if invoice_details.items:
+                        st.dataframe(
+                            line_items_frame(invoice_details.items),
+                            column_config={'Unit Price': money_column(), 'Total': money_column()},
+                            hide_index=True
+                        )
                     
                     # Generate PDF but don't show download button yet
-                    customer = invoice_details['customers']
+                    customer = invoice_details.customer
                     pdf_path = generate_invoice_pdf(selected_invoice_id, customer, invoice_details)
                     if pdf_path:
                         st.session_state.current_pdf_path = pdf_path
@@ -276,6 +161,9 @@ def show_invoices_page():
         else:
             st.info("No invoices found")
 
+    with tab3:
+        show_recurring_invoices_tab(customers, services)
+
     # Add spacing before the download section
     st.markdown("---")
     st.markdown("<br>", unsafe_allow_html=True)
@@ -296,7 +184,203 @@ def show_invoices_page():
             if st.button("Create Another Invoice"):
                 st.session_state.invoice_created = False
                 st.session_state.new_invoice_id = None
-                st.session_state.new_invoice_details = None
                 st.session_state.current_pdf_path = None
                 st.session_state.current_invoice_id = None
-                st.rerun()
\ No newline at end of file
+                st.rerun()
+
+@st.fragment
+def show_invoice_form(customers, services):
+    """The create-invoice form. Adding, removing and editing service lines only
+    reruns this fragment, on the customers and services the page already
+    loaded, so building an invoice makes no backend calls until it is submitted."""
+    with st.form("create_invoice_form"):
+        # Customer selection
+        customer_id = st.selectbox(
+            "Select Customer",
+            [c.customerid for c in customers],
+            format_func=lambda x: f"{next(c.customername for c in customers if c.customerid == x)}"
+        )
+        
+        # Date selection
+        invoice_date = st.date_input("Invoice Date", datetime.now())
+        
+        # Service selection
+        st.subheader("Add Services")
+        
+        # Initialize service count in session state
+        if 'service_count' not in st.session_state:
+            st.session_state.service_count = 1
+        
+        selected_services = []
+        service_ids_selected = set()  # Track selected service IDs
+        
+        for i in range(st.session_state.service_count):
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                service_id = st.selectbox(
+                    f"Service {i+1}",
+                    [s.serviceid for s in services],
+                    format_func=lambda x: f"{next(s.servicename for s in services if s.serviceid == x)} (Rs. {next(s.unitprice for s in services if s.serviceid == x):.2f})",
+                    key=f"service_{i}"
+                )
+            with col2:
+                quantity = st.number_input(
+                    "Quantity",
+                    min_value=1,
+                    value=1,
+                    key=f"quantity_{i}"
+                )
+            
+            if service_id:
+                if service_id in service_ids_selected:
+                    st.error(f"Service {next(s.servicename for s in services if s.serviceid == service_id)} is selected multiple times. Please select each service only once.")
+                else:
+                    service_ids_selected.add(service_id)
+                    service = next(s for s in services if s.serviceid == service_id)
+                    selected_services.append(LineItem(
+                        None, service_id, service.servicename, service.unitprice, quantity, service.unitprice * quantity
+                    ))
+        
+        # Add/Remove service buttons
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.form_submit_button("➕ Add Service"):
+                st.session_state.service_count += 1
+                st.rerun(scope="fragment")
+        with col2:
+            if st.session_state.service_count > 1:
+                if st.form_submit_button("➖ Remove Service"):
+                    st.session_state.service_count -= 1
+                    st.rerun(scope="fragment")
+        
+        # Calculate totals if services are selected
+        if selected_services:
+            subtotal = sum(s.totalprice for s in selected_services)
+            tax_amount = subtotal * TAX_RATE
+            cgst = tax_amount / 2
+            sgst = tax_amount / 2
+            grand_total = subtotal + tax_amount
+            
+            # Preview section inside form
+            st.markdown("### Invoice Preview")
+            st.markdown("#### Services")
+            st.dataframe(
+                line_items_frame(selected_services),
+                column_config={'Unit Price': money_column(), 'Total': money_column()},
+                hide_index=True
+            )
+            
+            # Show totals
+            st.markdown("#### Amount Details")
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                st.markdown("**Subtotal:**")
+                st.markdown("**CGST (5%):**")
+                st.markdown("**SGST (5%):**")
+                st.markdown("**Grand Total:**")
+            with col2:
+                st.markdown(f"**Rs. {subtotal:,.2f}**")
+                st.markdown(f"**Rs. {cgst:,.2f}**")
+                st.markdown(f"**Rs. {sgst:,.2f}**")
+                st.markdown(f"**Rs. {grand_total:,.2f}**")
+        
+        # Submit button
+        submit_button = st.form_submit_button("Create Invoice")
+        
+        if submit_button:
+            if not selected_services:
+                st.error("Please add at least one service")
+            elif check_duplicate_invoice(customer_id, invoice_date.strftime("%Y-%m-%d")):
+                st.error("An invoice already exists for this customer on the selected date")
+            else:
+                invoice_data = {
+                    "customer_id": customer_id,
+                    "date": invoice_date.strftime("%Y-%m-%d"),
+                    "services": selected_services,
+                    "subtotal": subtotal,
+                    "tax": tax_amount,
+                    "cgst": cgst,
+                    "sgst": sgst,
+                    "grand_total": grand_total
+                }
+                
+                invoice_id = create_invoice(invoice_data)
+                if invoice_id:
+                    st.session_state.invoice_created = True
+                    st.session_state.new_invoice_id = invoice_id
+                    # The final preview and PDF download live outside the fragment
+                    st.rerun()
+
+def show_recurring_invoices_tab(customers, services):
+    st.subheader("Generate Recurring Invoices")
+    run_date = st.date_input("Billing Date", datetime.now(), key="recurring_run_date")
+    st.caption(f"Monthly templates bill period {get_billing_period('monthly', run_date)}, "
+               f"quarterly {get_billing_period('quarterly', run_date)}, yearly {get_billing_period('yearly', run_date)}. "
+               "Templates already billed for their period are skipped.")
+    if st.button("Generate Due Invoices"):
+        with st.spinner("Generating invoices..."):
+            result = generate_recurring_invoices(run_date)
+        st.success(f"Created {result['created']} invoice(s), skipped {result['skipped']} already billed.")
+
+    st.subheader("Recurring Templates")
+    templates = get_recurring_templates()
+    if templates:
+        template_list = []
+        for t in templates:
+            template_list.append({
+                "Template #": t['templateid'],
+                "Customer": t['customers']['customername'],
+                "Cadence": t['cadence'].capitalize(),
+                "Services": ", ".join(f"{item['services']['servicename']} x{item['quantity']}" for item in t['recurringinvoiceitems']),
+                "Active": t['active']
+            })
+        st.dataframe(pd.DataFrame(template_list), hide_index=True)
+
+        selected_template_id = st.selectbox(
+            "Select Template",
+            [t['templateid'] for t in templates],
+            format_func=lambda x: f"Template #{x} - {next(t['customers']['customername'] for t in templates if t['templateid'] == x)}"
+        )
+        selected_template = next(t for t in templates if t['templateid'] == selected_template_id)
+        label = "Pause Template" if selected_template['active'] else "Resume Template"
+        if st.button(label):
+            if set_recurring_template_active(selected_template_id, not selected_template['active']):
+                st.rerun()
+    else:
+        st.info("No recurring templates found")
+
+    # Not a form: quantity inputs follow the service selection as it changes
+    st.subheader("New Recurring Template")
+    customer_id = st.selectbox(
+        "Customer",
+        [c.customerid for c in customers],
+        format_func=lambda x: f"{next(c.customername for c in customers if c.customerid == x)}",
+        key="recurring_customer"
+    )
+    cadence = st.selectbox("Cadence", RECURRING_CADENCES, format_func=str.capitalize)
+    service_ids = st.multiselect(
+        "Services",
+        [s.serviceid for s in services],
+        format_func=lambda x: f"{next(s.servicename for s in services if s.serviceid == x)}"
+    )
+    quantities = {}
+    for service_id in service_ids:
+        quantities[service_id] = st.number_input(
+            f"Quantity - {next(s.servicename for s in services if s.serviceid == service_id)}",
+            min_value=1,
+            value=1,
+            key=f"recurring_quantity_{service_id}"
+        )
+
+    if st.button("Save Template"):
+        if not service_ids:
+            st.error("Please add at least one service")
+        else:
+            template_id = add_recurring_template({
+                "customer_id": customer_id,
+                "cadence": cadence,
+                "services": [{"service_id": sid, "quantity": quantities[sid]} for sid in service_ids]
+            })
+            if template_id:
+                st.success(f"Recurring template #{template_id} created successfully!")
+                st.rerun()
@@ -1,5 +1,4 @@
 # Import standard libraries first
-import os
 from dotenv import load_dotenv
 
 # Import Streamlit and set page config before any other Streamlit commands
@@ -11,20 +10,14 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Import other dependencies after page config
-from supabase import create_client, Client
+# Import other dependencies after page config. The dashboard (and with it
+# pandas, plotly, fpdf and the data layer) is only imported once logged in,
+# so the login page comes up without them.
 from auth import show_login_page, init_auth, handle_password_reset
-from dashboard import show_dashboard
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
-)
-
 def main():
     # Check for password reset
     if st.query_params.get("type") == "recovery":
@@ -38,6 +31,7 @@ def main():
     if not st.session_state.get('auth_status'):
         show_login_page()
     else:
+        from dashboard import show_dashboard
         show_dashboard()
 
 if __name__ == "__main__":
@@ -0,0 +1,50 @@
+-- Change notifications for cache invalidation (cache.py): every insert, update
+-- or delete publishes {"table", "op", "key"} on the table_changes channel, and
+-- each app process evicts the cached reads that depend on that row.
+
+-- TG_ARGV[0] is the table name (partitions report their own name in
+-- TG_TABLE_NAME), the remaining arguments are the columns sent as the key.
+-- invoices also sends customerid so per-customer reads can be evicted alone.
+CREATE OR REPLACE FUNCTION public.notify_table_change()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed JSONB := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+    rowkey JSONB := '{}'::jsonb;
+    i INTEGER;
+BEGIN
+    FOR i IN 1 .. TG_NARGS - 1 LOOP
+        rowkey := rowkey || jsonb_build_object(TG_ARGV[i], changed -> TG_ARGV[i]);
+    END LOOP;
+    -- Delivered on commit, so listeners never evict for a write that rolls back
+    PERFORM pg_notify('table_changes', jsonb_build_object('table', TG_ARGV[0], 'op', TG_OP, 'key', rowkey)::text);
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    t RECORD;
+BEGIN
+    FOR t IN
+        SELECT * FROM (VALUES
+            ('customers', ARRAY['customerid']),
+            ('services', ARRAY['serviceid']),
+            ('invoices', ARRAY['invoiceid', 'customerid']),
+            ('invoicedetails', ARRAY['invoiceid', 'serviceid']),
+            ('payments', ARRAY['paymentid', 'invoiceid'])
+        ) AS tracked(tablename, keycolumns)
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notify_change ON public.%I', t.tablename, t.tablename);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_notify_change AFTER INSERT OR UPDATE OR DELETE ON public.%I
+             FOR EACH ROW EXECUTE FUNCTION public.notify_table_change(%s)',
+            t.tablename, t.tablename,
+            (SELECT string_agg(quote_literal(arg), ', ') FROM unnest(t.tablename || t.keycolumns) AS arg)
+        );
+    END LOOP;
+END $$;
+
+-- Check against a local Postgres:
+--   psql -c "LISTEN table_changes" -c "UPDATE services SET unitprice = unitprice WHERE serviceid = 1"
+-- or run `python cache.py` with DATABASE_URL set and make a change from the app.
@@ -0,0 +1,84 @@
+-- Change tracking for incremental sync (sync.py): every row carries updated_at,
+-- maintained by trigger, and deletes leave a tombstone in deletedrows.
+
+CREATE TABLE IF NOT EXISTS public.deletedrows (
+    tablename TEXT NOT NULL,
+    rowkey JSONB NOT NULL,
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+CREATE INDEX IF NOT EXISTS idx_deletedrows_table_deleted_at
+    ON public.deletedrows (tablename, deleted_at);
+
+-- clock_timestamp() rather than now(): rows written late in a long transaction
+-- get a late stamp, so fewer of them fall behind a reader's watermark
+CREATE OR REPLACE FUNCTION public.touch_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+-- TG_ARGV[0] is the table name (partitions report their own name in
+-- TG_TABLE_NAME), the remaining arguments are its key columns
+CREATE OR REPLACE FUNCTION public.record_tombstone()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    rowkey JSONB := '{}'::jsonb;
+    i INTEGER;
+BEGIN
+    FOR i IN 1 .. TG_NARGS - 1 LOOP
+        rowkey := rowkey || jsonb_build_object(TG_ARGV[i], to_jsonb(OLD) -> TG_ARGV[i]);
+    END LOOP;
+    INSERT INTO public.deletedrows (tablename, rowkey) VALUES (TG_ARGV[0], rowkey);
+    RETURN OLD;
+END;
+$$;
+
+DO $$
+DECLARE
+    t RECORD;
+BEGIN
+    FOR t IN
+        SELECT * FROM (VALUES
+            ('customers', ARRAY['customerid']),
+            ('services', ARRAY['serviceid']),
+            ('invoices', ARRAY['invoiceid']),
+            ('invoicedetails', ARRAY['invoiceid', 'serviceid']),
+            ('payments', ARRAY['paymentid'])
+        ) AS tracked(tablename, keycolumns)
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()', t.tablename);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON public.%I (updated_at)', 'idx_' || t.tablename || '_updated_at', t.tablename);
+
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_touch_updated_at ON public.%I', t.tablename, t.tablename);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_touch_updated_at BEFORE INSERT OR UPDATE ON public.%I
+             FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at()',
+            t.tablename, t.tablename
+        );
+
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_tombstone ON public.%I', t.tablename, t.tablename);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_tombstone AFTER DELETE ON public.%I
+             FOR EACH ROW EXECUTE FUNCTION public.record_tombstone(%s)',
+            t.tablename, t.tablename,
+            (SELECT string_agg(quote_literal(arg), ', ') FROM unnest(t.tablename || t.keycolumns) AS arg)
+        );
+    END LOOP;
+END $$;
+
+-- Tombstones are kept for 30 days; sync.py reloads a table in full when its
+-- watermark is older than that
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'purge-deletedrows',
+            '30 3 * * *',
+            'DELETE FROM public.deletedrows WHERE deleted_at < now() - INTERVAL ''30 days'''
+        );
+    END IF;
+END $$;
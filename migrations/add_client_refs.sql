@@ -0,0 +1,84 @@
+-- Client references for writes replayed from the offline queue (outbox.py).
+-- Invoices and payments taken while Supabase was unreachable carry the
+-- provisional id the clerk was shown. The first insert with a reference claims
+-- it in clientrefs; a replay of the same write is skipped, as ON CONFLICT DO
+-- NOTHING would, and the queue looks the saved row's id up here instead.
+-- Kept outside invoices and payments so the rule holds across their partitions.
+
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS clientref TEXT;
+ALTER TABLE public.payments ADD COLUMN IF NOT EXISTS clientref TEXT;
+
+CREATE TABLE IF NOT EXISTS public.clientrefs (
+    clientref TEXT PRIMARY KEY,
+    tablename TEXT NOT NULL,
+    recordid INTEGER NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Replayed line items are upserted, so each service appears once per invoice
+-- (the invoice form already refuses a service selected twice)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_invoicedetails_invoice_service
+    ON public.invoicedetails (invoiceid, serviceid);
+
+-- TG_ARGV[0] is the table name, TG_ARGV[1] its id column
+CREATE OR REPLACE FUNCTION public.claim_client_ref()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.clientref IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO public.clientrefs (clientref, tablename, recordid)
+    VALUES (NEW.clientref, TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::INTEGER)
+    ON CONFLICT DO NOTHING;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+-- A deleted row gives its reference back, so a replay inserts it again
+CREATE OR REPLACE FUNCTION public.release_client_ref()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM public.clientrefs WHERE clientref = OLD.clientref;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_invoices_claim_client_ref ON public.invoices;
+CREATE TRIGGER trg_invoices_claim_client_ref
+    BEFORE INSERT ON public.invoices
+    FOR EACH ROW EXECUTE FUNCTION public.claim_client_ref('invoices', 'invoiceid');
+
+DROP TRIGGER IF EXISTS trg_payments_claim_client_ref ON public.payments;
+CREATE TRIGGER trg_payments_claim_client_ref
+    BEFORE INSERT ON public.payments
+    FOR EACH ROW EXECUTE FUNCTION public.claim_client_ref('payments', 'paymentid');
+
+DROP TRIGGER IF EXISTS trg_invoices_release_client_ref ON public.invoices;
+CREATE TRIGGER trg_invoices_release_client_ref
+    AFTER DELETE ON public.invoices
+    FOR EACH ROW WHEN (OLD.clientref IS NOT NULL) EXECUTE FUNCTION public.release_client_ref();
+
+DROP TRIGGER IF EXISTS trg_payments_release_client_ref ON public.payments;
+CREATE TRIGGER trg_payments_release_client_ref
+    AFTER DELETE ON public.payments
+    FOR EACH ROW WHEN (OLD.clientref IS NOT NULL) EXECUTE FUNCTION public.release_client_ref();
+
+-- References only matter while a replay may still come; the queue keeps
+-- finished writes for a week
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'purge-clientrefs',
+            '15 4 * * *',
+            'DELETE FROM public.clientrefs WHERE created_at < now() - INTERVAL ''30 days'''
+        );
+    END IF;
+END $$;
@@ -0,0 +1,57 @@
+-- Keep each invoice's paid amount and outstanding balance on the invoice itself,
+-- maintained by a trigger on payments, and derive the status from them.
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS amountpaid NUMERIC NOT NULL DEFAULT 0;
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS balancedue NUMERIC
+    GENERATED ALWAYS AS (grandtotal - amountpaid) STORED;
+
+CREATE OR REPLACE FUNCTION public.invoice_payment_status(grandtotal NUMERIC, amountpaid NUMERIC)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN amountpaid >= grandtotal THEN 'Paid'
+        WHEN amountpaid > 0 THEN 'Partially Paid'
+        ELSE 'Unpaid'
+    END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.apply_payment_to_invoice()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- Take back the old amount on update/delete, add the new one on insert/update.
+    -- The row lock taken by UPDATE serialises concurrent payments on one invoice.
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.invoices
+        SET amountpaid = amountpaid - OLD.amountpaid,
+            status = public.invoice_payment_status(grandtotal, amountpaid - OLD.amountpaid)
+        WHERE invoiceid = OLD.invoiceid;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.invoices
+        SET amountpaid = amountpaid + NEW.amountpaid,
+            status = public.invoice_payment_status(grandtotal, amountpaid + NEW.amountpaid)
+        WHERE invoiceid = NEW.invoiceid;
+        RETURN NEW;
+    END IF;
+
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_payments_apply_to_invoice ON public.payments;
+CREATE TRIGGER trg_payments_apply_to_invoice
+    AFTER INSERT OR UPDATE OF amountpaid, invoiceid OR DELETE ON public.payments
+    FOR EACH ROW EXECUTE FUNCTION public.apply_payment_to_invoice();
+
+-- Backfill from existing payments. Invoices marked paid without a payment row
+-- keep their status.
+UPDATE public.invoices i
+SET amountpaid = p.total,
+    status = public.invoice_payment_status(i.grandtotal, p.total)
+FROM (
+    SELECT invoiceid, SUM(amountpaid) AS total
+    FROM public.payments
+    GROUP BY invoiceid
+) p
+WHERE p.invoiceid = i.invoiceid;
@@ -0,0 +1,51 @@
+-- Moves the one-invoice-per-template-and-period rule out of invoices, so it
+-- still holds once invoices is partitioned by date (a unique key on a
+-- partitioned table has to include invoicedate).
+-- Requires create_recurring_invoices_tables.sql; run before
+-- partition_invoices_payments_by_month.sql.
+
+CREATE TABLE IF NOT EXISTS public.recurringinvoiceperiods (
+    templateid INTEGER NOT NULL,
+    billingperiod TEXT NOT NULL,
+    invoiceid INTEGER NOT NULL,
+    CONSTRAINT pk_recurringinvoiceperiods PRIMARY KEY (templateid, billingperiod),
+    CONSTRAINT fk_template FOREIGN KEY (templateid) REFERENCES public.recurringinvoices(templateid) ON DELETE CASCADE
+);
+
+INSERT INTO public.recurringinvoiceperiods (templateid, billingperiod, invoiceid)
+SELECT templateid, billingperiod, invoiceid
+FROM public.invoices
+WHERE templateid IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+-- Claims the period for each generated invoice. A row whose period is already
+-- billed is skipped, as ON CONFLICT DO NOTHING would, which makes the batch
+-- run idempotent even when two runs overlap.
+CREATE OR REPLACE FUNCTION public.claim_recurring_period()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.templateid IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO public.recurringinvoiceperiods (templateid, billingperiod, invoiceid)
+    VALUES (NEW.templateid, NEW.billingperiod, NEW.invoiceid)
+    ON CONFLICT DO NOTHING;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_invoices_claim_recurring_period ON public.invoices;
+CREATE TRIGGER trg_invoices_claim_recurring_period
+    BEFORE INSERT ON public.invoices
+    FOR EACH ROW EXECUTE FUNCTION public.claim_recurring_period();
+
+-- The trigger now enforces the rule, and generate_recurring_invoices() reads
+-- billed periods from recurringinvoiceperiods instead of invoices
+ALTER TABLE public.invoices DROP CONSTRAINT IF EXISTS uq_invoices_template_period;
+DROP INDEX IF EXISTS public.idx_invoices_billingperiod;
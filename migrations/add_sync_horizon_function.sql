@@ -0,0 +1,24 @@
+-- Upper bound for an incremental pull (sync.py, analytics.py).
+-- Requires add_change_tracking.sql.
+--
+-- updated_at and deleted_at are stamped with clock_timestamp() inside the
+-- writing transaction, which may commit long after the stamp. A row stamped at
+-- or before the returned horizon can no longer appear later: the horizon is
+-- older than the start of every transaction that has written and not yet
+-- finished, and settle_seconds behind the database clock besides. Taking it
+-- from the database also keeps app server clocks out of the watermark.
+CREATE OR REPLACE FUNCTION public.sync_horizon(settle_seconds DOUBLE PRECISION DEFAULT 2)
+RETURNS TIMESTAMPTZ
+LANGUAGE sql
+-- pg_stat_activity only shows other roles' transactions to privileged roles
+SECURITY DEFINER
+SET search_path = pg_catalog
+AS $$
+    SELECT LEAST(
+        clock_timestamp() - make_interval(secs => settle_seconds),
+        (SELECT MIN(xact_start) - INTERVAL '1 microsecond'
+         FROM pg_stat_activity
+         WHERE backend_xid IS NOT NULL
+           AND pid <> pg_backend_pid())
+    );
+$$;
@@ -0,0 +1,30 @@
+-- Idempotency keys for the ingestion API (api.py). A client sends the same
+-- Idempotency-Key when it retries a write; the first request claims the key
+-- and stores its response, and every retry gets that response back instead
+-- of creating the invoices or payments a second time.
+
+CREATE TABLE IF NOT EXISTS public.apiidempotencykeys (
+    idempotencykey TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    -- sha256 of the request body; a key reused for a different body is rejected
+    requesthash TEXT NOT NULL,
+    -- NULL while the request that claimed the key is still running
+    statuscode INTEGER,
+    responsebody JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT pk_apiidempotencykeys PRIMARY KEY (idempotencykey, endpoint)
+);
+CREATE INDEX IF NOT EXISTS idx_apiidempotencykeys_created_at
+    ON public.apiidempotencykeys (created_at);
+
+-- Keys are kept for a day, longer than any client retries a request
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'purge-apiidempotencykeys',
+            '45 3 * * *',
+            'DELETE FROM public.apiidempotencykeys WHERE created_at < now() - INTERVAL ''1 day'''
+        );
+    END IF;
+END $$;
@@ -0,0 +1,106 @@
+-- Accounts-receivable aging, aggregated in the database.
+-- Requires add_invoice_balance_columns.sql (invoices.amountpaid / balancedue).
+
+-- Open invoices per customer, oldest first; covers the current-date path
+CREATE INDEX IF NOT EXISTS idx_invoices_open_customer_date
+    ON public.invoices (customerid, invoicedate)
+    INCLUDE (invoiceid, grandtotal, balancedue)
+    WHERE status IN ('Unpaid', 'Partially Paid');
+
+-- Payments made on an invoice up to a date; covers per-invoice payment lookups
+-- and the historical path's aggregate (an index-only scan)
+CREATE INDEX IF NOT EXISTS idx_payments_invoice_date
+    ON public.payments (invoiceid, paymentdate)
+    INCLUDE (amountpaid);
+
+-- Outstanding balance of every invoice as of a date.
+-- For today (or later) the maintained balancedue is read straight off the open
+-- invoices; for a past date the payments made up to that date are replayed.
+-- Only one branch runs: the as_of comparison is a one-time filter.
+CREATE OR REPLACE FUNCTION public.ar_open_balances(as_of DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (
+    invoiceid INTEGER,
+    customerid INTEGER,
+    invoicedate DATE,
+    grandtotal NUMERIC,
+    balancedue NUMERIC,
+    age_days INTEGER
+)
+LANGUAGE sql STABLE AS $$
+    SELECT i.invoiceid, i.customerid, i.invoicedate::date, i.grandtotal, i.balancedue,
+           as_of - i.invoicedate::date
+    FROM public.invoices i
+    WHERE as_of >= CURRENT_DATE
+      AND i.status IN ('Unpaid', 'Partially Paid')
+      AND i.balancedue > 0
+      AND i.invoicedate < as_of + 1
+    UNION ALL
+    SELECT i.invoiceid, i.customerid, i.invoicedate::date, i.grandtotal,
+           i.grandtotal - COALESCE(paid.total, 0),
+           as_of - i.invoicedate::date
+    FROM public.invoices i
+    -- Payments up to as_of summed once and hash-joined, rather than per invoice.
+    -- Grouped on payments: invoices' key includes invoicedate once partitioned.
+    LEFT JOIN (
+        SELECT p.invoiceid, SUM(p.amountpaid) AS total
+        FROM public.payments p
+        WHERE p.paymentdate < as_of + 1
+        GROUP BY p.invoiceid
+    ) paid ON paid.invoiceid = i.invoiceid
+    WHERE as_of < CURRENT_DATE
+      AND i.invoicedate < as_of + 1
+      -- As for today: invoices marked Paid before balances were tracked have no
+      -- payments to replay, and are never outstanding
+      AND (i.status IN ('Unpaid', 'Partially Paid') OR i.balancedue <= 0)
+      AND i.grandtotal - COALESCE(paid.total, 0) > 0;
+$$;
+
+-- Receivables per customer in 0-30 / 31-60 / 61-90 / 90+ day buckets
+CREATE OR REPLACE FUNCTION public.ar_aging(as_of DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (
+    customerid INTEGER,
+    customername VARCHAR,
+    days_0_30 NUMERIC,
+    days_31_60 NUMERIC,
+    days_61_90 NUMERIC,
+    days_90_plus NUMERIC,
+    total_due NUMERIC,
+    open_invoices BIGINT
+)
+LANGUAGE sql STABLE AS $$
+    SELECT b.customerid,
+           c.customername,
+           COALESCE(SUM(b.balancedue) FILTER (WHERE b.age_days <= 30), 0),
+           COALESCE(SUM(b.balancedue) FILTER (WHERE b.age_days BETWEEN 31 AND 60), 0),
+           COALESCE(SUM(b.balancedue) FILTER (WHERE b.age_days BETWEEN 61 AND 90), 0),
+           COALESCE(SUM(b.balancedue) FILTER (WHERE b.age_days > 90), 0),
+           SUM(b.balancedue),
+           COUNT(*)
+    FROM public.ar_open_balances(as_of) b
+    JOIN public.customers c ON c.customerid = b.customerid
+    GROUP BY b.customerid, c.customername
+    ORDER BY SUM(b.balancedue) DESC;
+$$;
+
+-- Drill-down: the open invoices behind one customer's aging row
+CREATE OR REPLACE FUNCTION public.ar_aging_detail(p_customerid INTEGER, as_of DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (
+    invoiceid INTEGER,
+    invoicedate DATE,
+    grandtotal NUMERIC,
+    balancedue NUMERIC,
+    age_days INTEGER,
+    bucket TEXT
+)
+LANGUAGE sql STABLE AS $$
+    SELECT b.invoiceid, b.invoicedate, b.grandtotal, b.balancedue, b.age_days,
+           CASE
+               WHEN b.age_days <= 30 THEN '0-30'
+               WHEN b.age_days <= 60 THEN '31-60'
+               WHEN b.age_days <= 90 THEN '61-90'
+               ELSE '90+'
+           END
+    FROM public.ar_open_balances(as_of) b
+    WHERE b.customerid = p_customerid
+    ORDER BY b.invoicedate;
+$$;
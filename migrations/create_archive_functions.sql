@@ -0,0 +1,16 @@
+-- Removes archived invoices from the hot tables. Called by archive.py once the
+-- rows are safely written to Parquet; runs as one transaction per call so an
+-- interrupted archive run never leaves an invoice without its payments.
+CREATE OR REPLACE FUNCTION public.purge_archived_invoices(invoice_ids INTEGER[])
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    purged INTEGER;
+BEGIN
+    DELETE FROM public.invoicedetails WHERE invoiceid = ANY(invoice_ids);
+    DELETE FROM public.payments WHERE invoiceid = ANY(invoice_ids);
+    DELETE FROM public.invoices WHERE invoiceid = ANY(invoice_ids);
+    GET DIAGNOSTICS purged = ROW_COUNT;
+    RETURN purged;
+END;
+$$;
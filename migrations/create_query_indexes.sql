@@ -0,0 +1,48 @@
+-- Secondary indexes for the filters utils.py issues on hot paths.
+-- Indexes created by create_ar_aging_functions.sql are reused:
+--   idx_invoices_open_customer_date  invoices (customerid, invoicedate) WHERE status is open
+--       -> get_unpaid_invoices(), with or without a customer
+--   idx_payments_invoice_date        payments (invoiceid, paymentdate)
+--       -> get_customer_history() payments .in_('invoiceid', ...), invoice payment lookups
+
+-- get_customer_history(): invoices .eq('customerid')
+-- check_duplicate_invoice(): invoices .eq('customerid').eq('invoicedate')
+CREATE INDEX IF NOT EXISTS idx_invoices_customer_date
+    ON public.invoices (customerid, invoicedate);
+
+-- get_report_data(): invoices .gte/.lte('invoicedate')
+CREATE INDEX IF NOT EXISTS idx_invoices_invoicedate
+    ON public.invoices (invoicedate);
+
+-- get_report_data(), get_revenue_by_period(): payments .gte/.lte('paymentdate')
+-- get_payments(): .order('paymentdate', desc=True)
+CREATE INDEX IF NOT EXISTS idx_payments_paymentdate
+    ON public.payments (paymentdate)
+    INCLUDE (invoiceid, amountpaid);
+
+-- delete_service(): invoicedetails .eq('serviceid')
+-- get_service_performance(): services -> invoicedetails join
+CREATE INDEX IF NOT EXISTS idx_invoicedetails_service
+    ON public.invoicedetails (serviceid, invoiceid);
+
+-- get_invoice_details(): invoicedetails .eq('invoiceid')
+CREATE INDEX IF NOT EXISTS idx_invoicedetails_invoice
+    ON public.invoicedetails (invoiceid);
+
+-- generate_recurring_invoices(): invoices .in_('billingperiod').not_.is_('templateid', 'null')
+CREATE INDEX IF NOT EXISTS idx_invoices_billingperiod
+    ON public.invoices (billingperiod)
+    WHERE templateid IS NOT NULL;
+
+-- get_recurring_templates(active_only=True): recurringinvoices .eq('active', True)
+CREATE INDEX IF NOT EXISTS idx_recurringinvoices_active
+    ON public.recurringinvoices (templateid)
+    WHERE active;
+
+-- authenticate_user(), register_user(), send_password_reset(): users .eq('email')
+CREATE INDEX IF NOT EXISTS idx_users_email
+    ON public.users (email);
+
+ANALYZE public.invoices;
+ANALYZE public.payments;
+ANALYZE public.invoicedetails;
@@ -0,0 +1,33 @@
+-- Recurring invoice templates for customers billed the same bundle every period
+CREATE TABLE IF NOT EXISTS public.recurringinvoices (
+    templateid SERIAL PRIMARY KEY,
+    customerid INTEGER NOT NULL REFERENCES public.customers(customerid),
+    cadence TEXT NOT NULL DEFAULT 'monthly',
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    createddate TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT chk_recurring_cadence CHECK (cadence IN ('monthly', 'quarterly', 'yearly'))
+);
+
+CREATE TABLE IF NOT EXISTS public.recurringinvoiceitems (
+    templateid INTEGER NOT NULL,
+    serviceid INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    CONSTRAINT pk_recurringinvoiceitems PRIMARY KEY (templateid, serviceid),
+    CONSTRAINT fk_template FOREIGN KEY (templateid) REFERENCES public.recurringinvoices(templateid) ON DELETE CASCADE,
+    CONSTRAINT fk_service FOREIGN KEY (serviceid) REFERENCES public.services(serviceid),
+    CONSTRAINT chk_recurring_quantity CHECK (quantity > 0)
+);
+
+-- Invoices generated from a template remember which period they bill.
+-- The unique key makes the batch run idempotent per period; manual invoices
+-- leave both columns NULL and are unaffected.
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS templateid INTEGER REFERENCES public.recurringinvoices(templateid);
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS billingperiod TEXT;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_invoices_template_period') THEN
+        ALTER TABLE public.invoices
+            ADD CONSTRAINT uq_invoices_template_period UNIQUE (templateid, billingperiod);
+    END IF;
+END $$;
@@ -0,0 +1,19 @@
+-- Invoice status always follows the amount paid: whatever status a writer
+-- sends, a new invoice starts from its payments (none, so Unpaid), and a change
+-- to its total or amount paid recomputes it.
+-- Requires add_invoice_balance_columns.sql. Invoices marked Paid before
+-- balances were tracked keep their status until a payment changes them.
+
+CREATE OR REPLACE FUNCTION public.derive_invoice_status()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.status := public.invoice_payment_status(NEW.grandtotal, NEW.amountpaid);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_invoices_derive_status ON public.invoices;
+CREATE TRIGGER trg_invoices_derive_status
+    BEFORE INSERT OR UPDATE OF grandtotal, amountpaid ON public.invoices
+    FOR EACH ROW EXECUTE FUNCTION public.derive_invoice_status();
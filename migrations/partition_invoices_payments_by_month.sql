@@ -0,0 +1,295 @@
+-- Move invoices and payments to monthly range partitions on invoicedate / paymentdate,
+-- so date-bounded report queries only touch the months they ask for.
+--
+-- Run in a maintenance window: the tables are rebuilt in one transaction.
+-- Requires add_recurring_invoice_periods.sql. Every trigger, index and foreign
+-- key on invoices and payments is carried over to the new tables as it is,
+-- whichever migration created it; migrations applied later attach theirs to
+-- the partitioned tables directly. Re-apply any RLS policies or grants your
+-- project has on invoices/payments afterwards.
+--
+-- Partitioning changes two things about the schema:
+--   * Primary keys include the partition column: (invoiceid, invoicedate) and
+--     (paymentid, paymentdate). Ids still come from the same sequences.
+--   * Foreign keys can no longer point at invoices(invoiceid), so payments and
+--     invoicedetails check the invoice exists with a trigger instead.
+
+BEGIN;
+
+-- ======================
+-- Partition management
+-- ======================
+CREATE OR REPLACE FUNCTION public.create_monthly_partition(parent TEXT, month_start DATE)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    first_day DATE := date_trunc('month', month_start)::date;
+    partition_name TEXT := format('%s_%s', parent, to_char(first_day, '"y"YYYY"m"MM'));
+    default_name TEXT := parent || '_default';
+    range_from TIMESTAMPTZ := first_day::timestamp AT TIME ZONE 'UTC';
+    range_to TIMESTAMPTZ := (first_day + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+    key_column TEXT := CASE parent WHEN 'invoices' THEN 'invoicedate' ELSE 'paymentdate' END;
+    in_range TEXT;
+    has_rows BOOLEAN;
+    cols TEXT;
+BEGIN
+    IF to_regclass(format('public.%I', partition_name)) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    -- Rows for the month go to the default partition until it has its own, and
+    -- a partition can't be added while the default still holds rows for it.
+    -- Writers wait until the month is moved out.
+    EXECUTE format('LOCK TABLE public.%I IN EXCLUSIVE MODE', default_name);
+    in_range := format('%I >= %L AND %I < %L', key_column, range_from, key_column, range_to);
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM public.%I WHERE %s)', default_name, in_range) INTO has_rows;
+
+    IF NOT has_rows THEN
+        EXECUTE format(
+            'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+            partition_name, parent, range_from, range_to
+        );
+        RETURN partition_name;
+    END IF;
+
+    -- Build the month on its own, then attach it: the rows are only moved, so
+    -- no trigger may see them as inserted or deleted (balances, change tracking)
+    EXECUTE format(
+        'CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)',
+        partition_name, parent
+    );
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+    FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = parent AND is_generated = 'NEVER';
+    EXECUTE format('INSERT INTO public.%I (%s) SELECT %s FROM public.%I WHERE %s',
+                   partition_name, cols, cols, default_name, in_range);
+
+    EXECUTE format('ALTER TABLE public.%I DISABLE TRIGGER USER', default_name);
+    EXECUTE format('DELETE FROM public.%I WHERE %s', default_name, in_range);
+    EXECUTE format('ALTER TABLE public.%I ENABLE TRIGGER USER', default_name);
+
+    EXECUTE format('ALTER TABLE public.%I ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+                   parent, partition_name, range_from, range_to);
+    RAISE NOTICE 'moved %''s rows out of % into %', to_char(first_day, 'YYYY-MM'), default_name, partition_name;
+    RETURN partition_name;
+END;
+$$;
+
+-- Creates this month's and the next months_ahead months' partitions, and
+-- returns how many it couldn't create. A month that fails is reported and
+-- skipped, so the months after it are still created.
+-- Run daily: by pg_cron (scheduled below) where it is installed, otherwise by
+-- `python batch.py partitions` from cron (see README). Rows for a month
+-- without a partition land in the *_default partitions until one is created.
+CREATE OR REPLACE FUNCTION public.ensure_monthly_partitions(months_ahead INTEGER DEFAULT 3)
+RETURNS INTEGER
+LANGUAGE plpgsql
+-- Adding partitions takes the table owner's rights; callers only need EXECUTE
+SECURITY DEFINER
+SET search_path = public, pg_catalog
+AS $$
+DECLARE
+    m DATE;
+    parent TEXT;
+    failed INTEGER := 0;
+BEGIN
+    FOR m IN
+        SELECT generate_series(
+            date_trunc('month', CURRENT_DATE),
+            date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead),
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        FOREACH parent IN ARRAY ARRAY['invoices', 'payments'] LOOP
+            BEGIN
+                PERFORM public.create_monthly_partition(parent, m);
+            EXCEPTION WHEN OTHERS THEN
+                failed := failed + 1;
+                RAISE WARNING 'could not create the % partition of %: %', to_char(m, 'YYYY-MM'), parent, SQLERRM;
+            END;
+        END LOOP;
+    END LOOP;
+    RETURN failed;
+END;
+$$;
+
+-- ======================
+-- Swap in partitioned tables
+-- ======================
+DO $$
+BEGIN
+    -- A unique key on a partitioned table must include the partition column
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = 'public' AND table_name = 'invoices' AND column_name = 'templateid')
+       AND to_regclass('public.recurringinvoiceperiods') IS NULL THEN
+        RAISE EXCEPTION 'apply add_recurring_invoice_periods.sql first';
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_index
+               WHERE indrelid IN ('public.invoices'::regclass, 'public.payments'::regclass)
+                 AND indisunique AND NOT indisprimary) THEN
+        RAISE EXCEPTION 'invoices or payments has a unique index other than its primary key; it cannot be partitioned';
+    END IF;
+    -- The first ar_open_balances grouped by invoiceid, which stops being the key
+    IF to_regprocedure('public.ar_open_balances(date)') IS NOT NULL
+       AND pg_get_functiondef('public.ar_open_balances(date)'::regprocedure) LIKE '%GROUP BY i.invoiceid%' THEN
+        RAISE EXCEPTION 're-apply create_ar_aging_functions.sql first';
+    END IF;
+END $$;
+
+-- Triggers, indexes and outgoing foreign keys to recreate on the new tables
+-- once their rows are copied (so the copy fires no triggers)
+CREATE TEMP TABLE partition_carryover (
+    seq SERIAL,
+    stmt TEXT NOT NULL
+) ON COMMIT DROP;
+
+INSERT INTO partition_carryover (stmt)
+SELECT format('ALTER TABLE %s ADD CONSTRAINT %I %s', conrelid::regclass, conname, pg_get_constraintdef(oid))
+FROM pg_constraint
+WHERE contype = 'f'
+  AND conrelid IN ('public.invoices'::regclass, 'public.payments'::regclass)
+  AND confrelid <> 'public.invoices'::regclass
+ORDER BY conrelid, conname;
+
+INSERT INTO partition_carryover (stmt)
+SELECT pg_get_indexdef(indexrelid)
+FROM pg_index
+WHERE indrelid IN ('public.invoices'::regclass, 'public.payments'::regclass)
+  AND NOT indisprimary
+ORDER BY indrelid, indexrelid;
+
+INSERT INTO partition_carryover (stmt)
+SELECT pg_get_triggerdef(oid)
+FROM pg_trigger
+WHERE tgrelid IN ('public.invoices'::regclass, 'public.payments'::regclass)
+  AND NOT tgisinternal
+ORDER BY tgrelid, tgname;
+
+DO $$
+DECLARE
+    fk RECORD;
+BEGIN
+    -- Foreign keys into invoices(invoiceid) cannot survive partitioning
+    FOR fk IN
+        SELECT conrelid::regclass AS table_name, conname
+        FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = 'public.invoices'::regclass
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.table_name, fk.conname);
+    END LOOP;
+END $$;
+
+ALTER TABLE public.invoices RENAME TO invoices_unpartitioned;
+ALTER TABLE public.payments RENAME TO payments_unpartitioned;
+ALTER SEQUENCE public.invoices_invoiceid_seq OWNED BY NONE;
+ALTER SEQUENCE public.payments_paymentid_seq OWNED BY NONE;
+
+-- The partition key is part of the primary key, so it cannot be NULL
+UPDATE public.invoices_unpartitioned SET invoicedate = CURRENT_TIMESTAMP WHERE invoicedate IS NULL;
+UPDATE public.payments_unpartitioned SET paymentdate = CURRENT_TIMESTAMP WHERE paymentdate IS NULL;
+
+CREATE TABLE public.invoices (
+    LIKE public.invoices_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS,
+    CONSTRAINT pk_invoices PRIMARY KEY (invoiceid, invoicedate)
+) PARTITION BY RANGE (invoicedate);
+
+CREATE TABLE public.payments (
+    LIKE public.payments_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+    CONSTRAINT pk_payments PRIMARY KEY (paymentid, paymentdate)
+) PARTITION BY RANGE (paymentdate);
+
+CREATE TABLE public.invoices_default PARTITION OF public.invoices DEFAULT;
+CREATE TABLE public.payments_default PARTITION OF public.payments DEFAULT;
+
+ALTER SEQUENCE public.invoices_invoiceid_seq OWNED BY public.invoices.invoiceid;
+ALTER SEQUENCE public.payments_paymentid_seq OWNED BY public.payments.paymentid;
+
+DO $$
+DECLARE
+    m DATE;
+    first_month DATE;
+    cols TEXT;
+BEGIN
+    SELECT date_trunc('month', LEAST(
+        (SELECT MIN(invoicedate) FROM public.invoices_unpartitioned),
+        (SELECT MIN(paymentdate) FROM public.payments_unpartitioned),
+        CURRENT_DATE
+    ))::date INTO first_month;
+
+    FOR m IN
+        SELECT generate_series(first_month, date_trunc('month', CURRENT_DATE), INTERVAL '1 month')::date
+    LOOP
+        PERFORM public.create_monthly_partition('invoices', m);
+        PERFORM public.create_monthly_partition('payments', m);
+    END LOOP;
+    PERFORM public.ensure_monthly_partitions(3);
+
+    -- Copy every stored column; balancedue is generated and recomputed
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+    FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'invoices_unpartitioned' AND is_generated = 'NEVER';
+    EXECUTE format('INSERT INTO public.invoices (%s) SELECT %s FROM public.invoices_unpartitioned', cols, cols);
+
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+    FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'payments_unpartitioned' AND is_generated = 'NEVER';
+    EXECUTE format('INSERT INTO public.payments (%s) SELECT %s FROM public.payments_unpartitioned', cols, cols);
+END $$;
+
+DROP TABLE public.payments_unpartitioned;
+DROP TABLE public.invoices_unpartitioned;
+
+-- ======================
+-- Keys, indexes and triggers on the new tables
+-- ======================
+-- Everything the old tables had: balances, recurring periods, change tracking,
+-- change notifications, client references and the indexes behind them.
+-- Indexes are created on every partition.
+DO $$
+DECLARE
+    carried RECORD;
+BEGIN
+    FOR carried IN SELECT stmt FROM partition_carryover ORDER BY seq LOOP
+        EXECUTE carried.stmt;
+    END LOOP;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.check_invoice_exists()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.invoices WHERE invoiceid = NEW.invoiceid) THEN
+        RAISE EXCEPTION 'invoice % does not exist', NEW.invoiceid
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER trg_payments_check_invoice
+    BEFORE INSERT OR UPDATE OF invoiceid ON public.payments
+    FOR EACH ROW EXECUTE FUNCTION public.check_invoice_exists();
+
+CREATE TRIGGER trg_invoicedetails_check_invoice
+    BEFORE INSERT OR UPDATE OF invoiceid ON public.invoicedetails
+    FOR EACH ROW EXECUTE FUNCTION public.check_invoice_exists();
+
+ANALYZE public.invoices;
+ANALYZE public.payments;
+
+COMMIT;
+
+-- Keep future partitions ahead of the calendar. Without pg_cron nothing would,
+-- so say to schedule batch.py instead.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'ensure-monthly-partitions',
+            '0 3 * * *',
+            'SELECT public.ensure_monthly_partitions(3)'
+        );
+    ELSE
+        RAISE WARNING 'pg_cron is not installed: run `python batch.py partitions` daily from cron to create next months'' partitions';
+    END IF;
+END $$;
@@ -0,0 +1,41 @@
+-- Refuse payments that take an invoice past its grand total, which would leave
+-- balancedue negative. Requires add_invoice_balance_columns.sql; replaces its
+-- apply_payment_to_invoice() and keeps the trigger that calls it.
+--
+-- The error is a check_violation (SQLSTATE 23514), so the API answers 422 and
+-- a batch of payments containing one is rejected as a whole.
+
+CREATE OR REPLACE FUNCTION public.apply_payment_to_invoice()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    overpaid NUMERIC;
+BEGIN
+    -- Take back the old amount on update/delete, add the new one on insert/update.
+    -- The row lock taken by UPDATE serialises concurrent payments on one invoice.
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.invoices
+        SET amountpaid = amountpaid - OLD.amountpaid,
+            status = public.invoice_payment_status(grandtotal, amountpaid - OLD.amountpaid)
+        WHERE invoiceid = OLD.invoiceid;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.invoices
+        SET amountpaid = amountpaid + NEW.amountpaid,
+            status = public.invoice_payment_status(grandtotal, amountpaid + NEW.amountpaid)
+        WHERE invoiceid = NEW.invoiceid
+        RETURNING amountpaid - grandtotal INTO overpaid;
+
+        -- Payments are entered to the paisa against totals that may carry more
+        -- decimals, so paying the rounded balance is not an overpayment
+        IF overpaid > 0.005 THEN
+            RAISE EXCEPTION 'payment of % is more than the balance due on invoice %', NEW.amountpaid, NEW.invoiceid
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NEW;
+    END IF;
+
+    RETURN OLD;
+END;
+$$;
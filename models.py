@@ -0,0 +1,189 @@
+from datetime import date, datetime
+
+# Typed records returned by the data-access functions in utils.py. Dates and
+# money are parsed once here, when a response is turned into records, so pages
+# never re-parse PostgREST strings. __slots__ keeps each record to its fields.
+
+def parse_date(value):
+    """'2025-04-01', '2025-04-01T10:00:00+00:00' or a date/datetime to a date"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+def parse_money(value):
+    return float(value) if value is not None else 0.0
+
+def _embedded_name(row, table, column):
+    # Names come embedded (customers!inner(...)) from the hot tables and flat from the archive
+    embedded = row.get(table)
+    if embedded:
+        return embedded.get(column, 'Unknown')
+    return row.get(column, 'Unknown')
+
+class Customer:
+    __slots__ = ('customerid', 'customername', 'email', 'phonenumber', 'address', 'createddate')
+
+    def __init__(self, customerid, customername, email=None, phonenumber=None, address=None, createddate=None):
+        self.customerid = customerid
+        self.customername = customername
+        self.email = email
+        self.phonenumber = phonenumber
+        self.address = address
+        self.createddate = createddate
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row['customerid'],
+            row.get('customername', 'Unknown'),
+            row.get('email'),
+            row.get('phonenumber'),
+            row.get('address'),
+            parse_date(row.get('createddate'))
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        from_row = cls.from_row
+        return [from_row(row) for row in rows or []]
+
+class Service:
+    __slots__ = ('serviceid', 'servicename', 'description', 'unitprice', 'createddate')
+
+    def __init__(self, serviceid, servicename, description=None, unitprice=0.0, createddate=None):
+        self.serviceid = serviceid
+        self.servicename = servicename
+        self.description = description
+        self.unitprice = unitprice
+        self.createddate = createddate
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row['serviceid'],
+            row['servicename'],
+            row.get('description'),
+            parse_money(row.get('unitprice')),
+            parse_date(row.get('createddate'))
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        from_row = cls.from_row
+        return [from_row(row) for row in rows or []]
+
+class LineItem:
+    __slots__ = ('invoiceid', 'serviceid', 'servicename', 'unitprice', 'quantity', 'totalprice')
+
+    def __init__(self, invoiceid, serviceid, servicename, unitprice, quantity, totalprice):
+        self.invoiceid = invoiceid
+        self.serviceid = serviceid
+        self.servicename = servicename
+        self.unitprice = unitprice
+        self.quantity = quantity
+        self.totalprice = totalprice
+
+    @classmethod
+    def from_row(cls, row):
+        service = row.get('services') or {}
+        return cls(
+            row.get('invoiceid'),
+            row['serviceid'],
+            service.get('servicename', row.get('servicename', 'Unknown')),
+            parse_money(service.get('unitprice', row.get('unitprice'))),
+            row['quantity'],
+            parse_money(row['totalprice'])
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        from_row = cls.from_row
+        return [from_row(row) for row in rows or []]
+
+class Invoice:
+    __slots__ = ('invoiceid', 'customerid', 'customername', 'invoicedate', 'totalamount', 'taxamount',
+                 'grandtotal', 'amountpaid', 'balancedue', 'status', 'customer', 'items')
+
+    def __init__(self, invoiceid, customerid, customername, invoicedate, totalamount, taxamount,
+                 grandtotal, amountpaid, balancedue, status, customer=None, items=None):
+        self.invoiceid = invoiceid
+        self.customerid = customerid
+        self.customername = customername
+        self.invoicedate = invoicedate
+        self.totalamount = totalamount
+        self.taxamount = taxamount
+        self.grandtotal = grandtotal
+        self.amountpaid = amountpaid
+        self.balancedue = balancedue
+        self.status = status
+        self.customer = customer
+        self.items = items if items is not None else []
+
+    @classmethod
+    def from_row(cls, row):
+        grandtotal = parse_money(row['grandtotal'])
+        # Archived rows carry no balance columns; only paid invoices are archived
+        if 'amountpaid' in row:
+            amountpaid = parse_money(row['amountpaid'])
+        else:
+            amountpaid = grandtotal if row['status'] == 'Paid' else 0.0
+        embedded = row.get('customers')
+        return cls(
+            row['invoiceid'],
+            row['customerid'],
+            _embedded_name(row, 'customers', 'customername'),
+            parse_date(row['invoicedate']),
+            parse_money(row.get('totalamount')),
+            parse_money(row.get('taxamount')),
+            grandtotal,
+            amountpaid,
+            parse_money(row['balancedue']) if 'balancedue' in row else grandtotal - amountpaid,
+            row['status'],
+            Customer.from_row({'customerid': row['customerid'], **embedded}) if embedded else None
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        from_row = cls.from_row
+        return [from_row(row) for row in rows or []]
+
+class Payment:
+    __slots__ = ('paymentid', 'invoiceid', 'paymentdate', 'paymentmethod', 'amountpaid',
+                 'customerid', 'customername', 'grandtotal')
+
+    def __init__(self, paymentid, invoiceid, paymentdate, paymentmethod, amountpaid,
+                 customerid=None, customername=None, grandtotal=None):
+        self.paymentid = paymentid
+        self.invoiceid = invoiceid
+        self.paymentdate = paymentdate
+        self.paymentmethod = paymentmethod
+        self.amountpaid = amountpaid
+        self.customerid = customerid
+        self.customername = customername
+        self.grandtotal = grandtotal
+
+    @classmethod
+    def from_row(cls, row):
+        # The invoice and its customer come embedded (invoices!inner(..., customers(...)))
+        # or already flattened, as in the archive
+        invoice = row.get('invoices') or row
+        grandtotal = invoice.get('grandtotal')
+        return cls(
+            row['paymentid'],
+            row['invoiceid'],
+            parse_date(row['paymentdate']),
+            row['paymentmethod'],
+            parse_money(row['amountpaid']),
+            invoice.get('customerid'),
+            _embedded_name(invoice, 'customers', 'customername'),
+            parse_money(grandtotal) if grandtotal is not None else None
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        from_row = cls.from_row
+        return [from_row(row) for row in rows or []]
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+import resilience
+
+# Write-behind journal for invoices and payments taken while Supabase can't be
+# reached. create_invoice and log_payment commit the write to a local SQLite
+# file, hand back a provisional id (P-...) straight away, and a background
+# thread sends the queue in batches once Supabase answers again. Each write
+# carries its provisional id as a client reference that the database claims on
+# insert (see migrations/add_client_refs.sql), so replaying a batch that was
+# partly saved before a crash or timeout never saves anything twice.
+
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'outbox.sqlite')
+FLUSH_SECONDS = 2
+FLUSH_BATCH = 500  # writes per kind per flush; one bulk insert each
+KEEP_DONE_DAYS = 7  # provisional ids stay resolvable this long after they're saved
+KINDS = ['invoice', 'payment']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    ref TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending, done or failed
+    record_id INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS writes_state ON writes (state, kind, seq);
+"""
+
+_local = threading.local()  # one SQLite connection per thread
+_replayers = {}  # kind -> function([(ref, payload)]) -> {ref: record id}, raising on failure
+_flusher = None
+_lock = threading.Lock()
+
+def _db():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(OUTBOX_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # A write acknowledged to the clerk has to survive a power cut
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+# ======================
+# JOURNAL
+# ======================
+def new_ref():
+    return f"P-{uuid.uuid4().hex[:12].upper()}"
+
+def is_provisional(record_id):
+    return isinstance(record_id, str) and record_id.startswith('P-')
+
+def enqueue(kind, ref, payload):
+    """Journal a write and return its provisional id; the same ref is only kept once"""
+    _db().execute(
+        "INSERT OR IGNORE INTO writes (kind, ref, payload, created_at) VALUES (?, ?, ?, ?)",
+        (kind, ref, json.dumps(payload), time.time())
+    )
+    _ensure_flusher()
+    return ref
+
+def has_pending(kind):
+    return _db().execute(
+        "SELECT 1 FROM writes WHERE kind = ? AND state = 'pending' LIMIT 1", (kind,)
+    ).fetchone() is not None
+
+def pending_payloads(kind):
+    return [json.loads(payload) for (payload,) in _db().execute(
+        "SELECT payload FROM writes WHERE kind = ? AND state = 'pending' ORDER BY seq", (kind,)
+    )]
+
+def resolve(ref):
+    """The saved record's id for a provisional id, or None while it is queued"""
+    row = _db().execute("SELECT record_id FROM writes WHERE ref = ?", (ref,)).fetchone()
+    return row[0] if row else None
+
+def status():
+    """{kind: {'pending': n, 'failed': n}} for every kind with queued or failed writes"""
+    counts = {}
+    for kind, state, n in _db().execute(
+        "SELECT kind, state, COUNT(*) FROM writes WHERE state != 'done' GROUP BY kind, state"
+    ):
+        counts.setdefault(kind, {'pending': 0, 'failed': 0})[state] = n
+    return counts
+
+def failed_writes():
+    return [{'ref': ref, 'kind': kind, 'payload': json.loads(payload), 'error': error}
+            for ref, kind, payload, error in _db().execute(
+                "SELECT ref, kind, payload, error FROM writes WHERE state = 'failed' ORDER BY seq")]
+
+def retry_failed():
+    """Queue failed writes again, e.g. once the invoice a payment was for has been fixed"""
+    count = _db().execute("UPDATE writes SET state = 'pending', error = NULL WHERE state = 'failed'").rowcount
+    if count:
+        _ensure_flusher()
+    return count
+
+# ======================
+# FLUSHING
+# ======================
+def register(kind, replay):
+    """Set the function that saves queued writes of kind, and start sending any left from before"""
+    _replayers[kind] = replay
+    try:
+        if has_pending(kind):
+            _ensure_flusher()
+    except Exception as e:
+        print(f"Outbox unavailable: {str(e)}")
+
+def _mark(conn, refs, state, record_ids=None, error=None):
+    now = time.time()
+    conn.executemany(
+        "UPDATE writes SET state = ?, record_id = ?, error = ?, attempts = attempts + 1, updated_at = ? WHERE ref = ?",
+        [(state, (record_ids or {}).get(ref), error, now, ref) for ref in refs]
+    )
+
+def _replay(kind, entries):
+    """Save entries, splitting the batch to find the ones Supabase rejects. False if it's unreachable."""
+    conn = _db()
+    try:
+        record_ids = _replayers[kind](entries)
+    except Exception as e:
+        if resilience.is_transient(e):
+            conn.execute("UPDATE writes SET attempts = attempts + 1, error = ? WHERE ref IN (%s)"
+                         % ','.join('?' * len(entries)), [str(e)] + [ref for ref, _ in entries])
+            return False
+        if len(entries) == 1:
+            print(f"Queued {kind} {entries[0][0]} was rejected: {str(e)}")
+            _mark(conn, [entries[0][0]], 'failed', error=str(e))
+            return True
+        middle = len(entries) // 2
+        return _replay(kind, entries[:middle]) and _replay(kind, entries[middle:])
+
+    refs = [ref for ref, _ in entries]
+    _mark(conn, [ref for ref in refs if ref in record_ids], 'done', record_ids)
+    unsaved = [ref for ref in refs if ref not in record_ids]
+    if unsaved:
+        _mark(conn, unsaved, 'failed', error="not saved")
+    return True
+
+def flush():
+    """Send every queued write Supabase will take now; returns how many are left"""
+    conn = _db()
+    for kind in KINDS:
+        if kind not in _replayers:
+            continue
+        while True:
+            rows = conn.execute(
+                "SELECT ref, payload FROM writes WHERE kind = ? AND state = 'pending' ORDER BY seq LIMIT ?",
+                (kind, FLUSH_BATCH)
+            ).fetchall()
+            if not rows:
+                break
+            if not _replay(kind, [(ref, json.loads(payload)) for ref, payload in rows]):
+                break
+    conn.execute("DELETE FROM writes WHERE state = 'done' AND updated_at < ?",
+                 (time.time() - KEEP_DONE_DAYS * 86400,))
+    return conn.execute("SELECT COUNT(*) FROM writes WHERE state = 'pending'").fetchone()[0]
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name='outbox-flusher', daemon=True)
+            _flusher.start()
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Outbox flush failed: {str(e)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or send the queued offline writes")
+    parser.add_argument("--flush", action="store_true", help="send the queue now")
+    parser.add_argument("--retry-failed", action="store_true", help="queue the failed writes again, then send")
+    args = parser.parse_args()
+    # utils registers its replay functions with the imported module, not __main__
+    import outbox
+    if args.flush or args.retry_failed:
+        import utils
+        if args.retry_failed:
+            print(f"Requeued {outbox.retry_failed()} failed write(s)")
+        print(f"{outbox.flush()} write(s) still queued")
+    print(json.dumps(outbox.status(), indent=2))
+    for write in outbox.failed_writes():
+        print(f"FAILED {write['kind']} {write['ref']}: {write['error']}")
@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from utils import get_customers, get_unpaid_invoices, log_payment, get_payments
+from utils import parse_statement_csv, reconcile_statement, post_reconciled_payments
+from frames import payments_frame, money_column
 
 def show_payments_page():
     st.title("🐕 Payment Management")
@@ -17,15 +19,15 @@ def show_payments_page():
         st.error("No customers available")
         return
     
-    tab1, tab2 = st.tabs(["Log Payment", "Payment History"])
+    tab1, tab2, tab3 = st.tabs(["Log Payment", "Payment History", "Reconcile Statement"])
     
     with tab1:
         st.subheader("Log New Payment")
             
         customer_id = st.selectbox(
             "Select Customer",
-            [c['customerid'] for c in customers],
-            format_func=lambda x: f"{next(c['customername'] for c in customers if c['customerid'] == x)}"
+            [c.customerid for c in customers],
+            format_func=lambda x: f"{next(c.customername for c in customers if c.customerid == x)}"
         )
         
         # Get customer's unpaid invoices
@@ -33,46 +35,45 @@ def show_payments_page():
         
         if not unpaid_invoices:
             st.warning("No unpaid invoices for this customer")
-            return
-            
-        with st.form("log_payment_form"):
-            invoice_id = st.selectbox(
-                "Select Invoice",
-                [inv['invoiceid'] for inv in unpaid_invoices],
-                format_func=lambda x: f"Invoice #{x} (Rs. {next(inv['grandtotal'] for inv in unpaid_invoices if inv['invoiceid'] == x):.2f})"
-            )
+        else:
+            with st.form("log_payment_form"):
+                invoice_id = st.selectbox(
+                    "Select Invoice",
+                    [inv.invoiceid for inv in unpaid_invoices],
+                    format_func=lambda x: f"Invoice #{x} (Rs. {next(inv.balancedue for inv in unpaid_invoices if inv.invoiceid == x):.2f} due)"
+                )
             
-            selected_invoice = next(inv for inv in unpaid_invoices if inv['invoiceid'] == invoice_id)
+                selected_invoice = next(inv for inv in unpaid_invoices if inv.invoiceid == invoice_id)
             
-            payment_method = st.selectbox(
-                "Payment Method",
-                ["Cash", "Card", "Online"]
-            )
+                payment_method = st.selectbox(
+                    "Payment Method",
+                    ["Cash", "Card", "Online"]
+                )
             
-            payment_date = st.date_input("Payment Date", datetime.now())
-            amount = st.number_input(
-                "Amount",
-                min_value=0.01,
-                max_value=float(selected_invoice['grandtotal']),
-                value=float(selected_invoice['grandtotal']),
-                step=0.01
-            )
+                payment_date = st.date_input("Payment Date", datetime.now())
+                amount = st.number_input(
+                    "Amount",
+                    min_value=0.01,
+                    max_value=selected_invoice.balancedue,
+                    value=selected_invoice.balancedue,
+                    step=0.01
+                )
             
-            submit_button = st.form_submit_button("Log Payment")
+                submit_button = st.form_submit_button("Log Payment")
             
-            if submit_button:
-                payment_data = {
-                    "invoice_id": invoice_id,
-                    "date": payment_date.strftime("%Y-%m-%d"),
-                    "method": payment_method,
-                    "amount": amount
-                }
+                if submit_button:
+                    payment_data = {
+                        "invoice_id": invoice_id,
+                        "date": payment_date.strftime("%Y-%m-%d"),
+                        "method": payment_method,
+                        "amount": amount
+                    }
                 
-                payment_id = log_payment(payment_data)
-                if payment_id:
-                    st.success(f"Payment #{payment_id} logged successfully!")
-                    st.session_state.payment_logged = True
-                    st.rerun()
+                    payment_id = log_payment(payment_data)
+                    if payment_id:
+                        st.success(f"Payment #{payment_id} logged successfully!")
+                        st.session_state.payment_logged = True
+                        st.rerun()
     
     with tab2:
         st.subheader("Payment History")
@@ -81,51 +82,107 @@ def show_payments_page():
         print(f"Number of payments fetched: {len(payments) if payments else 0}")
         
         if payments:
-            # Convert to DataFrame for display
-            payment_list = []
-            
-            for p in payments:
-                payment_list.append({
-                    "Payment #": p['paymentid'],
-                    "Invoice #": p['invoiceid'],
-                    "Customer": p['customername'],
-                    "Date": p['paymentdate'].split('T')[0] if isinstance(p['paymentdate'], str) else p['paymentdate'].strftime("%Y-%m-%d"),
-                    "Method": p['paymentmethod'],
-                    "Amount": f"Rs. {float(p['amountpaid']):,.2f}"
-                })
-            
-            print(f"Payment list prepared: {payment_list}")
-            df = pd.DataFrame(payment_list)
+            df = payments_frame(payments)
             st.dataframe(
-                df,
+                df.drop(columns=['grandtotal']),
                 column_config={
-                    "Payment #": st.column_config.NumberColumn(format="%d"),
-                    "Invoice #": st.column_config.NumberColumn(format="%d"),
+                    "paymentid": st.column_config.NumberColumn("Payment #", format="%d"),
+                    "invoiceid": st.column_config.NumberColumn("Invoice #", format="%d"),
+                    "customername": "Customer",
+                    "paymentdate": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
+                    "paymentmethod": "Method",
+                    "amountpaid": money_column("Amount")
                 },
                 hide_index=True
             )
             
             # Payment details
-            if payment_list:
-                st.subheader("Payment Details")
-                selected_payment_id = st.selectbox(
-                    "Select Payment",
-                    [p['paymentid'] for p in payments],
-                    format_func=lambda x: f"Payment #{x}"
-                )
+            st.subheader("Payment Details")
+            selected_payment_id = st.selectbox(
+                "Select Payment",
+                [p.paymentid for p in payments],
+                format_func=lambda x: f"Payment #{x}"
+            )
+            
+            if selected_payment_id:
+                payment = next(p for p in payments if p.paymentid == selected_payment_id)
                 
-                if selected_payment_id:
-                    payment = next(p for p in payments if p['paymentid'] == selected_payment_id)
-                    
-                    st.markdown(f"### Payment #{payment['paymentid']}")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.markdown(f"**Customer:** {payment['customername']}")
-                        st.markdown(f"**Invoice #:** {payment['invoiceid']}")
-                        st.markdown(f"**Date:** {payment['paymentdate'].split('T')[0] if isinstance(payment['paymentdate'], str) else payment['paymentdate'].strftime('%Y-%m-%d')}")
-                    with col2:
-                        st.markdown(f"**Method:** {payment['paymentmethod']}")
-                        st.markdown(f"**Amount:** Rs. {float(payment['amountpaid']):,.2f}")
-                        st.markdown(f"**Invoice Total:** Rs. {float(payment['grandtotal']):,.2f}")
+                st.markdown(f"### Payment #{payment.paymentid}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown(f"**Customer:** {payment.customername}")
+                    st.markdown(f"**Invoice #:** {payment.invoiceid}")
+                    st.markdown(f"**Date:** {payment.paymentdate:%Y-%m-%d}")
+                with col2:
+                    st.markdown(f"**Method:** {payment.paymentmethod}")
+                    st.markdown(f"**Amount:** Rs. {payment.amountpaid:,.2f}")
+                    st.markdown(f"**Invoice Total:** Rs. {payment.grandtotal:,.2f}")
         else:
-            st.info("No payments found")
\ No newline at end of file
+            st.info("No payments found")
+    
+    with tab3:
+        show_reconciliation_tab()
+
+def show_reconciliation_tab():
+    st.subheader("Reconcile Bank/UPI Statement")
+    st.caption("Upload a statement CSV with at least a date and an amount column. "
+               "Invoice numbers in the reference (e.g. INV-42) and payer names are used for matching.")
+
+    statement_file = st.file_uploader("Statement CSV", type=["csv"])
+    if not statement_file:
+        return
+
+    try:
+        statement_rows = parse_statement_csv(statement_file)
+    except Exception as e:
+        st.error(f"Could not read statement: {str(e)}")
+        return
+
+    # One fetch of all unpaid invoices; matching happens in memory
+    matched, unmatched = reconcile_statement(statement_rows, get_unpaid_invoices())
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Matched", len(matched))
+    with col2:
+        st.metric("Needs Review", len(unmatched))
+
+    if matched:
+        st.markdown("#### Matched Payments")
+        st.dataframe(
+            pd.DataFrame([{
+                "Row": m['row'],
+                "Date": m['date'],
+                "Reference": m['reference'],
+                "Invoice #": m['invoice_id'],
+                "Customer": m['customername'],
+                "Amount": m['amount'],
+                "Matched On": m['match_type']
+            } for m in matched]),
+            column_config={
+                "Amount": st.column_config.NumberColumn(format="Rs. %.2f")
+            },
+            hide_index=True
+        )
+
+        if st.button(f"Post {len(matched)} Payment(s)"):
+            payment_ids = post_reconciled_payments(matched)
+            if payment_ids:
+                st.success(f"Posted {len(payment_ids)} payment(s)")
+                st.session_state.payment_logged = True
+
+    if unmatched:
+        st.markdown("#### Unmatched Rows")
+        st.dataframe(
+            pd.DataFrame([{
+                "Row": r['row'],
+                "Date": r['date'],
+                "Reference": r['reference'],
+                "Payer": r['payer'],
+                "Amount": r['amount']
+            } for r in unmatched]),
+            column_config={
+                "Amount": st.column_config.NumberColumn(format="Rs. %.2f")
+            },
+            hide_index=True
+        )
@@ -3,13 +3,26 @@ import pandas as pd
 from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
-from utils import get_report_data, get_service_performance, get_revenue_by_period, generate_report_pdf
+from utils import get_report_data, get_service_performance, generate_report_pdf, get_revenue_dimensions, REVENUE_PERIODS
+from utils import get_ar_aging, get_ar_aging_detail
+from charts import revenue_trend_figure, REVENUE_BREAKDOWNS
+from frames import money_column
+from grid import paged_grid
 import os
 
 def show_reports_page():
     st.title("🐕 Business Reports")
     st.markdown("---")
     
+    tab1, tab2 = st.tabs(["Business Report", "Receivables Aging"])
+    
+    with tab1:
+        show_business_report()
+    
+    with tab2:
+        show_aging_report()
+
+def show_business_report():
     # Date range selection
     col1, col2 = st.columns(2)
     with col1:
@@ -35,27 +48,44 @@ def show_reports_page():
     
     # Summary metrics
     st.subheader("Summary")
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric("Total Revenue", f"Rs. {report_data['total_revenue']:,.2f}")
     with col2:
+        st.metric("Outstanding", f"Rs. {report_data['total_outstanding']:,.2f}")
+    with col3:
         total_invoices = len(report_data['invoices'])
         st.metric("Total Invoices", total_invoices)
-    with col3:
+    with col4:
         total_payments = len(report_data['payments'])
         st.metric("Total Payments", total_payments)
     
     # Revenue trend
     st.subheader("Revenue Trend")
-    period = st.selectbox("Group by", ["day", "week", "month"])
-    revenue_data = get_revenue_by_period(period, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    period = st.selectbox("Group by", list(REVENUE_PERIODS))
+    
+    # Breakdowns and filters are rollups of the snapshot's revenue cube
+    group_by = None
+    filters = {}
+    dimensions = get_revenue_dimensions()
+    if dimensions:
+        group_by = st.selectbox(
+            "Break down by",
+            [None] + list(dimensions),
+            format_func=lambda d: REVENUE_BREAKDOWNS[d] if d else "Nothing"
+        )
+        filter_cols = st.columns(len(dimensions))
+        for col, (dimension, members) in zip(filter_cols, dimensions.items()):
+            with col:
+                filters[dimension] = st.multiselect(REVENUE_BREAKDOWNS[dimension], members, placeholder="All")
     
-    if revenue_data:
-        df_revenue = pd.DataFrame(revenue_data)
-        fig = px.line(df_revenue, x='period_start', y='total_revenue',
-                     title=f"Revenue Trend by {period.capitalize()}",
-                     labels={'period_start': 'Date', 'total_revenue': 'Revenue (Rs.)'})
-        st.plotly_chart(fig)
+    # Downsampled to the chart's width and cached until payments change
+    try:
+        fig = revenue_trend_figure(period, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), group_by, filters)
+        if fig:
+            st.plotly_chart(fig)
+    except Exception as e:
+        st.error(f"Error getting revenue data: {str(e)}")
     
     # Service Performance
     st.subheader("Service Performance")
@@ -74,45 +104,46 @@ def show_reports_page():
                            labels={'servicename': 'Service', 'total_revenue': 'Revenue (Rs.)'})
         st.plotly_chart(fig_revenue)
     
-    # Invoices and Payments Tables
+    # Invoices and Payments Tables, paged on the server
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("Recent Invoices")
         if report_data['invoices']:
             df_invoices = pd.DataFrame(report_data['invoices'])
-            st.dataframe(
+            df_invoices['invoicedate'] = pd.to_datetime(df_invoices['invoicedate'])
+            paged_grid(
                 df_invoices,
+                key="report_invoices",
                 column_config={
-                    "invoiceid": "Invoice #",
-                    "invoicedate": "Date",
+                    "invoiceid": st.column_config.NumberColumn("Invoice #", format="%d"),
+                    "invoicedate": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
                     "customername": "Customer",
-                    "grandtotal": st.column_config.NumberColumn(
-                        "Amount",
-                        format="Rs. %.2f"
-                    ),
+                    "grandtotal": money_column("Amount"),
+                    "balancedue": money_column("Balance Due"),
                     "status": "Status"
                 },
-                hide_index=True
+                search_columns=['customername', 'status'],
+                sort_column='invoicedate'
             )
     
     with col2:
         st.subheader("Recent Payments")
         if report_data['payments']:
             df_payments = pd.DataFrame(report_data['payments'])
-            st.dataframe(
+            df_payments['paymentdate'] = pd.to_datetime(df_payments['paymentdate'])
+            paged_grid(
                 df_payments,
+                key="report_payments",
                 column_config={
-                    "paymentid": "Payment #",
-                    "invoiceid": "Invoice #",
-                    "paymentdate": "Date",
+                    "paymentid": st.column_config.NumberColumn("Payment #", format="%d"),
+                    "invoiceid": st.column_config.NumberColumn("Invoice #", format="%d"),
+                    "paymentdate": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
                     "customername": "Customer",
-                    "amountpaid": st.column_config.NumberColumn(
-                        "Amount",
-                        format="Rs. %.2f"
-                    )
+                    "amountpaid": money_column("Amount")
                 },
-                hide_index=True
+                search_columns=['customername'],
+                sort_column='paymentdate'
             )
     
     # Generate and Download Report
@@ -138,4 +169,69 @@ def show_reports_page():
             )
     else:
         # Disabled button if no data
-        st.button("📊 Generate & Download Report", disabled=True, help="No data available for the selected date range")
\ No newline at end of file
+        st.button("📊 Generate & Download Report", disabled=True, help="No data available for the selected date range")
+
+def show_aging_report():
+    st.subheader("Accounts Receivable Aging")
+    as_of = st.date_input("As of", datetime.now(), key="aging_as_of")
+    
+    # Bucketing happens in the database; only one row per customer comes back
+    aging = get_ar_aging(as_of.strftime("%Y-%m-%d"))
+    
+    if not aging:
+        st.info("No outstanding receivables as of the selected date")
+        return
+    
+    df_aging = pd.DataFrame(aging)
+    bucket_columns = ['days_0_30', 'days_31_60', 'days_61_90', 'days_90_plus', 'total_due']
+    df_aging[bucket_columns] = df_aging[bucket_columns].astype(float)
+    
+    col1, col2, col3, col4, col5 = st.columns(5)
+    for col, column, label in zip(
+        [col1, col2, col3, col4, col5],
+        bucket_columns,
+        ["0-30 Days", "31-60 Days", "61-90 Days", "90+ Days", "Total Due"]
+    ):
+        with col:
+            st.metric(label, f"Rs. {df_aging[column].sum():,.2f}")
+    
+    amount_format = "Rs. %.2f"
+    st.dataframe(
+        df_aging,
+        column_config={
+            "customerid": None,
+            "customername": "Customer",
+            "days_0_30": st.column_config.NumberColumn("0-30", format=amount_format),
+            "days_31_60": st.column_config.NumberColumn("31-60", format=amount_format),
+            "days_61_90": st.column_config.NumberColumn("61-90", format=amount_format),
+            "days_90_plus": st.column_config.NumberColumn("90+", format=amount_format),
+            "total_due": st.column_config.NumberColumn("Total Due", format=amount_format),
+            "open_invoices": "Open Invoices"
+        },
+        hide_index=True
+    )
+    
+    # Drill-down per customer
+    st.markdown("#### Customer Detail")
+    customer_id = st.selectbox(
+        "Select Customer",
+        df_aging['customerid'].tolist(),
+        format_func=lambda x: df_aging.loc[df_aging['customerid'] == x, 'customername'].iloc[0],
+        key="aging_customer"
+    )
+    
+    if customer_id:
+        detail = get_ar_aging_detail(customer_id, as_of.strftime("%Y-%m-%d"))
+        if detail:
+            st.dataframe(
+                pd.DataFrame(detail),
+                column_config={
+                    "invoiceid": "Invoice #",
+                    "invoicedate": "Date",
+                    "grandtotal": st.column_config.NumberColumn("Amount", format=amount_format),
+                    "balancedue": st.column_config.NumberColumn("Balance Due", format=amount_format),
+                    "age_days": "Age (Days)",
+                    "bucket": "Bucket"
+                },
+                hide_index=True
+            )
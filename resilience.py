@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# Keeps a slow or failing Supabase from hanging every session. Each HTTP request
+# has a deadline (REQUEST_TIMEOUT, set on the clients); reads that fail for a
+# transient reason are retried with jittered backoff, but only while a retry
+# could still time out within READ_DEADLINE of the first attempt; and
+# after FAILURE_THRESHOLD transient failures in a row a circuit breaker fails
+# calls straight away for OPEN_SECONDS, then lets a single call through to see
+# whether Supabase is back. While it is open, cache.py serves the last data it
+# read, and the page says how old that is.
+
+REQUEST_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT_SECONDS', '8'))
+READ_DEADLINE = float(os.getenv('SUPABASE_READ_DEADLINE_SECONDS', '12'))
+READ_ATTEMPTS = 3
+BACKOFF_BASE = 0.25  # seconds; doubles per attempt, with full jitter
+BACKOFF_CAP = 2.0
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30
+
+# PostgREST couldn't reach or use the database
+TRANSIENT_PGRST_CODES = {'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+# Postgres connection exceptions, insufficient resources, operator intervention
+# (incl. statement timeout), serialization failure and deadlock
+TRANSIENT_SQLSTATE_PREFIXES = ('08', '53', '57', '40001', '40P01')
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Supabase is unavailable; trying again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def is_transient(error):
+    """Whether error says Supabase is unavailable, rather than that the request was wrong"""
+    import httpx
+
+    if isinstance(error, (CircuitOpenError, httpx.TransportError)):
+        return True
+    # A gateway error page instead of PostgREST's JSON, e.g. a 502 or 503
+    if isinstance(error, json.JSONDecodeError):
+        return True
+    code = str(getattr(error, 'code', '') or '')
+    return code in TRANSIENT_PGRST_CODES or code.startswith(TRANSIENT_SQLSTATE_PREFIXES)
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            retry_in = self._opened_at + self.open_seconds - time.monotonic()
+            if retry_in > 0 or self._probing:
+                raise CircuitOpenError(max(retry_in, 0))
+            # Half-open: this call finds out whether Supabase is back
+            self._probing = True
+
+    def record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            # A failed probe keeps the breaker open for another OPEN_SECONDS
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Circuit breaker opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+breaker = CircuitBreaker()
+
+@contextmanager
+def guard():
+    """Run the block behind the circuit breaker, recording whether Supabase answered"""
+    breaker.before_call()
+    try:
+        yield
+    except Exception as e:
+        # A request Supabase rejected still shows it is up
+        breaker.record(not is_transient(e))
+        raise
+    breaker.record(True)
+
+def call(func, *args):
+    """func(*args) behind the breaker, retried while it fails transiently. For reads only.
+
+    Each attempt can take up to REQUEST_TIMEOUT, so one is only started when the
+    backoff and a whole REQUEST_TIMEOUT still fit before the deadline. That keeps
+    a read within READ_DEADLINE however slowly its attempts fail.
+    """
+    deadline = time.monotonic() + READ_DEADLINE
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            with guard():
+                return func(*args)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            if (not is_transient(e) or attempt == READ_ATTEMPTS - 1
+                    or time.monotonic() + delay + REQUEST_TIMEOUT > deadline):
+                raise
+            print(f"Retrying {func.__qualname__} in {delay:.2f}s after: {str(e)}")
+            time.sleep(delay)
+
+# ======================
+# STALE READS
+# ======================
+# Set per script run (one thread) when cache.py answered with data it couldn't
+# refresh, so the page can show a banner with the age of the oldest of it.
+_run = threading.local()
+
+def begin_run():
+    _run.stale_since = None
+
+def served_stale(loaded_at):
+    oldest = getattr(_run, 'stale_since', None)
+    _run.stale_since = loaded_at if oldest is None else min(oldest, loaded_at)
+    _run.stale_reads = stale_reads() + 1
+
+def stale_reads():
+    """How many stale values this thread has served, for telling whether a read used one"""
+    return getattr(_run, 'stale_reads', 0)
+
+def stale_since():
+    """Wall-clock time the oldest stale value served in this run was read, or None"""
+    return getattr(_run, 'stale_since', None)
@@ -1,6 +1,6 @@
 import streamlit as st
-import pandas as pd
 from utils import get_services, add_service, update_service, delete_service
+from frames import services_frame, money_column
 
 def show_services_page():
     st.title("🐕 Services Management")
@@ -25,7 +25,7 @@ def show_services_page():
                 else:
                     # Check if service with this name already exists
                     existing_services = get_services()
-                    if existing_services and any(s['servicename'].lower() == name.lower() for s in existing_services):
+                    if existing_services and any(s.servicename.lower() == name.lower() for s in existing_services):
                         st.error(f"A service with the name '{name}' already exists! Please use a different name.")
                     else:
                         service_data = {
@@ -41,7 +41,7 @@ def show_services_page():
         services = get_services()
         
         if services:
-            df = pd.DataFrame(services)
+            df = services_frame(services)
             # Rename columns for display
             df = df.rename(columns={
                 'serviceid': 'ID',
@@ -50,30 +50,27 @@ def show_services_page():
                 'unitprice': 'Unit Price',
                 'createddate': 'Created Date'
             })
-            # Format the unit price as currency
-            if 'Unit Price' in df.columns:
-                df['Unit Price'] = df['Unit Price'].apply(lambda x: f"Rs. {x:,.2f}")
-            st.dataframe(df)
+            st.dataframe(df, column_config={'Unit Price': money_column()})
             
             # Edit/Delete functionality
             st.subheader("Manage Services")
-            service_ids = [s['serviceid'] for s in services]
+            service_ids = [s.serviceid for s in services]
             selected_id = st.selectbox(
                 "Select Service to Manage", 
                 service_ids, 
-                format_func=lambda x: f"{next(s['servicename'] for s in services if s['serviceid'] == x)} (Rs. {next(s['unitprice'] for s in services if s['serviceid'] == x):,.2f})"
+                format_func=lambda x: f"{next(s.servicename for s in services if s.serviceid == x)} (Rs. {next(s.unitprice for s in services if s.serviceid == x):,.2f})"
             )
             
             if selected_id:
-                selected_service = next(s for s in services if s['serviceid'] == selected_id)
+                selected_service = next(s for s in services if s.serviceid == selected_id)
                 
                 col1, col2 = st.columns(2)
                 with col1:
                     with st.expander("Edit Service"):
                         with st.form("edit_service_form"):
-                            edit_name = st.text_input("Name", value=selected_service['servicename'])
-                            edit_description = st.text_area("Description", value=selected_service['description'])
-                            edit_price = st.number_input("Unit Price", value=float(selected_service['unitprice']), min_value=0.0, step=0.01)
+                            edit_name = st.text_input("Name", value=selected_service.servicename)
+                            edit_description = st.text_area("Description", value=selected_service.description)
+                            edit_price = st.number_input("Unit Price", value=selected_service.unitprice, min_value=0.0, step=0.01)
                             
                             update_button = st.form_submit_button("Update Service")
                             
@@ -100,7 +97,7 @@ def show_services_page():
                                     st.success("Service deleted successfully!")
                                     st.rerun()
                             except Exception as e:
-                                if "invoiceservices" in str(e):
+                                if "invoicedetails" in str(e):
                                     st.error("Cannot delete this service as it is being used in one or more invoices. Please remove the service from all invoices first.")
                                 else:
                                     st.error(f"Error deleting service: {str(e)}")
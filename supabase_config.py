@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 from supabase import create_client
+from supabase.lib.client_options import ClientOptions
+from resilience import REQUEST_TIMEOUT
 
 # Load environment variables from .env file
 load_dotenv()
@@ -8,4 +10,5 @@ load_dotenv()
 # Initialize Supabase client
 supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_KEY')
-supabase = create_client(supabase_url, supabase_key)
\ No newline at end of file
+supabase = create_client(supabase_url, supabase_key,
+                         options=ClientOptions(postgrest_client_timeout=REQUEST_TIMEOUT))
\ No newline at end of file
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+from supabase_config import supabase
+
+# Key columns of every table with change tracking (migrations/add_change_tracking.sql)
+SYNC_TABLES = {
+    'customers': ['customerid'],
+    'services': ['serviceid'],
+    'invoices': ['invoiceid'],
+    'invoicedetails': ['invoiceid', 'serviceid'],
+    'payments': ['paymentid']
+}
+# The horizon also stays this far behind the database clock, on top of the
+# start of the oldest open write transaction (see public.sync_horizon)
+SETTLE_WINDOW = timedelta(seconds=2)
+# deletedrows is purged after 30 days; an older watermark can't see every delete
+TOMBSTONE_RETENTION = timedelta(days=29)
+PAGE_SIZE = 1000  # PostgREST's default max rows per response
+
+def sync_horizon():
+    """Upper bound for the next pull; becomes the new watermark once the pull is applied.
+
+    Taken from the database (migrations/add_sync_horizon_function.sql), which
+    stamps updated_at: it is older than every write transaction still open, so
+    no row at or below it can commit later, whatever the local clock says.
+    """
+    response = supabase.rpc('sync_horizon', {'settle_seconds': SETTLE_WINDOW.total_seconds()}).execute()
+    return response.data
+
+def needs_full_reload(watermark):
+    return watermark is None or datetime.fromisoformat(watermark) < datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+
+def row_key(table, row):
+    return tuple(row[column] for column in SYNC_TABLES[table])
+
+def _fetch_pages(make_query):
+    rows = []
+    while True:
+        response = make_query().range(len(rows), len(rows) + PAGE_SIZE - 1).execute()
+        rows.extend(response.data or [])
+        if not response.data or len(response.data) < PAGE_SIZE:
+            return rows
+
+def _after(table, row):
+    """PostgREST or= filter for the rows ordered after row by (updated_at, key columns)"""
+    stamp = f'updated_at.eq."{row["updated_at"]}"'
+    keys = SYNC_TABLES[table]
+    terms = [f'updated_at.gt."{row["updated_at"]}"']
+    for i, column in enumerate(keys):
+        ties = [stamp] + [f"{k}.eq.{row[k]}" for k in keys[:i]]
+        terms.append(f"and({','.join(ties + [f'{column}.gt.{row[column]}'])})")
+    return ','.join(terms)
+
+def _fetch_changed(table, watermark, horizon, columns):
+    """Every row of table stamped in (watermark, horizon], a page per request.
+
+    Pages follow the (updated_at, key) order from the last row read rather than
+    an offset, so rows updated while the pull runs (and stamped past the
+    horizon) never shift a row that is still due out of the pages.
+    """
+    if columns != '*':
+        selected = [c.strip() for c in columns.split(',')]
+        columns = ', '.join(selected + [c for c in ['updated_at'] + SYNC_TABLES[table] if c not in selected])
+    order = ','.join(['updated_at'] + SYNC_TABLES[table])
+    rows = []
+    while True:
+        query = supabase.table(table).select(columns).lte('updated_at', horizon)
+        if watermark:
+            query = query.gt('updated_at', watermark)
+        if rows:
+            query = query.or_(_after(table, rows[-1]))
+        response = query.order(order).limit(PAGE_SIZE).execute()
+        rows.extend(response.data or [])
+        if not response.data or len(response.data) < PAGE_SIZE:
+            return rows
+
+def pull_changes(table, watermark, horizon, columns='*'):
+    """Rows of table changed in (watermark, horizon] and the keys deleted in that window.
+
+    With no watermark every row up to the horizon is returned and no deletes.
+    A table with nothing new transfers zero rows.
+    """
+    rows = _fetch_changed(table, watermark, horizon, columns)
+    if not watermark:
+        return rows, []
+
+    # Tombstones are never updated, so offsets are stable once rowkey breaks ties
+    tombstones = _fetch_pages(
+        lambda: supabase.table('deletedrows').select('rowkey').eq('tablename', table)
+        .gt('deleted_at', watermark).lte('deleted_at', horizon).order('deleted_at,rowkey')
+    )
+    return rows, [t['rowkey'] for t in tombstones]
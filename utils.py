@@ -1,10 +1,17 @@
 import streamlit as st
-import pandas as pd
 import os
+import re
 from datetime import datetime, timedelta
-from fpdf import FPDF
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from dotenv import load_dotenv
+import analytics
+import resilience
+import outbox
+from auth import remember_session
+from cache import cached, invalidate, invalidate_rows
+from models import Customer, Service, Invoice, LineItem, Payment
+from archive import archive_covers, get_archive_version, read_archived_invoices, read_archived_payments, read_archived_invoice_details
 
 # Load environment variables
 load_dotenv()
@@ -12,7 +19,8 @@ load_dotenv()
 # Initialize Supabase client
 supabase: Client = create_client(
     supabase_url=os.getenv('SUPABASE_URL'),
-    supabase_key=os.getenv('SUPABASE_KEY')
+    supabase_key=os.getenv('SUPABASE_KEY'),
+    options=ClientOptions(postgrest_client_timeout=resilience.REQUEST_TIMEOUT)
 )
 
 # Print Supabase connection info for debugging
@@ -46,6 +54,8 @@ def authenticate_user(email, password):
             
             if user_response.data:
                 user_data = user_response.data[0]
+                remember_session(auth_response.session, auth_response.user)
+                st.session_state.user_profile.update(user_data)
                 st.session_state.user_id = user_data['userid']
                 st.session_state.email = user_data['email']
                 st.session_state.fullname = user_data['fullname']
@@ -111,11 +121,14 @@ def send_password_reset(email):
 # ======================
 # CUSTOMER FUNCTIONS
 # ======================
+@cached('customers')
+def _load_customers():
+    response = supabase.table('customers').select('*').execute()
+    return Customer.from_rows(response.data)
+
 def get_customers():
     try:
-        # First, let's check what tables are available
-        response = supabase.table('customers').select('*').execute()
-        return response.data
+        return _load_customers()
     except Exception as e:
         st.error(f"Error fetching customers: {str(e)}")
         # Try to get more information about the error
@@ -137,6 +150,7 @@ def add_customer(customer_data):
         }).execute()
         
         if response.data:
+            invalidate('customers', {'customerid': response.data[0]['customerid']})
             st.success("Customer added successfully!")
             return True
         return False
@@ -154,6 +168,7 @@ def update_customer(customer_id, updated_data):
         }).eq('customerid', customer_id).execute()
         
         if response.data:
+            invalidate('customers', {'customerid': customer_id})
             st.success("Customer updated successfully!")
             return True
         return False
@@ -165,6 +180,7 @@ def delete_customer(customer_id):
     try:
         response = supabase.table('customers').delete().eq('customerid', customer_id).execute()
         if response.data:
+            invalidate('customers', {'customerid': customer_id})
             st.success("Customer deleted successfully!")
             return True
         return False
@@ -172,35 +188,44 @@ def delete_customer(customer_id):
         st.error(f"Error deleting customer: {str(e)}")
         return False
 
+@cached('customers', 'invoices', 'payments', key_column='customerid')
+def _load_customer_history(customer_id):
+    # Get customer details
+    customer_response = supabase.table('customers').select('*').eq('customerid', customer_id).execute()
+    customer = Customer.from_row(customer_response.data[0]) if customer_response.data else None
+    
+    # Get invoices for the customer
+    invoices_response = supabase.table('invoices').select('*').eq('customerid', customer_id).execute()
+    invoices = invoices_response.data if invoices_response.data else []
+    
+    # Get payments for the customer's invoices
+    if invoices:
+        invoice_ids = [inv['invoiceid'] for inv in invoices]
+        payments_response = supabase.table('payments').select('''
+            paymentid,
+            invoiceid,
+            paymentdate,
+            paymentmethod,
+            amountpaid
+        ''').in_('invoiceid', invoice_ids).execute()
+        payments = payments_response.data if payments_response.data else []
+    else:
+        payments = []
+    
+    # History is all-time, so closed invoices moved to the archive belong here too
+    if archive_covers(None):
+        invoices.extend(read_archived_invoices(customer_id=customer_id))
+        payments.extend(read_archived_payments(customer_id=customer_id))
+    
+    return {
+        'customer': customer,
+        'invoices': Invoice.from_rows(invoices),
+        'payments': Payment.from_rows(payments)
+    }
+
 def get_customer_history(customer_id):
     try:
-        # Get customer details
-        customer_response = supabase.table('customers').select('*').eq('customerid', customer_id).execute()
-        customer = customer_response.data[0] if customer_response.data else None
-        
-        # Get invoices for the customer
-        invoices_response = supabase.table('invoices').select('*').eq('customerid', customer_id).execute()
-        invoices = invoices_response.data if invoices_response.data else []
-        
-        # Get payments for the customer's invoices
-        if invoices:
-            invoice_ids = [inv['invoiceid'] for inv in invoices]
-            payments_response = supabase.table('payments').select('''
-                paymentid,
-                invoiceid,
-                paymentdate,
-                paymentmethod,
-                amountpaid
-            ''').in_('invoiceid', invoice_ids).execute()
-            payments = payments_response.data if payments_response.data else []
-        else:
-            payments = []
-        
-        return {
-            'customer': customer,
-            'invoices': invoices,
-            'payments': payments
-        }
+        return _load_customer_history(customer_id)
     except Exception as e:
         st.error(f"Error fetching customer history: {str(e)}")
         return {'customer': None, 'invoices': [], 'payments': []}
@@ -208,10 +233,14 @@ def get_customer_history(customer_id):
 # ======================
 # SERVICE FUNCTIONS
 # ======================
+@cached('services')
+def _load_services():
+    response = supabase.table('services').select('*').execute()
+    return Service.from_rows(response.data)
+
 def get_services():
     try:
-        response = supabase.table('services').select('*').execute()
-        return response.data
+        return _load_services()
     except Exception as e:
         st.error(f"Error fetching services: {str(e)}")
         return []
@@ -225,6 +254,7 @@ def add_service(service_data):
         }).execute()
         
         if response.data:
+            invalidate('services', {'serviceid': response.data[0]['serviceid']})
             st.success("Service added successfully!")
             return True
         return False
@@ -241,6 +271,7 @@ def update_service(service_id, updated_data):
         }).eq('serviceid', service_id).execute()
         
         if response.data:
+            invalidate('services', {'serviceid': service_id})
             st.success("Service updated successfully!")
             return True
         return False
@@ -251,7 +282,7 @@ def update_service(service_id, updated_data):
 def delete_service(service_id):
     try:
         # First check if service is used in any invoices
-        check_response = supabase.table('invoiceservices').select('*').eq('serviceid', service_id).execute()
+        check_response = supabase.table('invoicedetails').select('invoiceid').eq('serviceid', service_id).limit(1).execute()
         
         if check_response.data and len(check_response.data) > 0:
             st.error("Cannot delete service as it is being used in one or more invoices. Please remove the service from all invoices first.")
@@ -260,6 +291,7 @@ def delete_service(service_id):
         # If service is not used in any invoices, proceed with deletion
         response = supabase.table('services').delete().eq('serviceid', service_id).execute()
         if response.data:
+            invalidate('services', {'serviceid': service_id})
             return True
         return False
     except Exception as e:
@@ -269,206 +301,617 @@ def delete_service(service_id):
 # ======================
 # INVOICE FUNCTIONS
 # ======================
+@cached('invoices', 'customers')
+def _load_invoices():
+    response = supabase.table('invoices').select('''
+        *,
+        customers!inner(*)
+    ''').execute()
+    return Invoice.from_rows(response.data)
+
 def get_invoices():
     try:
-        response = supabase.table('invoices').select('''
-            *,
-            customers!inner(*)
-        ''').execute()
-        return response.data
+        return _load_invoices()
     except Exception as e:
         st.error(f"Error fetching invoices: {str(e)}")
         return []
 
 def create_invoice(invoice_data):
+    """Create an invoice and return its id.
+
+    While Supabase can't be reached the invoice is queued (see outbox.py) and a
+    provisional id (P-...) is returned instead; it is saved once Supabase is back.
+    """
+    # Sent with the first attempt too, so a queued retry of a write that timed out but went through is skipped
+    invoice_data = {**invoice_data, 'client_ref': outbox.new_ref()}
     try:
-        # Start a transaction by creating the invoice first
-        invoice_response = supabase.table('invoices').insert({
-            'customerid': invoice_data['customer_id'],
-            'invoicedate': invoice_data['date'],
-            'totalamount': invoice_data['subtotal'],
-            'taxamount': invoice_data['tax'],
-            'grandtotal': invoice_data['grand_total'],
-            'status': invoice_data['status'].capitalize()  # Ensure proper case for status
-        }).execute()
+        # Behind earlier queued invoices, so they're saved in order
+        if resilience.breaker.is_open() or outbox.has_pending('invoice'):
+            return outbox.enqueue('invoice', invoice_data['client_ref'], _invoice_payload(invoice_data))
+        return create_invoices([invoice_data])[0]
+    except Exception as e:
+        if resilience.is_transient(e):
+            try:
+                return outbox.enqueue('invoice', invoice_data['client_ref'], _invoice_payload(invoice_data))
+            except Exception as journal_error:
+                e = journal_error
+        st.error(f"Error creating invoice: {str(e)}")
+        return None
 
-        if not invoice_response.data:
-            raise Exception("Failed to create invoice")
+def _invoice_row(invoice_data):
+    return {
+        'customerid': invoice_data['customer_id'],
+        'invoicedate': invoice_data['date'],
+        'totalamount': invoice_data['subtotal'],
+        'taxamount': invoice_data['tax'],
+        'grandtotal': invoice_data['grand_total'],
+        # Status follows the payments recorded against it (add_invoice_balance_columns.sql)
+        'status': 'Unpaid',
+        'clientref': invoice_data.get('client_ref')
+    }
 
-        invoice_id = invoice_response.data[0]['invoiceid']
+def _invoice_payload(invoice_data):
+    """invoice_data as JSON for the queue, line items included"""
+    return {
+        **{k: v for k, v in invoice_data.items() if k != 'services'},
+        'services': [{'serviceid': item.serviceid, 'quantity': item.quantity, 'totalprice': item.totalprice}
+                     for item in invoice_data['services']]
+    }
 
-        # Insert invoice details for each service
-        for service in invoice_data['services']:
-            detail_response = supabase.table('invoicedetails').insert({
-                'invoiceid': invoice_id,
-                'serviceid': service['service_id'],
-                'quantity': service['quantity'],
-                'totalprice': service['total']
-            }).execute()
+def create_invoices(invoice_list):
+    """Insert invoices and their line items in bulk and return their ids, in order.
 
+    Each entry is shaped like create_invoice's invoice_data. Raises on failure,
+    after deleting whatever part of the batch was inserted.
+    """
+    if not invoice_list:
+        return []
+
+    invoice_rows = [_invoice_row(invoice_data) for invoice_data in invoice_list]
+
+    # PostgREST returns inserted rows in the order they were sent
+    created = []
+    try:
+        # Writes aren't retried, but fail straight away while Supabase is down
+        for i in range(0, len(invoice_rows), BULK_INSERT_CHUNK):
+            with resilience.guard():
+                response = supabase.table('invoices').insert(invoice_rows[i:i + BULK_INSERT_CHUNK]).execute()
+            created.extend(response.data or [])
+        if len(created) != len(invoice_rows):
+            raise Exception("Failed to create invoice")
+
+        detail_rows = [{
+            'invoiceid': invoice['invoiceid'],
+            'serviceid': item.serviceid,
+            'quantity': item.quantity,
+            'totalprice': item.totalprice
+        } for invoice, invoice_data in zip(created, invoice_list) for item in invoice_data['services']]
+        for i in range(0, len(detail_rows), BULK_INSERT_CHUNK):
+            with resilience.guard():
+                detail_response = supabase.table('invoicedetails').insert(detail_rows[i:i + BULK_INSERT_CHUNK]).execute()
             if not detail_response.data:
-                # If detail insertion fails, the transaction will be rolled back automatically
                 raise Exception("Failed to add invoice details")
+    except Exception:
+        # Don't leave invoices without line items behind
+        if created:
+            created_ids = [invoice['invoiceid'] for invoice in created]
+            supabase.table('invoicedetails').delete().in_('invoiceid', created_ids).execute()
+            supabase.table('invoices').delete().in_('invoiceid', created_ids).execute()
+        raise
 
-        return invoice_id
+    invoice_ids = [invoice['invoiceid'] for invoice in created]
+    invalidate_rows('invoices', [{'invoiceid': invoice['invoiceid'], 'customerid': invoice['customerid']}
+                                 for invoice in created])
+    invalidate_rows('invoicedetails', [{'invoiceid': invoice_id} for invoice_id in invoice_ids])
+    analytics.mark_stale()
+    return invoice_ids
 
-    except Exception as e:
-        st.error(f"Error creating invoice: {str(e)}")
-        return None
+def _claimed_ids(refs):
+    """Ids of rows an earlier attempt already saved under these client references"""
+    if not refs:
+        return {}
+    with resilience.guard():
+        response = supabase.table('clientrefs').select('clientref, recordid').in_('clientref', refs).execute()
+    return {row['clientref']: row['recordid'] for row in response.data or []}
 
-def get_invoice_details(invoice_id):
-    try:
-        # Get the invoice details including customer information
-        invoice_response = supabase.table('invoices').select('''
-            *,
-            customers!inner(*)
-        ''').eq('invoiceid', invoice_id).execute()
+def _replay_invoices(entries):
+    """Save queued invoices, (client_ref, payload) pairs, and return {client_ref: invoiceid}.
 
-        if not invoice_response.data:
-            return None
+    Safe to run again for the same entries: invoices already saved are skipped
+    by the claim_client_ref trigger and their line items are upserted.
+    """
+    with resilience.guard():
+        response = supabase.table('invoices').insert([_invoice_row(payload) for _, payload in entries]).execute()
+    invoice_ids = {row['clientref']: row['invoiceid'] for row in response.data or []}
+    invoice_ids.update(_claimed_ids([ref for ref, _ in entries if ref not in invoice_ids]))
 
-        invoice = invoice_response.data[0]
+    detail_rows = [{'invoiceid': invoice_ids[ref], **item}
+                   for ref, payload in entries if ref in invoice_ids
+                   for item in payload['services']]
+    for i in range(0, len(detail_rows), BULK_INSERT_CHUNK):
+        with resilience.guard():
+            supabase.table('invoicedetails').upsert(
+                detail_rows[i:i + BULK_INSERT_CHUNK], on_conflict='invoiceid,serviceid', ignore_duplicates=True
+            ).execute()
 
-        # Get the services for this invoice
-        services_response = supabase.table('invoicedetails').select('''
-            *,
-            services!inner(*)
-        ''').eq('invoiceid', invoice_id).execute()
-
-        if services_response.data:
-            invoice['services'] = [{
-                'name': s['services']['servicename'],
-                'unit_price': s['services']['unitprice'],
-                'quantity': s['quantity'],
-                'total': s['totalprice']
-            } for s in services_response.data]
-        else:
-            invoice['services'] = []
+    saved = [(invoice_ids[ref], payload['customer_id']) for ref, payload in entries if ref in invoice_ids]
+    invalidate_rows('invoices', [{'invoiceid': invoice_id, 'customerid': customer_id} for invoice_id, customer_id in saved])
+    invalidate_rows('invoicedetails', [{'invoiceid': invoice_id} for invoice_id, _ in saved])
+    analytics.mark_stale()
+    return invoice_ids
+
+@cached('invoices', 'invoicedetails', 'customers', 'services', key_column='invoiceid')
+def _load_invoice_details(invoice_id):
+    # Get the invoice details including customer information
+    invoice_response = supabase.table('invoices').select('''
+        *,
+        customers!inner(*)
+    ''').eq('invoiceid', invoice_id).execute()
+
+    if not invoice_response.data:
+        return None
 
-        return invoice
+    invoice = Invoice.from_row(invoice_response.data[0])
 
+    # Get the services for this invoice
+    services_response = supabase.table('invoicedetails').select('''
+        *,
+        services!inner(*)
+    ''').eq('invoiceid', invoice_id).execute()
+    invoice.items = LineItem.from_rows(services_response.data)
+
+    return invoice
+
+def get_invoice_details(invoice_id):
+    try:
+        return _load_invoice_details(invoice_id)
     except Exception as e:
         st.error(f"Error fetching invoice details: {str(e)}")
         return None
 
 def check_duplicate_invoice(customer_id, date):
     try:
+        # Invoices queued while Supabase is unreachable count too
+        if any(p['customer_id'] == customer_id and p['date'] == date for p in outbox.pending_payloads('invoice')):
+            return True
         # Check if an invoice already exists for this customer on the same date
-        response = supabase.table('invoices').select('invoiceid').eq('customerid', customer_id).eq('invoicedate', date).execute()
+        with resilience.guard():
+            response = supabase.table('invoices').select('invoiceid').eq('customerid', customer_id).eq('invoicedate', date).execute()
         return len(response.data) > 0
     except Exception as e:
-        st.error(f"Error checking for duplicate invoice: {str(e)}")
+        # Unreachable: the invoice will be queued, and the check is up to the clerk
+        if not resilience.is_transient(e):
+            st.error(f"Error checking for duplicate invoice: {str(e)}")
         return False
 
 # ======================
-# PAYMENT FUNCTIONS
+# RECURRING INVOICE FUNCTIONS
 # ======================
-def get_payments():
-    """Get all payments from the database with related invoice and customer information"""
+TAX_RATE = 0.10  # 10% GST, split equally into CGST and SGST
+RECURRING_CADENCES = ["monthly", "quarterly", "yearly"]
+BULK_INSERT_CHUNK = 500  # rows per insert request
+
+def get_billing_period(cadence, run_date):
+    """Return the billing period key (e.g. 2025-04, 2025-Q2, 2025) that run_date falls in"""
+    if cadence == 'yearly':
+        return f"{run_date.year}"
+    if cadence == 'quarterly':
+        return f"{run_date.year}-Q{(run_date.month - 1) // 3 + 1}"
+    return run_date.strftime('%Y-%m')
+
+def get_recurring_templates(active_only=False):
+    """Get recurring invoice templates with their customer and service lines"""
     try:
-        print("Fetching payments...")
-        # Get payments with invoice and customer information using a single query
-        response = supabase.from_('payments').select('''
+        query = supabase.table('recurringinvoices').select('''
             *,
-            invoices!inner (
-                *,
-                customers!inner (
-                    customerid,
-                    customername
+            customers!inner (
+                customerid,
+                customername
+            ),
+            recurringinvoiceitems (
+                serviceid,
+                quantity,
+                services!inner (
+                    servicename,
+                    unitprice
                 )
             )
-        ''').order('paymentdate', desc=True).execute()
-        
-        print(f"Response data: {response.data}")
-        
-        if not response.data:
-            print("No payments found in database")
-            return []
-            
-        # Transform the nested data into the expected format
-        payments = []
-        for p in response.data:
-            payment = {
-                'paymentid': p['paymentid'],
-                'invoiceid': p['invoiceid'],
-                'paymentdate': p['paymentdate'],
-                'paymentmethod': p['paymentmethod'],
-                'amountpaid': p['amountpaid'],
-                'customerid': p['invoices']['customers']['customerid'],
-                'grandtotal': p['invoices']['grandtotal'],
-                'customername': p['invoices']['customers']['customername']
-            }
-            payments.append(payment)
-            print(f"Processed payment: {payment}")
+        ''')
+        if active_only:
+            query = query.eq('active', True)
+        response = query.order('templateid').execute()
+        return response.data if response.data else []
+    except Exception as e:
+        st.error(f"Error fetching recurring templates: {str(e)}")
+        return []
+
+def add_recurring_template(template_data):
+    """Create a recurring invoice template and its service lines"""
+    try:
+        template_response = supabase.table('recurringinvoices').insert({
+            'customerid': template_data['customer_id'],
+            'cadence': template_data['cadence'],
+            'active': True
+        }).execute()
+
+        if not template_response.data:
+            raise Exception("Failed to create recurring template")
+
+        template_id = template_response.data[0]['templateid']
+
+        # All service lines go in with a single insert
+        items_response = supabase.table('recurringinvoiceitems').insert([{
+            'templateid': template_id,
+            'serviceid': item['service_id'],
+            'quantity': item['quantity']
+        } for item in template_data['services']]).execute()
+
+        if not items_response.data:
+            supabase.table('recurringinvoices').delete().eq('templateid', template_id).execute()
+            raise Exception("Failed to add template services")
+
+        return template_id
+    except Exception as e:
+        st.error(f"Error creating recurring template: {str(e)}")
+        return None
+
+def set_recurring_template_active(template_id, active):
+    try:
+        response = supabase.table('recurringinvoices').update({
+            'active': active
+        }).eq('templateid', template_id).execute()
+        return bool(response.data)
+    except Exception as e:
+        st.error(f"Error updating recurring template: {str(e)}")
+        return False
+
+def generate_recurring_invoices(run_date):
+    """Create the invoices of every active template for the period run_date falls in.
+
+    Invoices are inserted in bulk and each (templateid, billingperiod) is
+    claimed in recurringinvoiceperiods, so running the batch again for the
+    same period creates nothing new.
+    """
+    result = {'created': 0, 'skipped': 0, 'invoice_ids': []}
+    try:
+        templates = get_recurring_templates(active_only=True)
+        templates = [t for t in templates if t.get('recurringinvoiceitems')]
+        if not templates:
+            return result
+
+        periods = {t['templateid']: get_billing_period(t['cadence'], run_date) for t in templates}
+
+        # One lookup for everything already generated in the periods being billed
+        existing_response = supabase.table('recurringinvoiceperiods').select(
+            'templateid, billingperiod'
+        ).in_('billingperiod', sorted(set(periods.values()))).execute()
+        already_billed = {(row['templateid'], row['billingperiod']) for row in existing_response.data or []}
+
+        invoice_rows = []
+        lines_by_template = {}
+        for template in templates:
+            template_id = template['templateid']
+            if (template_id, periods[template_id]) in already_billed:
+                result['skipped'] += 1
+                continue
+
+            lines = [{
+                'serviceid': item['serviceid'],
+                'quantity': item['quantity'],
+                'totalprice': float(item['services']['unitprice']) * item['quantity']
+            } for item in template['recurringinvoiceitems']]
+            subtotal = sum(line['totalprice'] for line in lines)
+            tax_amount = subtotal * TAX_RATE
+
+            lines_by_template[template_id] = lines
+            invoice_rows.append({
+                'customerid': template['customerid'],
+                'invoicedate': run_date.strftime('%Y-%m-%d'),
+                'totalamount': subtotal,
+                'taxamount': tax_amount,
+                'grandtotal': subtotal + tax_amount,
+                'status': 'Unpaid',
+                'templateid': template_id,
+                'billingperiod': periods[template_id]
+            })
+
+        # Bulk insert the invoices. Rows for a period a concurrent run already
+        # billed are dropped by the claim_recurring_period trigger and don't come back.
+        # Like create_invoices, writes fail straight away while Supabase is down.
+        created = []
+        for i in range(0, len(invoice_rows), BULK_INSERT_CHUNK):
+            with resilience.guard():
+                response = supabase.table('invoices').insert(invoice_rows[i:i + BULK_INSERT_CHUNK]).execute()
+            created.extend(response.data or [])
+
+        detail_rows = [
+            {'invoiceid': inv['invoiceid'], **line}
+            for inv in created
+            for line in lines_by_template[inv['templateid']]
+        ]
+        try:
+            for i in range(0, len(detail_rows), BULK_INSERT_CHUNK):
+                with resilience.guard():
+                    supabase.table('invoicedetails').insert(detail_rows[i:i + BULK_INSERT_CHUNK]).execute()
+        except Exception:
+            # Don't leave invoices without line items behind; the next run recreates them
+            created_ids = [inv['invoiceid'] for inv in created]
+            supabase.table('invoicedetails').delete().in_('invoiceid', created_ids).execute()
+            supabase.table('recurringinvoiceperiods').delete().in_('invoiceid', created_ids).execute()
+            supabase.table('invoices').delete().in_('invoiceid', created_ids).execute()
+            raise
+
+        if created:
+            invalidate_rows('invoices', [{'invoiceid': inv['invoiceid'], 'customerid': inv['customerid']} for inv in created])
+            invalidate_rows('invoicedetails', [{'invoiceid': inv['invoiceid']} for inv in created])
+            analytics.mark_stale()
+        result['created'] = len(created)
+        result['skipped'] += len(invoice_rows) - len(created)
+        result['invoice_ids'] = [inv['invoiceid'] for inv in created]
+        return result
+    except Exception as e:
+        st.error(f"Error generating recurring invoices: {str(e)}")
+        return result
+
+# ======================
+# PAYMENT FUNCTIONS
+# ======================
+OPEN_INVOICE_STATUSES = ['Unpaid', 'Partially Paid']
+
+@cached('payments', 'invoices', 'customers')
+def _load_payments():
+    # Get payments with invoice and customer information using a single query
+    response = supabase.from_('payments').select('''
+        *,
+        invoices!inner (
+            *,
+            customers!inner (
+                customerid,
+                customername
+            )
+        )
+    ''').order('paymentdate', desc=True).execute()
+    
+    if not response.data:
+        return []
         
-        return payments
+    # Flatten the nested invoice and customer into Payment records
+    return Payment.from_rows(response.data)
+
+def get_payments():
+    """Get all payments from the database with related invoice and customer information"""
+    try:
+        return _load_payments()
     except Exception as e:
         print(f"Error in get_payments: {str(e)}")
         st.error(f"Error fetching payments: {str(e)}")
         return []
 
 def log_payment(payment_data):
-    """Log a new payment in the database and update invoice status"""
-    try:
-        print(f"Logging payment: {payment_data}")
-        # Insert payment record
-        response = supabase.from_('payments').insert({
-            'invoiceid': payment_data['invoice_id'],
-            'paymentdate': payment_data['date'],
-            'paymentmethod': payment_data['method'],
-            'amountpaid': payment_data['amount']
-        }).execute()
+    """Log a new payment in the database.
 
-        print(f"Payment insert response: {response.data}")
-        if response.data:
-            payment_id = response.data[0]['paymentid']
-            
-            # Update invoice status to 'Paid'
-            update_response = supabase.from_('invoices').update({
-                'status': 'Paid'
-            }).eq('invoiceid', payment_data['invoice_id']).execute()
-            print(f"Invoice update response: {update_response.data}")
-            
-            return payment_id
-        return None
+    The payments trigger adds the amount to the invoice's amountpaid and
+    derives its status (Unpaid, Partially Paid or Paid) in the same transaction.
+    While Supabase can't be reached the payment is queued, as in create_invoice.
+    """
+    payment_data = {**payment_data, 'client_ref': outbox.new_ref()}
+    try:
+        if resilience.breaker.is_open() or outbox.has_pending('payment'):
+            return outbox.enqueue('payment', payment_data['client_ref'], payment_data)
+        return log_payments([payment_data])[0]
     except Exception as e:
+        if resilience.is_transient(e):
+            try:
+                return outbox.enqueue('payment', payment_data['client_ref'], payment_data)
+            except Exception as journal_error:
+                e = journal_error
         print(f"Error in log_payment: {str(e)}")
         st.error(f"Error logging payment: {str(e)}")
         return None
 
+def _payment_row(payment_data):
+    return {
+        'invoiceid': payment_data['invoice_id'],
+        'paymentdate': payment_data['date'],
+        'paymentmethod': payment_data['method'],
+        'amountpaid': payment_data['amount'],
+        'clientref': payment_data.get('client_ref')
+    }
+
+def log_payments(payment_list):
+    """Insert payments in bulk and return their ids, in order. Raises on failure.
+
+    Each entry is shaped like log_payment's payment_data. The whole list goes
+    in as one statement, so it is recorded, and its invoices settled, all or
+    nothing: a failed batch leaves nothing behind for a retry to duplicate.
+    """
+    if not payment_list:
+        return []
+
+    payment_rows = [_payment_row(payment_data) for payment_data in payment_list]
+
+    payment_ids = []
+    try:
+        # Not retried: a payment that timed out may still have been recorded
+        with resilience.guard():
+            response = supabase.from_('payments').insert(payment_rows).execute()
+        if len(response.data or []) != len(payment_rows):
+            raise Exception("Failed to record payments")
+        payment_ids = [p['paymentid'] for p in response.data]
+    finally:
+        if payment_ids:
+            # The trigger changed the invoices' balance and status too
+            invalidate_rows('payments', [{'paymentid': payment_id, 'invoiceid': row['invoiceid']}
+                                         for payment_id, row in zip(payment_ids, payment_rows)])
+            invalidate_rows('invoices', [{'invoiceid': row['invoiceid']} for row in payment_rows])
+            analytics.mark_stale()
+    return payment_ids
+
+def _replay_payments(entries):
+    """Save queued payments and return {client_ref: paymentid}; safe to run again, as _replay_invoices"""
+    with resilience.guard():
+        response = supabase.from_('payments').insert([_payment_row(payload) for _, payload in entries]).execute()
+    payment_ids = {row['clientref']: row['paymentid'] for row in response.data or []}
+    payment_ids.update(_claimed_ids([ref for ref, _ in entries if ref not in payment_ids]))
+
+    saved = [(payment_ids[ref], payload['invoice_id']) for ref, payload in entries if ref in payment_ids]
+    invalidate_rows('payments', [{'paymentid': payment_id, 'invoiceid': invoice_id} for payment_id, invoice_id in saved])
+    invalidate_rows('invoices', [{'invoiceid': invoice_id} for _, invoice_id in saved])
+    analytics.mark_stale()
+    return payment_ids
+
+outbox.register('invoice', _replay_invoices)
+outbox.register('payment', _replay_payments)
+
+@cached('invoices', 'customers', key_column='customerid')
+def _load_unpaid_invoices(customer_id):
+    query = supabase.table('invoices').select(
+        '*', 
+        count='exact'
+    ).in_('status', OPEN_INVOICE_STATUSES)
+    
+    if customer_id:
+        query = query.eq('customerid', customer_id)
+        
+    response = query.execute()
+    
+    if response.data:
+        # Get customer details for each invoice
+        customer_response = supabase.table('customers').select('*').execute()
+        customers = {c['customerid']: c for c in customer_response.data}
+        
+        # Combine invoice data with customer data
+        for invoice in response.data:
+            invoice['customername'] = customers.get(invoice['customerid'], {}).get('customername', 'Unknown')
+        
+        return Invoice.from_rows(response.data)
+    return []
+
 def get_unpaid_invoices(customer_id=None):
-    """Get unpaid invoices, optionally filtered by customer"""
+    """Get invoices with an outstanding balance, optionally filtered by customer"""
     try:
-        query = supabase.table('invoices').select(
-            '*', 
-            count='exact'
-        ).eq('status', 'Unpaid')
-        
-        if customer_id:
-            query = query.eq('customerid', customer_id)
-            
-        response = query.execute()
-        
-        if response.data:
-            # Get customer details for each invoice
-            customer_response = supabase.table('customers').select('*').execute()
-            customers = {c['customerid']: c for c in customer_response.data}
-            
-            # Combine invoice data with customer data
-            for invoice in response.data:
-                invoice['customername'] = customers.get(invoice['customerid'], {}).get('customername', 'Unknown')
-            
-            return response.data
-        return []
+        return _load_unpaid_invoices(customer_id)
     except Exception as e:
         st.error(f"Error fetching unpaid invoices: {e}")
         return []
 
+# ======================
+# RECONCILIATION FUNCTIONS
+# ======================
+# Accepted header names for each statement field, lower-cased
+STATEMENT_COLUMNS = {
+    'date': ['date', 'txn date', 'transaction date', 'value date', 'paymentdate'],
+    'amount': ['amount', 'credit', 'credit amount', 'deposit', 'amountpaid'],
+    'reference': ['reference', 'ref', 'ref no', 'description', 'narration', 'remarks', 'utr'],
+    'payer': ['payer', 'name', 'customer', 'customername', 'from'],
+    'method': ['method', 'mode', 'paymentmethod']
+}
+INVOICE_REFERENCE_PATTERN = re.compile(r'(?:inv(?:oice)?|#)\s*[-:#]?\s*(\d+)', re.IGNORECASE)
+
+def _to_cents(amount):
+    return int(round(float(amount) * 100))
+
+def parse_statement_csv(file):
+    """Read a bank/UPI statement CSV into rows of date, amount, reference, payer and method"""
+    import pandas as pd
+    
+    df = pd.read_csv(file, dtype=str).fillna('')
+    headers = {c.strip().lower(): c for c in df.columns}
+    columns = {}
+    for field, names in STATEMENT_COLUMNS.items():
+        columns[field] = next((headers[n] for n in names if n in headers), None)
+    if not columns['date'] or not columns['amount']:
+        raise ValueError("Statement must have a date and an amount column")
+
+    rows = []
+    for i, record in enumerate(df.to_dict('records'), start=1):
+        raw_amount = record[columns['amount']].replace(',', '').replace('Rs.', '').strip()
+        if not raw_amount:
+            continue  # debit-only rows have no credit amount
+        rows.append({
+            'row': i,
+            'date': pd.to_datetime(record[columns['date']], dayfirst=True).strftime('%Y-%m-%d'),
+            'amount': float(raw_amount),
+            'reference': record[columns['reference']].strip() if columns['reference'] else '',
+            'payer': record[columns['payer']].strip() if columns['payer'] else '',
+            'method': (record[columns['method']].strip() if columns['method'] else '') or 'Online'
+        })
+    return rows
+
+def reconcile_statement(statement_rows, unpaid_invoices):
+    """Match statement rows to unpaid invoices by their outstanding balance.
+
+    Tries, in order: an invoice number in the reference with the same amount,
+    then a unique invoice for the payer's name and amount, then a unique
+    invoice for the amount alone. Each invoice is matched at most once.
+    Returns (matched, unmatched).
+    """
+    by_id = {inv.invoiceid: inv for inv in unpaid_invoices}
+    by_customer_amount = {}
+    by_amount = {}
+    for inv in unpaid_invoices:
+        cents = _to_cents(inv.balancedue)
+        name = inv.customername.strip().lower()
+        by_customer_amount.setdefault((name, cents), []).append(inv.invoiceid)
+        by_amount.setdefault(cents, []).append(inv.invoiceid)
+
+    used = set()
+    matched = []
+    unmatched = []
+
+    def pick(candidates):
+        remaining = [i for i in candidates if i not in used]
+        return remaining[0] if len(remaining) == 1 else None
+
+    for row in statement_rows:
+        cents = _to_cents(row['amount'])
+        invoice_id = None
+        match_type = None
+
+        for ref in INVOICE_REFERENCE_PATTERN.findall(row['reference']):
+            ref_id = int(ref)
+            if ref_id in by_id and ref_id not in used and _to_cents(by_id[ref_id].balancedue) == cents:
+                invoice_id, match_type = ref_id, 'reference'
+                break
+
+        if invoice_id is None and row['payer']:
+            invoice_id = pick(by_customer_amount.get((row['payer'].lower(), cents), []))
+            match_type = 'customer + amount'
+
+        if invoice_id is None:
+            invoice_id = pick(by_amount.get(cents, []))
+            match_type = 'amount'
+
+        if invoice_id is None:
+            unmatched.append(row)
+            continue
+
+        used.add(invoice_id)
+        matched.append({
+            **row,
+            'invoice_id': invoice_id,
+            'customername': by_id[invoice_id].customername,
+            'match_type': match_type
+        })
+
+    return matched, unmatched
+
+def post_reconciled_payments(matched):
+    """Insert all matched payments in bulk; the payments trigger settles their invoices"""
+    try:
+        return log_payments(matched)
+    except Exception as e:
+        print(f"Error in post_reconciled_payments: {str(e)}")
+        st.error(f"Error posting reconciled payments: {str(e)}")
+        return []
+
 # ======================
 # PDF GENERATION FUNCTIONS
 # ======================
-def generate_invoice_pdf(invoice_id, customer, invoice_data):
+def generate_invoice_pdf(invoice_id, customer, invoice, output_dir="temp_pdfs"):
     try:
+        from fpdf import FPDF
+        
         pdf = FPDF()
         pdf.add_page()
         
@@ -495,21 +938,21 @@ def generate_invoice_pdf(invoice_id, customer, invoice_data):
         
         # Date and Status
         pdf.set_font("Arial", size=10)
-        pdf.cell(90, 6, txt=f"Date: {invoice_data['invoicedate'].split('T')[0]}", ln=0)
-        pdf.cell(90, 6, txt=f"Status: {invoice_data['status'].upper()}", ln=1, align='R')
+        pdf.cell(90, 6, txt=f"Date: {invoice.invoicedate:%Y-%m-%d}", ln=0)
+        pdf.cell(90, 6, txt=f"Status: {invoice.status.upper()}", ln=1, align='R')
         
         # Bill To section
         pdf.ln(5)
         pdf.set_font("Arial", 'B', size=10)
         pdf.cell(180, 6, txt="Bill To:", ln=1)
         pdf.set_font("Arial", size=10)
-        pdf.cell(180, 6, txt=f"{customer['customername']}", ln=1)
-        if customer.get('email'):
-            pdf.cell(180, 6, txt=f"Email: {customer['email']}", ln=1)
-        if customer.get('phonenumber'):
-            pdf.cell(180, 6, txt=f"Phone: {customer['phonenumber']}", ln=1)
-        if customer.get('address'):
-            pdf.cell(180, 6, txt=f"Address: {customer['address']}", ln=1)
+        pdf.cell(180, 6, txt=f"{customer.customername}", ln=1)
+        if customer.email:
+            pdf.cell(180, 6, txt=f"Email: {customer.email}", ln=1)
+        if customer.phonenumber:
+            pdf.cell(180, 6, txt=f"Phone: {customer.phonenumber}", ln=1)
+        if customer.address:
+            pdf.cell(180, 6, txt=f"Address: {customer.address}", ln=1)
         
         # Services Table
         pdf.ln(5)
@@ -525,11 +968,11 @@ def generate_invoice_pdf(invoice_id, customer, invoice_data):
         
         # Table Contents
         pdf.set_font("Arial", size=10)
-        for service in invoice_data['services']:
-            pdf.cell(widths[0], 8, txt=service['name'], border=1)
-            pdf.cell(widths[1], 8, txt=f"Rs. {service['unit_price']:.2f}", border=1, align='R')
-            pdf.cell(widths[2], 8, txt=str(service['quantity']), border=1, align='C')
-            pdf.cell(widths[3], 8, txt=f"Rs. {service['total']:.2f}", border=1, align='R')
+        for item in invoice.items:
+            pdf.cell(widths[0], 8, txt=item.servicename, border=1)
+            pdf.cell(widths[1], 8, txt=f"Rs. {item.unitprice:.2f}", border=1, align='R')
+            pdf.cell(widths[2], 8, txt=str(item.quantity), border=1, align='C')
+            pdf.cell(widths[3], 8, txt=f"Rs. {item.totalprice:.2f}", border=1, align='R')
             pdf.ln()
         
         # Calculations section
@@ -541,7 +984,7 @@ def generate_invoice_pdf(invoice_id, customer, invoice_data):
         # Subtotal
         pdf.cell(align_position)
         pdf.cell(label_width, 6, txt="Subtotal:", align='L')
-        pdf.cell(amount_width, 6, txt=f"Rs. {invoice_data['totalamount']:.2f}", align='R', ln=1)
+        pdf.cell(amount_width, 6, txt=f"Rs. {invoice.totalamount:.2f}", align='R', ln=1)
         
         # Tax Breakdown Header
         pdf.cell(align_position)
@@ -552,18 +995,18 @@ def generate_invoice_pdf(invoice_id, customer, invoice_data):
         # CGST
         pdf.cell(align_position + 5)
         pdf.cell(label_width, 6, txt="CGST (5%):", align='L')
-        pdf.cell(amount_width - 5, 6, txt=f"Rs. {float(invoice_data['taxamount'])/2:.2f}", align='R', ln=1)
+        pdf.cell(amount_width - 5, 6, txt=f"Rs. {invoice.taxamount/2:.2f}", align='R', ln=1)
         
         # SGST
         pdf.cell(align_position + 5)
         pdf.cell(label_width, 6, txt="SGST (5%):", align='L')
-        pdf.cell(amount_width - 5, 6, txt=f"Rs. {float(invoice_data['taxamount'])/2:.2f}", align='R', ln=1)
+        pdf.cell(amount_width - 5, 6, txt=f"Rs. {invoice.taxamount/2:.2f}", align='R', ln=1)
         
         # Total Tax
         pdf.cell(align_position)
         pdf.set_font("Arial", 'B', size=10)
         pdf.cell(label_width, 6, txt="Total Tax:", align='L')
-        pdf.cell(amount_width, 6, txt=f"Rs. {float(invoice_data['taxamount']):.2f}", align='R', ln=1)
+        pdf.cell(amount_width, 6, txt=f"Rs. {invoice.taxamount:.2f}", align='R', ln=1)
         
         # Line before grand total
         pdf.ln(2)
@@ -574,7 +1017,7 @@ def generate_invoice_pdf(invoice_id, customer, invoice_data):
         pdf.set_font("Arial", 'B', size=10)
         pdf.cell(align_position)
         pdf.cell(label_width, 8, txt="Grand Total:", align='L')
-        pdf.cell(amount_width, 8, txt=f"Rs. {invoice_data['grandtotal']:.2f}", align='R', ln=1)
+        pdf.cell(amount_width, 8, txt=f"Rs. {invoice.grandtotal:.2f}", align='R', ln=1)
         
         # Terms and Conditions
         pdf.ln(20)
@@ -591,16 +1034,18 @@ def generate_invoice_pdf(invoice_id, customer, invoice_data):
         pdf.cell(180, 5, txt="Thank you for your business!", align='C', ln=1)
         
         # Save to file
-        os.makedirs("temp_pdfs", exist_ok=True)
-        pdf_path = f"temp_pdfs/invoice_{invoice_id}.pdf"
+        os.makedirs(output_dir, exist_ok=True)
+        pdf_path = os.path.join(output_dir, f"invoice_{invoice_id}.pdf")
         pdf.output(pdf_path)
         return pdf_path
     except Exception as e:
         st.error(f"Error generating PDF: {str(e)}")
         return None
 
-def generate_report_pdf(report_data):
+def generate_report_pdf(report_data, output_dir="temp_pdfs"):
     try:
+        from fpdf import FPDF
+        
         pdf = FPDF()
         pdf.add_page()
         
@@ -640,6 +1085,7 @@ def generate_report_pdf(report_data):
         
         # Revenue breakdown
         pdf.cell(190, 6, txt=f"Total Revenue: Rs. {report_data['total_revenue']:,.2f}", ln=1)
+        pdf.cell(190, 6, txt=f"Outstanding Balance: Rs. {report_data.get('total_outstanding', 0):,.2f}", ln=1)
         pdf.cell(190, 6, txt=f"Total Tax (GST): Rs. {total_tax:,.2f}", ln=1)
         pdf.cell(190, 6, txt=f"   - CGST (5%): Rs. {cgst:,.2f}", ln=1)
         pdf.cell(190, 6, txt=f"   - SGST (5%): Rs. {sgst:,.2f}", ln=1)
@@ -713,8 +1159,8 @@ def generate_report_pdf(report_data):
         pdf.cell(190, 5, txt="Generated by Pet Care Services", align='C', ln=1)
         
         # Save to file
-        os.makedirs("temp_pdfs", exist_ok=True)
-        pdf_path = f"temp_pdfs/report_{report_data['start_date']}_to_{report_data['end_date']}.pdf"
+        os.makedirs(output_dir, exist_ok=True)
+        pdf_path = os.path.join(output_dir, f"report_{report_data['start_date']}_to_{report_data['end_date']}.pdf")
         pdf.output(pdf_path)
         return pdf_path
     except Exception as e:
@@ -725,177 +1171,262 @@ def generate_report_pdf(report_data):
 # ======================
 # REPORT FUNCTIONS
 # ======================
-def get_report_data(start_date, end_date):
-    """Get report data from database for the specified date range"""
-    try:
-        # Get invoices for the date range
-        invoices_response = supabase.from_('invoices').select('''
-            *,
+# Revenue periods -> pandas period frequency for the PostgREST fallback
+REVENUE_PERIODS = {'day': 'D', 'week': 'W-SUN', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+# Report aggregates can come from the analytics snapshot, which lags the tables
+# by up to its refresh interval; cached copies are kept no longer than that
+@cached('invoices', 'invoicedetails', 'payments', 'customers', 'services', ttl=analytics.REFRESH_SECONDS)
+def _load_report_data(start_date, end_date, archive_version):
+    # Answered from the local columnar snapshot when DuckDB is available
+    if analytics.enabled():
+        return analytics.get_report_data(start_date, end_date)
+    
+    # Get invoices for the date range
+    invoices_response = supabase.from_('invoices').select('''
+        *,
+        customers (
+            customerid,
+            customername
+        )
+    ''').gte('invoicedate', start_date).lte('invoicedate', end_date).execute()
+    
+    # Get payments for the date range
+    payments_response = supabase.from_('payments').select('''
+        *,
+        invoices!inner (
+            customerid,
             customers (
-                customerid,
                 customername
             )
-        ''').gte('invoicedate', start_date).lte('invoicedate', end_date).execute()
-        
-        # Get payments for the date range
-        payments_response = supabase.from_('payments').select('''
-            *,
-            invoices!inner (
-                customerid,
-                customers (
-                    customername
-                )
-            )
-        ''').gte('paymentdate', start_date).lte('paymentdate', end_date).execute()
-        
-        # Get service performance using direct query instead of stored procedure
-        service_performance = get_service_performance(start_date, end_date)
-        
-        # Calculate total revenue (from paid invoices)
-        total_revenue = sum(float(payment['amountpaid']) for payment in payments_response.data) if payments_response.data else 0
-        
-        # Process invoices data
-        invoices = []
-        if invoices_response.data:
-            for inv in invoices_response.data:
-                invoices.append({
-                    'invoiceid': inv['invoiceid'],
-                    'invoicedate': inv['invoicedate'].split('T')[0] if isinstance(inv['invoicedate'], str) else inv['invoicedate'].strftime('%Y-%m-%d'),
-                    'customername': inv['customers']['customername'],
-                    'grandtotal': float(inv['grandtotal']),
-                    'status': inv['status']
-                })
-        
-        # Process payments data
-        payments = []
-        if payments_response.data:
-            for payment in payments_response.data:
-                payments.append({
-                    'paymentid': payment['paymentid'],
-                    'invoiceid': payment['invoiceid'],
-                    'paymentdate': payment['paymentdate'].split('T')[0] if isinstance(payment['paymentdate'], str) else payment['paymentdate'].strftime('%Y-%m-%d'),
-                    'customername': payment['invoices']['customers']['customername'],
-                    'amountpaid': float(payment['amountpaid'])
-                })
-        
-        return {
-            'start_date': start_date,
-            'end_date': end_date,
-            'total_revenue': total_revenue,
-            'invoices': invoices,
-            'payments': payments,
-            'service_performance': service_performance
-        }
-        
+        )
+    ''').gte('paymentdate', start_date).lte('paymentdate', end_date).execute()
+    
+    # Get service performance using direct query instead of stored procedure
+    service_performance = _service_performance(start_date, end_date)
+    
+    invoice_rows = invoices_response.data or []
+    payment_rows = payments_response.data or []
+    
+    # Closed invoices older than the archive cutoff are read from Parquet
+    if archive_covers(start_date):
+        invoice_rows = invoice_rows + read_archived_invoices(start_date, end_date)
+        payment_rows = payment_rows + read_archived_payments(start_date, end_date)
+    
+    invoices = [{
+        'invoiceid': inv.invoiceid,
+        'invoicedate': inv.invoicedate.isoformat(),
+        'customername': inv.customername,
+        'grandtotal': inv.grandtotal,
+        'balancedue': inv.balancedue,
+        'status': inv.status
+    } for inv in Invoice.from_rows(invoice_rows)]
+    
+    payments = [{
+        'paymentid': payment.paymentid,
+        'invoiceid': payment.invoiceid,
+        'paymentdate': payment.paymentdate.isoformat(),
+        'customername': payment.customername,
+        'amountpaid': payment.amountpaid
+    } for payment in Payment.from_rows(payment_rows)]
+    
+    # Calculate total revenue (from paid invoices)
+    total_revenue = sum(payment['amountpaid'] for payment in payments)
+    
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_revenue': total_revenue,
+        'total_outstanding': sum(inv['balancedue'] for inv in invoices if inv['status'] in OPEN_INVOICE_STATUSES),
+        'invoices': invoices,
+        'payments': payments,
+        'service_performance': service_performance
+    }
+
+def get_report_data(start_date, end_date):
+    """Get report data from database for the specified date range"""
+    try:
+        return _load_report_data(start_date, end_date, get_archive_version())
     except Exception as e:
         print(f"Error generating report: {str(e)}")
         st.error(f"Error generating report: {str(e)}")
         return None
 
-def get_service_performance(start_date, end_date):
-    """Get service performance metrics for the specified date range"""
-    try:
-        # Get all services with their usage and revenue in the date range
-        query = supabase.from_('services').select('''
+def _service_performance(start_date, end_date):
+    # Answered from the local columnar snapshot when DuckDB is available
+    if analytics.enabled():
+        return analytics.get_service_performance(start_date, end_date)
+    
+    # Get all services with their usage and revenue in the date range
+    query = supabase.from_('services').select('''
+        serviceid,
+        servicename,
+        invoicedetails!left (
             serviceid,
-            servicename,
-            invoicedetails!left (
-                serviceid,
-                totalprice,
-                invoices!inner (
-                    invoicedate
-                )
+            totalprice,
+            invoices!inner (
+                invoicedate
             )
-        ''').execute()
-        
-        if not query.data:
-            return []
-        
-        # Process service performance data
-        service_performance = {}
-        for service in query.data:
-            service_id = service['serviceid']
-            if service_id not in service_performance:
-                service_performance[service_id] = {
-                    'serviceid': service_id,
-                    'servicename': service['servicename'],
+        )
+    ''').execute()
+    
+    if not query.data:
+        return []
+    
+    # Process service performance data
+    service_performance = {}
+    for service in query.data:
+        service_id = service['serviceid']
+        if service_id not in service_performance:
+            service_performance[service_id] = {
+                'serviceid': service_id,
+                'servicename': service['servicename'],
+                'usage_count': 0,
+                'total_revenue': 0
+            }
+        
+        # Calculate usage and revenue for services within date range
+        if service.get('invoicedetails'):
+            for detail in service['invoicedetails']:
+                if detail.get('invoices') and detail['invoices'].get('invoicedate'):
+                    invoice_date = detail['invoices']['invoicedate'].split('T')[0]
+                    if start_date <= invoice_date <= end_date:
+                        service_performance[service_id]['usage_count'] += 1
+                        service_performance[service_id]['total_revenue'] += float(detail['totalprice'])
+    
+    if archive_covers(start_date):
+        for detail in read_archived_invoice_details(start_date, end_date):
+            if detail['serviceid'] not in service_performance:
+                service_performance[detail['serviceid']] = {
+                    'serviceid': detail['serviceid'],
+                    'servicename': detail['servicename'],
                     'usage_count': 0,
                     'total_revenue': 0
                 }
-            
-            # Calculate usage and revenue for services within date range
-            if service.get('invoicedetails'):
-                for detail in service['invoicedetails']:
-                    if detail.get('invoices') and detail['invoices'].get('invoicedate'):
-                        invoice_date = detail['invoices']['invoicedate'].split('T')[0]
-                        if start_date <= invoice_date <= end_date:
-                            service_performance[service_id]['usage_count'] += 1
-                            service_performance[service_id]['total_revenue'] += float(detail['totalprice'])
-        
-        # Convert to list and sort by revenue
-        result = list(service_performance.values())
-        result.sort(key=lambda x: x['total_revenue'], reverse=True)
-        return result
-        
+            service_performance[detail['serviceid']]['usage_count'] += 1
+            service_performance[detail['serviceid']]['total_revenue'] += detail['totalprice']
+    
+    # Convert to list and sort by revenue
+    result = list(service_performance.values())
+    result.sort(key=lambda x: x['total_revenue'], reverse=True)
+    return result
+
+def get_service_performance(start_date, end_date):
+    """Get service performance metrics for the specified date range"""
+    try:
+        return _service_performance(start_date, end_date)
     except Exception as e:
         print(f"Error getting service performance: {str(e)}")
         st.error(f"Error getting service performance: {str(e)}")
         return []
 
-def get_revenue_by_period(period_type, start_date, end_date):
-    """Get revenue data grouped by the specified period (day, week, month)"""
+def _revenue_by_period(period_type, start_date, end_date, group_by=None, filters=None):
+    # Answered from the local columnar snapshot when DuckDB is available
+    if analytics.enabled():
+        return analytics.get_revenue_by_period(period_type, start_date, end_date, group_by, filters)
+    
+    # Get all payments in the date range
+    payments_response = supabase.from_('payments').select('paymentdate, amountpaid').gte('paymentdate', start_date).lte('paymentdate', end_date).execute()
+    
+    if not payments_response.data:
+        return []
+    
+    # Bucket all payments at once; weekly periods start on Monday
+    import pandas as pd
+    df = pd.DataFrame(payments_response.data)
+    dates = pd.to_datetime(df['paymentdate'].str[:10])
+    df['period_start'] = dates.dt.to_period(REVENUE_PERIODS[period_type]).dt.start_time.dt.strftime('%Y-%m-%d')
+    revenue = df.groupby('period_start')['amountpaid'].sum().rename('total_revenue')
+    return revenue.reset_index().to_dict('records')
+
+def get_revenue_by_period(period_type, start_date, end_date, group_by=None, filters=None):
+    """Get revenue data grouped by the specified period (day, week, month, quarter, year).
+
+    With the DuckDB snapshot this is a rollup of its revenue cube, which can also
+    split each period by service, payment method or customer segment (group_by)
+    and filter on them (filters, dimension -> values); see get_revenue_dimensions.
+    """
     try:
-        # Get all payments in the date range
-        payments_response = supabase.from_('payments').select('*').gte('paymentdate', start_date).lte('paymentdate', end_date).execute()
-        
-        if not payments_response.data:
-            return []
-            
-        # Process payments into periods
-        revenue_by_period = {}
-        for payment in payments_response.data:
-            payment_date = payment['paymentdate'].split('T')[0]
-            
-            # Determine period start date based on period_type
-            if period_type == 'day':
-                period_start = payment_date
-            elif period_type == 'week':
-                # Convert to datetime for week calculation
-                dt = datetime.strptime(payment_date, '%Y-%m-%d')
-                period_start = (dt - timedelta(days=dt.weekday())).strftime('%Y-%m-%d')
-            else:  # month
-                period_start = payment_date[:7] + '-01'
-            
-            if period_start not in revenue_by_period:
-                revenue_by_period[period_start] = 0
-            revenue_by_period[period_start] += float(payment['amountpaid'])
-        
-        # Convert to list of dictionaries
-        return [
-            {
-                'period_start': period_start,
-                'total_revenue': total_revenue
-            }
-            for period_start, total_revenue in sorted(revenue_by_period.items())
-        ]
-        
+        return _revenue_by_period(period_type, start_date, end_date, group_by, filters)
     except Exception as e:
         print(f"Error getting revenue data: {str(e)}")
         st.error(f"Error getting revenue data: {str(e)}")
         return []
 
-# Initialize sample data if empty
-if not customers_db:
-    add_customer({
-        'name': 'Sample Customer',
-        'email': 'sample@email.com',
-        'phone': '123-456-7890',
-        'address': '123 Main St'
-    })
-
-if not services_db:
-    add_service({
-        'name': 'Dog Grooming',
-        'description': 'Full service grooming including bath, haircut, and nail trimming',
-        'unit_price': 50.00
-    })
\ No newline at end of file
+def get_revenue_dimensions():
+    """Values of each revenue breakdown (service, method, segment), or {} without the snapshot"""
+    if not analytics.enabled():
+        return {}
+    try:
+        return {dimension: analytics.get_cube_members(dimension) for dimension in analytics.CUBE_DIMENSIONS}
+    except Exception as e:
+        print(f"Error getting revenue dimensions: {str(e)}")
+        return {}
+
+def get_customer_segments(as_of):
+    """RFM scores, segment and lifetime value per customer as a DataFrame, best first.
+
+    Computed over the DuckDB snapshot (see analytics.get_customer_rfm), which
+    picks up new invoices and payments shortly after they are written. Returns
+    None without the snapshot.
+    """
+    if not analytics.enabled():
+        return None
+    try:
+        return analytics.get_customer_rfm(as_of)
+    except Exception as e:
+        print(f"Error getting customer segments: {str(e)}")
+        st.error(f"Error getting customer segments: {str(e)}")
+        return None
+
+# ======================
+# RECEIVABLES FUNCTIONS
+# ======================
+@cached('invoices', 'payments', 'customers')
+def _load_ar_aging(as_of):
+    response = supabase.rpc('ar_aging', {'as_of': as_of}).execute()
+    return response.data if response.data else []
+
+def get_ar_aging(as_of):
+    """Get receivables per customer in 0-30/31-60/61-90/90+ day buckets as of a date"""
+    try:
+        return _load_ar_aging(as_of)
+    except Exception as e:
+        print(f"Error getting aging report: {str(e)}")
+        st.error(f"Error getting aging report: {str(e)}")
+        return []
+
+def get_ar_aging_detail(customer_id, as_of):
+    """Get the open invoices behind one customer's aging row"""
+    try:
+        response = supabase.rpc('ar_aging_detail', {
+            'p_customerid': customer_id,
+            'as_of': as_of
+        }).execute()
+        return response.data if response.data else []
+    except Exception as e:
+        print(f"Error getting aging detail: {str(e)}")
+        st.error(f"Error getting aging detail: {str(e)}")
+        return []
+
+def seed_sample_data():
+    """Add a sample customer and service to a database that has none"""
+    if not supabase.table('customers').select('customerid').limit(1).execute().data:
+        add_customer({
+            'name': 'Sample Customer',
+            'email': 'sample@email.com',
+            'phone': '123-456-7890',
+            'address': '123 Main St'
+        })
+
+    if not supabase.table('services').select('serviceid').limit(1).execute().data:
+        add_service({
+            'name': 'Dog Grooming',
+            'description': 'Full service grooming including bath, haircut, and nail trimming',
+            'unit_price': 50.00
+        })
+
+# Run directly to seed an empty database; importing utils (the app, api.py,
+# batch.py, outbox.py --flush) must not write
+if __name__ == "__main__":
+    seed_sample_data()